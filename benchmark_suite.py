@@ -0,0 +1,348 @@
+"""Benchmark the pipeline on synthetic graph families of controlled size and clustering.
+Each stage (p-motif detection, analysis data creation, report creation) runs in its own process,
+whose runtime and peak memory are recorded as telemetry and plotted as scaling curves
+against nodes, edges, average clustering coefficient and graphlet size."""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from itertools import product
+from pathlib import Path
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+import networkx as nx
+from matplotlib import pyplot as plt
+from scipy.stats import spearmanr
+
+from pmotif_cml_interface import add_workers_arg
+from telemetry import TELEMETRY_SUFFIX, Telemetry, describe, load_records
+from util import validate_edgelist
+
+REPO = Path(__file__).parent
+
+GRAPH_RECORD = "suite_graph"
+STAGE_RECORD = "suite_stage"
+SUMMARY_NAME = "benchmark_suite_summary.json"
+
+STAGES = ["detection", "analysis", "report"]
+MEASUREMENTS = ["wall_s", "peak_rss_mb"]
+PREDICTORS = ["nodes", "edges", "average_clustering"]
+
+
+class SyntheticGraph(NamedTuple):
+    """A synthetic graph of a family, generated with the given parameters."""
+    family: str
+    nodes: int
+    average_degree: int
+    triangle_probability: Optional[float]
+    seed: int
+
+    @property
+    def name(self) -> str:
+        name = f"{self.family}_n{self.nodes}_d{self.average_degree}"
+        if self.triangle_probability is not None:
+            name += f"_p{self.triangle_probability}"
+        return f"{name}_s{self.seed}"
+
+
+def scale_free_graph(nodes: int, average_degree: int, seed: int) -> nx.Graph:
+    """Simple, undirected version of the directed scale-free graph model (Bollobás et al.).
+    Its average degree follows from the model and is not controlled."""
+    graph = nx.Graph(nx.scale_free_graph(nodes, seed=seed))
+    graph.remove_edges_from(nx.selfloop_edges(graph))
+    return graph
+
+
+FAMILIES: Dict[str, Callable[..., nx.Graph]] = {
+    "barabasi_albert": lambda n, d, p, seed: nx.barabasi_albert_graph(n, max(1, d // 2), seed=seed),
+    "erdos_renyi": lambda n, d, p, seed: nx.gnm_random_graph(n, n * d // 2, seed=seed),
+    # Barabási–Albert with triad formation, `p` controls the clustering coefficient
+    "powerlaw_cluster": lambda n, d, p, seed: nx.powerlaw_cluster_graph(n, max(1, d // 2), p, seed=seed),
+    "scale_free": lambda n, d, p, seed: scale_free_graph(n, d, seed),
+}
+
+
+def synthetic_graphs(
+    families: List[str],
+    nodes: List[int],
+    average_degrees: List[int],
+    triangle_probabilities: List[float],
+    seed: int,
+) -> List[SyntheticGraph]:
+    """Return the graphs of all parameter combinations. Only the powerlaw cluster family uses triangle probabilities."""
+    graphs = []
+    for family, n, d in product(families, nodes, average_degrees):
+        probabilities = triangle_probabilities if family == "powerlaw_cluster" else [None]
+        graphs.extend(SyntheticGraph(family, n, d, p, seed) for p in probabilities)
+    return graphs
+
+
+def write_graph(graph: SyntheticGraph, graphs_out: Path) -> Path:
+    """Generate the graph and write it as an edgelist, unless it already exists.
+    Nodes without edges are dropped and node ids are made consecutive, starting at 1, as gtrieScanner requires."""
+    edgelist = graphs_out / f"{graph.name}.edgelist"
+    if edgelist.is_file():
+        return edgelist
+
+    g = FAMILIES[graph.family](graph.nodes, graph.average_degree, graph.triangle_probability, graph.seed)
+    g.remove_nodes_from([node for node, degree in g.degree if degree == 0])
+    g = nx.convert_node_labels_to_integers(g, first_label=1)
+    tmp_path = edgelist.with_suffix(".tmp")
+    nx.write_edgelist(g, tmp_path, data=False)
+    os.replace(tmp_path, edgelist)
+    return edgelist
+
+
+def run_stage(command: List[str], log: Path) -> Dict[str, float]:
+    """Run a stage in its own process and return its exit code, wall time, CPU time
+    and the peak resident memory of it and its children (e.g. gtrieScanner or worker pools)."""
+    with open(log, "a", encoding="utf-8") as log_file:
+        start = time.perf_counter()
+        process = subprocess.Popen(command, cwd=REPO, stdout=log_file, stderr=subprocess.STDOUT)
+        _, status, rusage = os.wait4(process.pid, 0)
+        wall = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)  # Reaped by wait4 already
+    return {
+        "returncode": process.returncode,
+        "wall_s": wall,
+        "cpu_s": rusage.ru_utime + rusage.ru_stime,
+        "peak_rss_mb": rusage.ru_maxrss / 1024,  # ru_maxrss is reported in KB
+    }
+
+
+def stage_commands(edgelist: Path, graphlet_size: int, run_out: Path, random_graphs: int, workers: int, seed: int):
+    """Return the command of each pipeline stage, writing all output to `run_out`.
+    Random graphs are created from `seed`, so every repetition processes the same random graphs."""
+    experiment_out = run_out / "experiments"
+    analysis_out = run_out / "analysis"
+    common = ["--edgelist-path", str(edgelist), "--graphlet-size", str(graphlet_size), "--workers", str(workers)]
+    return {
+        "detection": [
+            sys.executable, "pmotif_detection.py", *common,
+            "--experiment-out", str(experiment_out), "--random-graphs", str(random_graphs),
+            "--random-seed", str(seed),
+        ],
+        "analysis": [
+            sys.executable, "create_analysis_data.py", *common,
+            "--experiment-out", str(experiment_out), "--analysis-out", str(analysis_out),
+        ],
+        "report": [
+            sys.executable, "-m", "report_creation.analyse_result", *common,
+            "--analysis-out", str(analysis_out), "--figure-formats", "png",
+        ],
+    }
+
+
+def run_suite(
+    suite_out: Path,
+    graphs: List[SyntheticGraph],
+    graphlet_sizes: List[int],
+    repetitions: int,
+    random_graphs: int,
+    workers: int,
+    keep_outputs: bool,
+):
+    """Run all stages on every graph and graphlet size, `repetitions` times.
+    Each repetition starts from scratch and writes its own telemetry file.
+    If a stage fails, its failure is recorded and the remaining stages of that run are skipped."""
+    graphs_out = suite_out / "graphs"
+    os.makedirs(graphs_out, exist_ok=True)
+    edgelists = {graph: write_graph(graph, graphs_out) for graph in graphs}
+
+    for repetition in range(1, repetitions + 1):
+        with Telemetry(suite_out / f"suite_{repetition}{TELEMETRY_SUFFIX}", repetition) as telemetry:
+            for graph, edgelist in edgelists.items():
+                stats = validate_edgelist(edgelist)
+                telemetry.record(
+                    GRAPH_RECORD,
+                    graph=graph.name,
+                    family=graph.family,
+                    average_degree=graph.average_degree,
+                    triangle_probability=graph.triangle_probability,
+                    seed=graph.seed,
+                    nodes=stats.node_count,
+                    edges=stats.edge_count,
+                    average_clustering=nx.average_clustering(nx.read_edgelist(edgelist)),
+                )
+                for graphlet_size in graphlet_sizes:
+                    run_out = suite_out / "runs" / graph.name / str(graphlet_size) / str(repetition)
+                    shutil.rmtree(run_out, ignore_errors=True)
+                    os.makedirs(run_out)
+                    commands = stage_commands(edgelist, graphlet_size, run_out, random_graphs, workers, graph.seed)
+                    for stage in STAGES:
+                        print(f"Repetition {repetition}: {stage} of {graph.name} (graphlet size {graphlet_size})")
+                        measurements = run_stage(commands[stage], run_out / f"{stage}.log")
+                        telemetry.record(
+                            STAGE_RECORD,
+                            graph=graph.name,
+                            graphlet_size=graphlet_size,
+                            stage=stage,
+                            workers=workers,
+                            random_graphs=random_graphs,
+                            **measurements,
+                        )
+                        if measurements["returncode"] != 0:
+                            print(f"{stage} failed, see {run_out / f'{stage}.log'}")
+                            break
+                    if not keep_outputs and measurements["returncode"] == 0:
+                        shutil.rmtree(run_out)
+
+
+def summarize_suite(suite_out: Path) -> Dict:
+    """Aggregate the telemetry of all repetitions to the median and IQR per graph, graphlet size and stage,
+    and rank correlate each measurement with each predictor per stage and graphlet size. Failed stages are left out."""
+    records = load_records(sorted(suite_out.glob(f"suite_*{TELEMETRY_SUFFIX}")))
+    graphs = {record["graph"]: record for record in records if record["record"] == GRAPH_RECORD}
+    measured = defaultdict(lambda: defaultdict(list))
+    for record in records:
+        if record["record"] == STAGE_RECORD and record["returncode"] == 0:
+            for measurement in MEASUREMENTS:
+                measured[(record["graph"], record["graphlet_size"], record["stage"])][measurement].append(
+                    record[measurement]
+                )
+
+    points = [
+        {
+            "graph": graph_name,
+            "family": graphs[graph_name]["family"],
+            "graphlet_size": graphlet_size,
+            "stage": stage,
+            **{predictor: graphs[graph_name][predictor] for predictor in PREDICTORS},
+            **{measurement: describe(values) for measurement, values in measurements.items()},
+        }
+        for (graph_name, graphlet_size, stage), measurements in sorted(measured.items())
+    ]
+
+    correlations = {}
+    for stage, graphlet_size in sorted({(p["stage"], p["graphlet_size"]) for p in points}):
+        selected = [p for p in points if p["stage"] == stage and p["graphlet_size"] == graphlet_size]
+        if len(selected) < 3:
+            continue
+        correlations[f"{stage}/{graphlet_size}"] = {
+            measurement: {
+                predictor: float(spearmanr(
+                    [p[predictor] for p in selected],
+                    [p[measurement]["median"] for p in selected],
+                ).statistic)
+                for predictor in PREDICTORS
+            }
+            for measurement in MEASUREMENTS
+        }
+    return {"points": points, "spearman_correlations": correlations}
+
+
+def plot_scaling_curves(summary: Dict, curves_out: Path):
+    """Plot each measurement against each predictor, a figure per stage.
+    Families are distinguished by color, graphlet sizes by marker."""
+    os.makedirs(curves_out, exist_ok=True)
+    families = sorted({p["family"] for p in summary["points"]})
+    colors = {family: f"C{i}" for i, family in enumerate(families)}
+    markers = {3: "o", 4: "s"}
+
+    for stage in STAGES:
+        points = [p for p in summary["points"] if p["stage"] == stage]
+        if len(points) == 0:
+            continue
+        fig, axes = plt.subplots(
+            len(MEASUREMENTS), len(PREDICTORS), figsize=(6 * len(PREDICTORS), 5 * len(MEASUREMENTS)), squeeze=False,
+        )
+        for (row, measurement), (column, predictor) in product(enumerate(MEASUREMENTS), enumerate(PREDICTORS)):
+            ax = axes[row][column]
+            for family, graphlet_size in sorted({(p["family"], p["graphlet_size"]) for p in points}):
+                selected = sorted(
+                    (p for p in points if p["family"] == family and p["graphlet_size"] == graphlet_size),
+                    key=lambda p: p[predictor],
+                )
+                ax.errorbar(
+                    [p[predictor] for p in selected],
+                    [p[measurement]["median"] for p in selected],
+                    yerr=[p[measurement]["iqr"] / 2 for p in selected],
+                    color=colors[family],
+                    marker=markers.get(graphlet_size, "^"),
+                    label=f"{family}, k={graphlet_size}",
+                )
+            if predictor != "average_clustering":
+                ax.set_xscale("log")
+            ax.set_yscale("log")
+            ax.set_xlabel(predictor)
+            ax.set_ylabel(measurement)
+        axes[0][0].legend(fontsize="small")
+        fig.suptitle(f"{stage} (median and IQR over repetitions)")
+        fig.tight_layout()
+        fig.savefig(curves_out / f"{stage}.png")
+        plt.close(fig)
+
+
+def main(
+    suite_out: Path,
+    graphs: List[SyntheticGraph],
+    graphlet_sizes: List[int],
+    repetitions: int,
+    random_graphs: int,
+    workers: int,
+    keep_outputs: bool = False,
+    summarize_only: bool = False,
+):
+    """Run the benchmark suite (unless `summarize_only`), then write the summary and the scaling curves."""
+    if not summarize_only:
+        run_suite(suite_out, graphs, graphlet_sizes, repetitions, random_graphs, workers, keep_outputs)
+
+    summary = summarize_suite(suite_out)
+    with open(suite_out / SUMMARY_NAME, "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=4)
+    plot_scaling_curves(summary, suite_out / "curves")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--suite-out",
+        required=True,
+        type=Path,
+        help="Path where the synthetic graphs, telemetry, summary and scaling curves will be saved.",
+    )
+    add_workers_arg(parser)
+    parser.add_argument("--families", nargs="+", choices=list(FAMILIES), default=list(FAMILIES))
+    parser.add_argument("--nodes", nargs="+", type=int, default=[250, 500, 1000, 2000])
+    parser.add_argument("--average-degrees", nargs="+", type=int, default=[4, 8])
+    parser.add_argument(
+        "--triangle-probabilities",
+        nargs="+",
+        type=float,
+        default=[0.1, 0.5, 0.9],
+        help="Probabilities of closing a triangle after each edge of the powerlaw cluster family, "
+             "which control its average clustering coefficient.",
+    )
+    parser.add_argument("--graphlet-sizes", nargs="+", type=int, choices=[3, 4], default=[3, 4])
+    parser.add_argument("--repetitions", type=int, default=3)
+    # z-scores of the report are only defined if the occurrence counts vary across random graphs
+    parser.add_argument("--random-graphs", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--keep-outputs",
+        action="store_true",
+        help="Keep the pipeline output of each run instead of removing it once measured. "
+             "Output of failed runs is always kept.",
+    )
+    parser.add_argument(
+        "--summarize-only",
+        action="store_true",
+        help="Only aggregate existing telemetry and plot the scaling curves.",
+    )
+
+    args = parser.parse_args()
+
+    main(
+        args.suite_out,
+        synthetic_graphs(args.families, args.nodes, args.average_degrees, args.triangle_probabilities, args.seed),
+        args.graphlet_sizes,
+        args.repetitions,
+        args.random_graphs,
+        args.workers,
+        keep_outputs=args.keep_outputs,
+        summarize_only=args.summarize_only,
+    )
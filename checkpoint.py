@@ -0,0 +1,125 @@
+"""Keep track of the completed stages of a p-motif detection, so that interrupted runs can be resumed."""
+import json
+import os
+import zipfile
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from pmotif_lib.p_motif_graph import PMotifGraph
+
+from report_creation.util import write_json_atomically
+
+MANIFEST_NAME = "manifest.json"
+GRAPHLET_STAGE = "graphlets"
+
+
+class GraphManifest:
+    """Per-graph and per-graphlet-size record of completed stages: the graphlet detection and each pMetric.
+    A stage is only recorded after its output was written completely. It counts as complete as long as
+    all of its output files are still present with the recorded sizes.
+
+    Output computed before manifests existed has no record. If `trust_unrecorded` is set, such output
+    is validated by its content and, if valid, recorded with the requested meta information.
+
+    The manifest of an original graph also records its random graph ensemble (see `record_ensemble`)."""
+
+    def __init__(self, pmotif_graph: PMotifGraph, graphlet_size: int, trust_unrecorded: bool = True):
+        self.pmotif_graph = pmotif_graph
+        self.graphlet_size = graphlet_size
+        self.trust_unrecorded = trust_unrecorded
+        self.path = pmotif_graph.get_graphlet_output_directory(graphlet_size) / MANIFEST_NAME
+
+        self._stages: Dict[str, Dict] = {}
+        self.peak_memory_gb: Optional[float] = None
+        self.ensemble: Optional[Dict[str, int]] = None
+        if self.path.is_file():
+            with open(self.path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            self._stages = manifest["stages"]
+            self.peak_memory_gb = manifest["peak_memory_gb"]
+            self.ensemble = manifest.get("ensemble")  # Missing in manifests of older versions
+
+    def is_complete(self, stage: str, **meta) -> bool:
+        """Whether `stage` finished with the given `meta` information and its output is still intact."""
+        if stage not in self._stages:
+            if not self.trust_unrecorded or not self._is_valid_unrecorded(stage):
+                return False
+            self.mark_complete(stage, **meta)
+
+        record = self._stages[stage]
+        if any(record.get(key) != value for key, value in meta.items()):
+            return False
+        output = self.pmotif_graph.get_graphlet_output_directory(self.graphlet_size)
+        return all(
+            (output / file).is_file() and (output / file).stat().st_size == size
+            for file, size in record["files"].items()
+        )
+
+    def mark_complete(self, stage: str, **meta):
+        """Record `stage` as complete, remembering the sizes of its output files."""
+        output = self.pmotif_graph.get_graphlet_output_directory(self.graphlet_size)
+        self._stages[stage] = {
+            **meta,
+            "files": {
+                str(file.relative_to(output)): file.stat().st_size
+                for file in self._stage_files(stage)
+            },
+        }
+        self._save()
+
+    def record_peak_memory(self, peak_memory_gb: float):
+        """Remember the memory needed to process the graph, to estimate the memory needed by similar graphs."""
+        self.peak_memory_gb = peak_memory_gb
+        self._save()
+
+    def record_ensemble(self, random_graphs: int, random_seed: int):
+        """Remember the requested number of random graphs and the seed they are created from,
+        so that missing random graphs can be detected and recreated."""
+        self.ensemble = {"random_graphs": random_graphs, "random_seed": random_seed}
+        self._save()
+
+    def reset(self):
+        """Forget all completed stages, e.g. because the graphlets they depend on are recomputed.
+        The random graph ensemble does not depend on them, and is kept."""
+        self._stages = {}
+        self.peak_memory_gb = None
+        if self.ensemble is not None:
+            self._save()
+        elif self.path.is_file():
+            os.remove(self.path)
+
+    def _save(self):
+        """Write the manifest to disk."""
+        write_json_atomically(
+            self.path,
+            {"stages": self._stages, "peak_memory_gb": self.peak_memory_gb, "ensemble": self.ensemble},
+            indent=4,
+        )
+
+    def _stage_files(self, stage: str) -> List[Path]:
+        """Return the output files written by `stage`."""
+        if stage == GRAPHLET_STAGE:
+            return [
+                self.pmotif_graph.get_graphlet_freq_file(self.graphlet_size),
+                self.pmotif_graph.get_graphlet_pos_zip(self.graphlet_size),
+            ]
+        metric_output = self.pmotif_graph.get_pmetric_directory(self.graphlet_size) / stage
+        return [Path(root) / file for root, _, files in os.walk(metric_output) for file in files]
+
+    def _is_valid_unrecorded(self, stage: str) -> bool:
+        """Validate output without a record by its content."""
+        try:
+            occurrence_count = sum(self.pmotif_graph.load_graphlet_freq_file(self.graphlet_size).values())
+        except (OSError, ValueError, IndexError):
+            return False
+
+        if stage == GRAPHLET_STAGE:
+            return zipfile.is_zipfile(self.pmotif_graph.get_graphlet_pos_zip(self.graphlet_size))
+
+        graphlet_metrics = self.pmotif_graph.get_pmetric_directory(self.graphlet_size) / stage / "graphlet_metrics"
+        if not graphlet_metrics.is_file():
+            return False
+        with open(graphlet_metrics, "rb") as f:
+            expected = int(f.readline().strip() or -1)
+            total = sum(1 for _ in f)
+        return expected == total == occurrence_count
@@ -2,25 +2,66 @@
 import argparse
 import json
 import os
+import shutil
 from multiprocessing import Pool
 from pathlib import Path
-from statistics import median
-from typing import Dict
-from scipy.stats import mannwhitneyu
+from math import ceil
+from typing import Dict, List, Union
 from tqdm import tqdm
 
+import numpy as np
 import pandas as pd
-from pmotif_lib.graphlet_representation import graphlet_classes_from_size, get_graphlet_size_from_class
+from pmotif_lib.graphlet_representation import graphlet_classes_from_size
 from pmotif_lib.p_metric.metric_consolidation import metrics
+from pmotif_lib.p_metric.p_metric_result import PMetricResult
 from pmotif_lib.p_motif_graph import PMotifGraphWithRandomization, PMotifGraph
 from pmotif_lib.result_transformer import ResultTransformer
 
+from fingerprint import FingerprintManifest, combine, consolidation_fingerprint, random_graph_keys
+from mann_whitney import RankedDistribution
+from occurrence_store import load_occurrence_store
 from pmotif_cml_interface import add_common_args, add_analysis_out_arg, add_workers_arg, add_experiment_out_arg
+from report_creation.columnar_storage import (
+    COLUMNAR_FORMAT, JSON_FORMAT, METRIC_DTYPE, STORAGE_FORMATS, write_class_arrays,
+)
+from streaming_result import StreamedResult, OccurrenceSpool, ColumnarOccurrenceSpool
 
 ORIGINAL_MISSING_GRAPHLET_CLASS = "ORIGINAL_MISSING_GRAPHLET_CLASS"
 RANDOM_MISSING_GRAPHLET_CLASS = "RANDOM_MISSING_GRAPHLET_CLASS"
 
 SUPRESS_TQDM = True
+RANDOM_GRAPH_BATCH_SIZE = 50
+
+
+def load_result(edgelist: Path, out: Path, graphlet_size: int) -> ResultTransformer:
+    """Load the graphlets and pMetrics of a graph like `ResultTransformer.load_result`, but take the graphlet
+    occurrences from the memory-mapped occurrence store of the graph instead of parsing the output of gtrieScanner."""
+    pmotif_graph = PMotifGraph(edgelist, out)
+    store = load_occurrence_store(pmotif_graph, graphlet_size)
+
+    pmetric_output_directory = pmotif_graph.get_pmetric_directory(graphlet_size)
+    p_metric_results = [
+        PMetricResult.load_from_disk(pmetric_output_directory / content, SUPRESS_TQDM)
+        for content in os.listdir(pmetric_output_directory)
+        if (pmetric_output_directory / content).is_dir()
+    ]
+
+    graphlet_classes, node_lists = [], []
+    for block_classes, block_nodes in store.iter_blocks():
+        graphlet_classes.extend(block_classes)
+        node_lists.extend(block_nodes)
+    positional_metric_df = pd.DataFrame({
+        "graphlet_class": graphlet_classes,
+        "nodes": node_lists,
+        **{metric_result.metric_name: metric_result.graphlet_metrics for metric_result in p_metric_results},
+    })
+
+    return ResultTransformer(
+        pmotif_graph=pmotif_graph,
+        positional_metric_df=positional_metric_df,
+        p_metric_results=p_metric_results,
+        graphlet_size=graphlet_size,
+    )
 
 
 def add_consolidated_metrics(result: ResultTransformer) -> ResultTransformer:
@@ -33,149 +74,293 @@ def add_consolidated_metrics(result: ResultTransformer) -> ResultTransformer:
     return result
 
 
-def extract_metric_distribution(df: pd.DataFrame, metric_name: str):
-    """Return the values of `metric_name` from the given `df` and groups them by graphlet classes."""
-    return dict(df.groupby("graphlet_class").agg(list)[metric_name])
-
+class DistributionIndex:
+    """The graphlet occurrences of a result grouped by graphlet class, with all of their (consolidated) metrics.
+    Built by a single groupby, and shared by the frequency, the metric distributions and the dumps of a result."""
 
-def to_graphlet_class_frequency(result_df: pd.DataFrame) -> Dict[str, int]:
-    graphlet_size = get_graphlet_size_from_class(result_df["graphlet_class"][0])
-    all_frequencies = dict.fromkeys(graphlet_classes_from_size(graphlet_size), 0)
-
-    r = {
-        **all_frequencies,
-        **dict(result_df.groupby("graphlet_class").agg("count")["nodes"]),
-    }
+    def __init__(self, r: ResultTransformer):
+        self.pmotif_graph = r.pmotif_graph
+        self.graphlet_size = r.graphlet_size
+        self.consolidated_metrics = r.consolidated_metrics
+        self.groups: Dict[str, pd.DataFrame] = dict(iter(r.positional_metric_df.groupby("graphlet_class")))
 
-    return dict(zip(r.keys(), map(int, r.values())))
-
-
-def single_pairwise_result(original: ResultTransformer, random: ResultTransformer, metric_name: str) -> Dict[str, Dict]:
-    """Perform a mann whitney u test and return its pvalue and uvalue"""
-    graphlet_classes = graphlet_classes_from_size(original.graphlet_size)
+    def frequency(self) -> Dict[str, int]:
+        """Return the occurrence count of each graphlet class, including classes without occurrences."""
+        return {
+            **dict.fromkeys(graphlet_classes_from_size(self.graphlet_size), 0),
+            **{graphlet_class: len(group) for graphlet_class, group in self.groups.items()},
+        }
 
-    original_distribution = extract_metric_distribution(
-        original.positional_metric_df, metric_name
-    )
+    def distribution(self, column: str) -> Dict[str, List]:
+        """Return the values of `column` grouped by graphlet classes."""
+        return {graphlet_class: group[column].tolist() for graphlet_class, group in self.groups.items()}
 
-    data = {}
-    for graphlet_class in graphlet_classes:
-        original_missing_class = graphlet_class not in original_distribution
-        if original_missing_class:
-            data[graphlet_class] = ORIGINAL_MISSING_GRAPHLET_CLASS
-            continue
+    def arrays(self, column: str, dtype) -> Dict[str, np.ndarray]:
+        """Return the values of `column` grouped by graphlet classes, as arrays of `dtype`."""
+        return {graphlet_class: group[column].to_numpy(dtype=dtype) for graphlet_class, group in self.groups.items()}
 
-        random_distribution = extract_metric_distribution(random.positional_metric_df, metric_name)
 
-        random_missing_class = graphlet_class not in random_distribution
-        if random_missing_class:
-            data[graphlet_class] = RANDOM_MISSING_GRAPHLET_CLASS
-            continue
+RankedDistributions = Dict[str, Dict[str, RankedDistribution]]
 
-        mwu_result = mannwhitneyu(
-            original_distribution[graphlet_class],
-            random_distribution[graphlet_class],
-        )
 
-        data[graphlet_class] = {
-            "u-statistic": mwu_result.statistic,
-            "p-value": mwu_result.pvalue,
-            "sample-size": len(random_distribution[graphlet_class]),
-            "sample-median": median(
-                random_distribution[graphlet_class]
-            ),
-            "original-size": len(original_distribution[graphlet_class]),
-            "original-median": median(
-                original_distribution[graphlet_class]
-            ),
+def rank_distributions(r: Union[DistributionIndex, StreamedResult]) -> RankedDistributions:
+    """Rank the distribution of each consolidated metric and graphlet class of a result,
+    returned as a lookup metric_name -> graphlet_class -> distribution."""
+    if isinstance(r, StreamedResult):
+        return {
+            metric_name: {
+                graphlet_class: RankedDistribution.from_value_counts(value_counts)
+                for graphlet_class, value_counts in r.distributions[metric_name].items()
+            }
+            for metric_name in r.consolidated_metrics
         }
-    return data
+    return {
+        metric_name: {
+            graphlet_class: RankedDistribution.from_values(values)
+            for graphlet_class, values in r.distribution(metric_name).items()
+        }
+        for metric_name in r.consolidated_metrics
+    }
 
 
-def process_random_graph(analysis_out: Path, original_r: ResultTransformer, random_graph: PMotifGraph):
-    """Dump frequency and pairwise comparison with the original graph for the given random graph to disk."""
-    os.makedirs(analysis_out / random_graph.edgelist_path.name, exist_ok=True)
-    random_r = ResultTransformer.load_result(
-        random_graph.edgelist_path,
-        random_graph.output_directory,
-        original_r.graphlet_size,
-        supress_tqdm=SUPRESS_TQDM,
-    )
-    dump_frequency(analysis_out, random_r)
+def pairwise_results(
+    original: RankedDistributions,
+    randoms: List[RankedDistributions],
+    graphlet_size: int,
+) -> List[Dict[str, Dict[str, Dict]]]:
+    """Perform a mann whitney u test between the original and each random distribution and return its pvalue and
+    uvalue, as a lookup metric_name -> graphlet_class -> result per random graph.
+    Each original distribution is compared with the distributions of all random graphs at once."""
+    results = [{metric_name: {} for metric_name in original} for _ in randoms]
+    for metric_name, original_distributions in original.items():
+        for graphlet_class in graphlet_classes_from_size(graphlet_size):
+            if graphlet_class not in original_distributions:
+                for result in results:
+                    result[metric_name][graphlet_class] = ORIGINAL_MISSING_GRAPHLET_CLASS
+                continue
+
+            present = []
+            for result, random in zip(results, randoms):
+                if graphlet_class in random.get(metric_name, {}):
+                    present.append((result, random[metric_name][graphlet_class]))
+                else:
+                    result[metric_name][graphlet_class] = RANDOM_MISSING_GRAPHLET_CLASS
+
+            original_distribution = original_distributions[graphlet_class]
+            u_statistics, p_values = original_distribution.mannwhitneyu([sample for _, sample in present])
+            for (result, sample), u_statistic, p_value in zip(present, u_statistics, p_values):
+                result[metric_name][graphlet_class] = {
+                    "u-statistic": float(u_statistic),
+                    "p-value": float(p_value),
+                    "sample-size": sample.size,
+                    "sample-median": sample.median,
+                    "original-size": original_distribution.size,
+                    "original-median": original_distribution.median,
+                }
+    return results
+
+
+def load_random_graph(
+    analysis_out: Path,
+    random_graph: PMotifGraph,
+    graphlet_size: int,
+    streaming: bool,
+) -> RankedDistributions:
+    """Load the result of a random graph, dump its frequency to disk and return its ranked distributions."""
+    if streaming:
+        random_s = StreamedResult.load_result(random_graph.edgelist_path, random_graph.output_directory, graphlet_size)
+        write_frequency(analysis_out / random_graph.edgelist_path.name, random_s.frequency)
+        return rank_distributions(random_s)
+
+    random_r = load_result(random_graph.edgelist_path, random_graph.output_directory, graphlet_size)
     add_consolidated_metrics(random_r)
-    for metric_name in original_r.consolidated_metrics:
-        data = single_pairwise_result(original_r, random_r, metric_name)
-        with open(analysis_out / random_graph.edgelist_path.name / f"{metric_name}.data", "w", encoding="utf-8") as out:
-            json.dump(data, out)
-
-
-def compute_pairwise_results(original_r: ResultTransformer, analysis_out: Path, workers: int):
-    """Compare the original result with each random graph, sequentially per metric.
-    Stores the result on disk, grouped by metric and random graph."""
-    randomized_graph = PMotifGraphWithRandomization.create_from_pmotif_graph(original_r.pmotif_graph, -1)
-
-    with Pool(processes=workers) as pool:
-        compare_args = [
-            (analysis_out, original_r, r_g)
-            for r_g in randomized_graph.swapped_graphs
-        ]
-
-        pool.starmap(
-            process_random_graph,
-            tqdm(
-                compare_args,
-                desc="Processing random graphs",
-            ),
-            chunksize=1,
-        )
+    random_index = DistributionIndex(random_r)
+    dump_frequency(analysis_out, random_index)
+    return rank_distributions(random_index)
+
+
+def process_random_graphs(
+    analysis_out: Path,
+    original: RankedDistributions,
+    graphlet_size: int,
+    streaming: bool,
+    random_graphs: List[PMotifGraph],
+):
+    """Dump frequency and pairwise comparison with the original graph for the given random graphs to disk."""
+    randoms = [load_random_graph(analysis_out, r_g, graphlet_size, streaming) for r_g in random_graphs]
+    for random_graph, result in zip(random_graphs, pairwise_results(original, randoms, graphlet_size)):
+        for metric_name, data in result.items():
+            with open(analysis_out / random_graph.edgelist_path.name / f"{metric_name}.data", "w", encoding="utf-8") as out:
+                json.dump(data, out)
+
+
+# Set once per worker process by `init_worker`, so tasks only carry random graphs
+_worker_args = ()
+
+
+def init_worker(analysis_out: Path, original: RankedDistributions, graphlet_size: int, streaming: bool):
+    """Hand the arguments shared by all random graphs to a worker process once."""
+    global _worker_args
+    _worker_args = (analysis_out, original, graphlet_size, streaming)
+
+
+def process_random_graph_batch(random_graphs: List[PMotifGraph]) -> List[str]:
+    """Call `process_random_graphs` in a worker process set up by `init_worker`.
+    Return the names of the processed random graphs."""
+    process_random_graphs(*_worker_args, random_graphs)
+    return [random_graph.edgelist_path.name for random_graph in random_graphs]
+
+
+def compute_pairwise_results(
+    original_r: Union[DistributionIndex, StreamedResult],
+    analysis_out: Path,
+    workers: int,
+    swapped_graphs: List[PMotifGraph],
+    manifest: FingerprintManifest,
+    random_keys: Dict[str, Dict[str, str]],
+):
+    """Compare the original result with each of the given random graphs.
+    The original distributions are ranked once, handed to each worker once, and compared with batches of random
+    graphs at once. Stores the result on disk, grouped by metric and random graph, and records the outputs of
+    each random graph in `manifest` with their input fingerprints `random_keys`.
+    Random graphs are streamed, if the original result was streamed."""
+    streaming = isinstance(original_r, StreamedResult)
+    original = rank_distributions(original_r)
+
+    # Keep every worker busy, but bound the number of random results a worker holds in memory
+    batch_size = max(1, min(RANDOM_GRAPH_BATCH_SIZE, ceil(len(swapped_graphs) / workers)))
+    batches = [swapped_graphs[i:i + batch_size] for i in range(0, len(swapped_graphs), batch_size)]
+    with Pool(
+        processes=workers,
+        initializer=init_worker,
+        initargs=(analysis_out, original, original_r.graphlet_size, streaming),
+    ) as pool:
+        for processed in tqdm(
+            pool.imap_unordered(process_random_graph_batch, batches),
+            total=len(batches),
+            desc="Processing random graph batches",
+        ):
+            manifest.record({
+                f"{name}/{output}": key
+                for name in processed
+                for output, key in random_keys[name].items()
+            })
+
+
+def dump_frequency(analysis_out: Path, index: DistributionIndex):
+    """Dump the graphlet class frequency to disk."""
+    write_frequency(analysis_out / index.pmotif_graph.edgelist_path.name, index.frequency())
 
 
-def dump_frequency(analysis_out: Path, r: ResultTransformer):
-    """Dump the graphlet class frequency to disk."""
-    frequency = to_graphlet_class_frequency(r.positional_metric_df)
-    os.makedirs(analysis_out / r.pmotif_graph.edgelist_path.name, exist_ok=True)
-    with open(analysis_out / r.pmotif_graph.edgelist_path.name / f"frequency", "w", encoding="utf-8") as out:
-        json.dump(frequency, out)
+def write_frequency(out: Path, frequency: Dict[str, int]):
+    """Write a graphlet class frequency to disk."""
+    os.makedirs(out, exist_ok=True)
+    with open(out / "frequency", "w", encoding="utf-8") as frequency_file:
+        json.dump(frequency, frequency_file)
 
 
-def dump_consolidated_metrics(r: ResultTransformer, analysis_out: Path):
+def dump_consolidated_metrics(index: DistributionIndex, analysis_out: Path, storage_format: str = JSON_FORMAT):
     """Dump each consolidated metric on disk."""
-    outpath = analysis_out / r.pmotif_graph.edgelist_path.name / "consolidated_metrics"
+    outpath = analysis_out / index.pmotif_graph.edgelist_path.name / "consolidated_metrics"
     os.makedirs(outpath, exist_ok=True)
-    for metric_name in r.consolidated_metrics:
-        metric_values = r.positional_metric_df.groupby("graphlet_class").agg(list)[metric_name]
+    for metric_name in index.consolidated_metrics:
+        if storage_format == COLUMNAR_FORMAT:
+            write_class_arrays(outpath / metric_name, index.arrays(metric_name, METRIC_DTYPE))
+            continue
         with open(outpath / metric_name, "w", encoding="utf-8") as out:
-            json.dump(dict(metric_values), out)
+            json.dump(index.distribution(metric_name), out)
 
 
-def dump_graphlet_occurrences(r: ResultTransformer, analysis_out: Path):
-    """Dump the graphlet occurrences on disk."""
-    outpath = analysis_out / r.pmotif_graph.edgelist_path.name
-    occurrences = r.positional_metric_df.groupby("graphlet_class").agg(list)["nodes"]
+def dump_graphlet_occurrences(index: DistributionIndex, analysis_out: Path, storage_format: str = JSON_FORMAT):
+    """Dump the graphlet occurrences on disk. The columnar format is copied from the occurrence store of the graph."""
+    outpath = analysis_out / index.pmotif_graph.edgelist_path.name
+    if storage_format == COLUMNAR_FORMAT:
+        store = load_occurrence_store(index.pmotif_graph, index.graphlet_size)
+        write_class_arrays(outpath / "graphlet_occurrences", store.class_arrays())
+        return
     with open(outpath / "graphlet_occurrences", "w", encoding="utf-8") as out:
-        json.dump(dict(occurrences), out)
-
-
-def create_analysis_data(analysis_out: Path, experiment_out: Path, edgelist: Path, graphlet_size: int, workers: int):
-    """Calculate frequency data and (consolidated) pmetric data and store to disk for later use."""
+        json.dump(index.distribution("nodes"), out)
+
+
+def create_analysis_data(
+    analysis_out: Path,
+    experiment_out: Path,
+    edgelist: Path,
+    graphlet_size: int,
+    workers: int,
+    streaming: bool = False,
+    storage_format: str = JSON_FORMAT,
+):
+    """Calculate frequency data and (consolidated) pmetric data and store to disk for later use.
+    With `streaming`, results are read in a single pass per graph instead of being loaded as a whole,
+    keeping memory independent of the number of graphlet occurrences.
+    `storage_format` selects how consolidated metrics and graphlet occurrences are stored, see `STORAGE_FORMATS`.
+    Analysis data is only rebuilt for the original graph and random graphs whose inputs changed since the last run,
+    see `fingerprint.FingerprintManifest`."""
     analysis_out = analysis_out / edgelist.name
     analysis_out = analysis_out / "raw" / str(graphlet_size)
     os.makedirs(analysis_out, exist_ok=True)
 
     graphlet_data = experiment_out / edgelist.stem
-
-    original_r = ResultTransformer.load_result(edgelist, graphlet_data, graphlet_size, supress_tqdm=SUPRESS_TQDM)
-    dump_frequency(analysis_out, original_r)
-    # PMetric Data
-    add_consolidated_metrics(original_r)
-    dump_consolidated_metrics(original_r, analysis_out)
-    dump_graphlet_occurrences(original_r, analysis_out)
-
+    original_graph = PMotifGraph(edgelist, graphlet_data)
     try:
-        compute_pairwise_results(original_r, analysis_out, workers=workers)
+        swapped_graphs = PMotifGraphWithRandomization.create_from_pmotif_graph(original_graph, -1).swapped_graphs
     except FileNotFoundError:
         raise FileNotFoundError("Most likely there are no edge swapping?")
 
+    # Only rebuild analysis data whose inputs changed since the last run
+    manifest = FingerprintManifest(analysis_out)
+    consolidations = consolidation_fingerprint()
+    original_fingerprint = manifest.graph_fingerprint(original_graph, graphlet_size)
+    original_key = combine(original_fingerprint, consolidations, storage_format)
+    original_current = manifest.is_current(edgelist.name, original_key)
+    random_keys = {
+        r_g.edgelist_path.name: random_graph_keys(
+            original_fingerprint,
+            manifest.graph_fingerprint(r_g, graphlet_size),
+            consolidations,
+        )
+        for r_g in tqdm(swapped_graphs, desc="Fingerprinting random graphs")
+    }
+    outdated_graphs = [
+        r_g for r_g in swapped_graphs
+        if not all(
+            manifest.is_current(f"{r_g.edgelist_path.name}/{output}", key)
+            for output, key in random_keys[r_g.edgelist_path.name].items()
+        )
+    ]
+    manifest.save()
+    if original_current and not outdated_graphs:
+        print("Analysis data is up to date.")
+        return
+    print(f"Rebuilding analysis data of {len(outdated_graphs)} of {len(swapped_graphs)} random graphs.")
+
+    if not original_current:
+        shutil.rmtree(analysis_out / edgelist.name, ignore_errors=True)
+
+    if streaming:
+        spool = None
+        if not original_current and storage_format == COLUMNAR_FORMAT:
+            spool = ColumnarOccurrenceSpool(analysis_out / edgelist.name, original_graph, graphlet_size)
+        elif not original_current:
+            spool = OccurrenceSpool(analysis_out / edgelist.name)
+        original = StreamedResult.load_result(edgelist, graphlet_data, graphlet_size, spool=spool)
+        if spool is not None:
+            write_frequency(analysis_out / edgelist.name, original.frequency)
+            spool.dump()
+    else:
+        original_r = load_result(edgelist, graphlet_data, graphlet_size)
+        # PMetric Data
+        add_consolidated_metrics(original_r)
+        original = DistributionIndex(original_r)
+        if not original_current:
+            dump_frequency(analysis_out, original)
+            dump_consolidated_metrics(original, analysis_out, storage_format)
+            dump_graphlet_occurrences(original, analysis_out, storage_format)
+    manifest.record({edgelist.name: original_key})
+
+    compute_pairwise_results(original, analysis_out, workers, outdated_graphs, manifest, random_keys)
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -184,6 +369,19 @@ if __name__ == "__main__":
     add_experiment_out_arg(parser)
     add_analysis_out_arg(parser)
     add_workers_arg(parser)
+    parser.add_argument(
+        "--streaming",
+        action="store_true",
+        help="Stream graphlet occurrences and their metrics instead of loading them as a whole. "
+             "Use this for results with too many graphlet occurrences to fit into memory.",
+    )
+    parser.add_argument(
+        "--storage-format",
+        choices=STORAGE_FORMATS,
+        default=JSON_FORMAT,
+        help="How to store consolidated metrics and graphlet occurrences of the original graph. "
+             "`columnar` stores a numpy array per graphlet class, which is memory-mapped during report creation.",
+    )
 
     args = parser.parse_args()
 
@@ -193,4 +391,6 @@ if __name__ == "__main__":
         edgelist=args.edgelist_path,
         graphlet_size=args.graphlet_size,
         workers=args.workers,
+        streaming=args.streaming,
+        storage_format=args.storage_format,
     )
@@ -1,21 +1,17 @@
 """ONLY WORKS ON THE ORIGINAL GRAPH!"""
-from typing import List
+from typing import List, Optional
 
 import networkx as nx
-from pmotif_lib.p_metric import p_metric
+import numpy as np
 from pmotif_lib.p_metric.p_metric import PreComputation
 
+from custom_pmetrics.weighted_adjacency import WeightedAdjacencyMetric
 
-class ExternalWeight(p_metric.PMetric):
+
+class ExternalWeight(WeightedAdjacencyMetric):
     """PMetric to gather the weight of all edges connected to but outside the graphlet occurrence"""
     def __init__(self, graph_with_weights: nx.Graph, data_key="weight"):
-        """GtrieScanner does not allow weights. Therefore, the edgelists handed to the pmotif lib never contain
-        (meaningful) weights. This makes a side-channel to inject the weights necessary.
-        Providing the same edgelist with weights for this metric is said side-channel."""
-        self.graph_with_weights = graph_with_weights
-        self.data_key = data_key
-
-        super().__init__("pExternalWeight")
+        super().__init__("pExternalWeight", graph_with_weights, data_key)
 
     def metric_calculation(
         self,
@@ -24,20 +20,13 @@ class ExternalWeight(p_metric.PMetric):
         pre_compute: PreComputation,
     ) -> List[float]:
         """Gathers the edge weight of every external edge."""
+        return self.adjacency.external_weights(graphlet_nodes)
 
-        nodes = set(graphlet_nodes)
-
-        external_edges = [
-            (src, dst)
-            for src, dst in graph.edges(graphlet_nodes)
-            if src not in nodes or dst not in nodes
-        ]
-
-        return [
-            self.graph_with_weights.get_edge_data(u, v)[self.data_key]
-            for u, v in external_edges
-        ]
-
-    def pre_computation(self, graph: nx.Graph) -> PreComputation:
-        """No pre-computation necessary for weight calculation."""
-        return {}
+    def batch_calculation(
+        self,
+        graph: Optional[nx.Graph],
+        occurrences: np.ndarray,
+        pre_compute: PreComputation,
+    ) -> List[List[float]]:
+        """Gathers the edge weight of every external edge of each graphlet of the block."""
+        return self.adjacency.batch_external_weights(occurrences)
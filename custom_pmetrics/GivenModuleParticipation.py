@@ -1,12 +1,51 @@
 """PMetric to calculate the number of predefined graph modules a graphlet touches.
 ONLY WORKS ON THE ORIGINAL GRAPH!"""
-from typing import List
+from __future__ import annotations
+
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, Optional
 import networkx as nx
+import numpy as np
+
+from pmotif_lib.p_metric.p_metric import PreComputation
+
+from custom_pmetrics.batched_metric import BatchedPMetric, MemoryMappedArrays, csr_gather, split_rows
+
+
+class ModuleIndex(MemoryMappedArrays):
+    """CSR lookup of the module indices of each (integer) node id."""
 
-from pmotif_lib.p_metric.p_metric import PMetric, PreComputation
+    shared_arrays = ("indptr", "module_indices")
 
+    def __init__(self, indptr: np.ndarray, module_indices: np.ndarray, module_count: int):
+        self.indptr = indptr
+        self.module_indices = module_indices
+        self.module_count = module_count
 
-class GivenModuleParticipation(PMetric):
+    @staticmethod
+    def from_node_modules(node_modules: Dict[str, List[int]], node_count: int, module_count: int) -> ModuleIndex:
+        """Build the lookup of `node_count` node ids from the module indices of each node."""
+        memberships = np.zeros(node_count, dtype=np.int64)
+        for node, module_indices in node_modules.items():
+            memberships[int(node)] = len(module_indices)
+        indptr = np.concatenate(([0], np.cumsum(memberships)))
+        module_indices = np.empty(indptr[-1], dtype=np.int64)
+        for node, node_module_indices in node_modules.items():
+            module_indices[indptr[int(node)]:indptr[int(node) + 1]] = node_module_indices
+        return ModuleIndex(indptr, module_indices, module_count)
+
+    def batch_participation(self, occurrences: np.ndarray) -> List[List[int]]:
+        """Return the sorted indices of the modules containing nodes of each row of an N x k node id array."""
+        owner, positions = csr_gather(self.indptr, occurrences.ravel())
+        rows = owner // occurrences.shape[1]
+        # Unique (row, module index) pairs, sorted by row and then by module index
+        pairs = np.unique(rows * self.module_count + self.module_indices[positions])
+        rows, module_indices = np.divmod(pairs, self.module_count)
+        return split_rows(module_indices, rows, len(occurrences))
+
+
+class GivenModuleParticipation(BatchedPMetric):
     """Measures how many unique graph modules a graphlet participates in.
     Graph modules are previously known.
     A graphlet participates in a module, if at least one graphlet node belongs to that module.
@@ -17,10 +56,27 @@ class GivenModuleParticipation(PMetric):
 
     def __init__(self, modules: List[List[str]]):
         self.modules = modules
+        # Module indices of each node, and their lookup for the batched calculation (integer node ids only)
+        self.node_modules: Dict[str, List[int]] = {}
+        self.module_index: Optional[ModuleIndex] = None
         super().__init__("pGivenModuleParticipation")
 
     def pre_computation(self, graph: nx.Graph) -> PreComputation:
-        """No precomputation needed, as modules are given."""
+        """Index the modules by node, so that each graphlet node is looked up once
+        instead of being searched in every module. The index is kept on the metric, as it is no result of its own.
+        The lookup of the batched calculation is only built if all node ids are integers."""
+        node_modules = defaultdict(list)
+        for i, graph_module in enumerate(self.modules):
+            for node in set(graph_module):
+                node_modules[node].append(i)
+        self.node_modules = dict(node_modules)
+
+        try:
+            node_count = max(int(node) for node in [*graph.nodes, *node_modules]) + 1
+        except ValueError:
+            self.module_index = None
+        else:
+            self.module_index = ModuleIndex.from_node_modules(node_modules, node_count, len(self.modules))
         return {}
 
     def metric_calculation(
@@ -31,10 +87,32 @@ class GivenModuleParticipation(PMetric):
     ) -> List[int]:
         """Returns a list of indices
         indicating which modules contain nodes of the graphlet occurrence."""
-        participations = []
-        for i, graph_module in enumerate(self.modules):
-            for node in graphlet_nodes:
-                if node in graph_module:
-                    participations.append(i)
-                    break
-        return participations
+        if self.module_index is not None:
+            return self.module_index.batch_participation(np.array([graphlet_nodes], dtype=np.int64))[0]
+        return sorted({i for node in graphlet_nodes for i in self.node_modules.get(node, [])})
+
+    def batch_calculation(
+        self,
+        graph: Optional[nx.Graph],
+        occurrences: np.ndarray,
+        pre_compute: PreComputation,
+    ) -> List[List[int]]:
+        """Returns a list of indices per graphlet occurrence of the block,
+        indicating which modules contain nodes of the graphlet occurrence."""
+        if self.module_index is None:
+            return [self.metric_calculation(graph, [str(node) for node in row], pre_compute) for row in occurrences]
+        return self.module_index.batch_participation(occurrences)
+
+    def share_pre_computation(self, directory: Path):
+        """Memory-map the module lookup, so worker processes share it."""
+        if self.module_index is not None:
+            self.module_index.share(directory / self.name)
+
+    def __getstate__(self):
+        """Leave the modules and the module indices per node behind when sent to worker processes,
+        they only need the module lookup."""
+        state = self.__dict__.copy()
+        if state["module_index"] is not None:
+            del state["modules"]
+            state["node_modules"] = {}
+        return state
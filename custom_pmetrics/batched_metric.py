@@ -0,0 +1,96 @@
+"""Batched pMetric protocol: a pMetric which calculates a whole block of graphlet occurrences per call."""
+import os
+from abc import abstractmethod
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+
+import networkx as nx
+import numpy as np
+from pmotif_lib.p_metric import p_metric
+from pmotif_lib.p_metric.p_metric import PreComputation, RawMetric
+
+
+class BatchedPMetric(p_metric.PMetric):
+    """A pMetric which, next to the per-occurrence `metric_calculation`, can calculate the metric of
+    many graphlet occurrences at once. Both have to produce the same results.
+    `util.calculate_missing_metrics` uses the batched path for every metric implementing this interface."""
+
+    @abstractmethod
+    def batch_calculation(
+        self,
+        graph: Optional[nx.Graph],
+        occurrences: np.ndarray,
+        pre_compute: PreComputation,
+    ) -> List[RawMetric]:
+        """Is called on a block of graphlet occurrences, given as an N x k array of (integer) node ids.
+        Returns the json serializable metric of each occurrence, in the order of the block.
+        `graph` is always None, so that the graph is not sent to worker processes:
+        everything needed of it has to be kept on the metric by `pre_computation`.
+        """
+
+    def share_pre_computation(self, directory: Path):
+        """Called after `pre_computation`, before the metric is sent to worker processes.
+        Metrics keeping large lookups on the instance move them to memory-mapped files in `directory`,
+        so workers map the same files instead of receiving copies. Does nothing by default."""
+
+
+class MemoryMappedArrays:
+    """Mixin for lookups made of numpy arrays, listed in `shared_arrays`.
+    Once `share`d, the arrays are memory-mapped from .npy files and pickled as the location of those files."""
+
+    shared_arrays: Tuple[str, ...] = ()
+    shared_directory: Optional[Path] = None
+
+    def share(self, directory: Path):
+        """Store the arrays in `directory` and replace them with read-only memory maps of the stored files."""
+        os.makedirs(directory, exist_ok=True)
+        for name in self.shared_arrays:
+            np.save(directory / f"{name}.npy", getattr(self, name))
+        self.shared_directory = directory
+        self._map_arrays()
+
+    def _map_arrays(self):
+        for name in self.shared_arrays:
+            setattr(self, name, np.load(self.shared_directory / f"{name}.npy", mmap_mode="r"))
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self.shared_directory is not None:
+            for name in self.shared_arrays:
+                del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.shared_directory is not None:
+            self._map_arrays()
+
+
+def csr_gather(indptr: np.ndarray, nodes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Gather the CSR entries of `nodes`, in order.
+    Returns the index into `nodes` each entry belongs to, and the position of each entry in the CSR data."""
+    starts = indptr[nodes]
+    lengths = indptr[nodes + 1] - starts
+    owner = np.repeat(np.arange(len(nodes)), lengths)
+    # Offset of each entry within the entries of its node
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return owner, np.repeat(starts, lengths) + offsets
+
+
+def budget_slices(costs: np.ndarray, budget: int) -> Iterator[slice]:
+    """Split a sequence into consecutive slices whose `costs` sum to at most `budget`,
+    with at least one element per slice. Bounds the memory of gathering CSR entries of hubs."""
+    cumulative = np.cumsum(costs)
+    start = 0
+    while start < len(costs):
+        spent = cumulative[start - 1] if start > 0 else 0
+        end = max(int(np.searchsorted(cumulative, spent + budget, side="right")), start + 1)
+        yield slice(start, end)
+        start = end
+
+
+def split_rows(values: np.ndarray, rows: np.ndarray, row_count: int) -> List[list]:
+    """Split `values`, sorted by the row they belong to, into a list per row."""
+    bounds = np.concatenate(([0], np.cumsum(np.bincount(rows, minlength=row_count)))).tolist()
+    values = values.tolist()
+    return [values[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
@@ -0,0 +1,130 @@
+"""Compact lookup of the weights of edges adjacent to graphlet nodes, and the base of the edge weight pMetrics
+sharing it."""
+from __future__ import annotations
+
+from pathlib import Path
+from typing import List, Optional
+
+import networkx as nx
+import numpy as np
+from pmotif_lib.p_metric.p_metric import PreComputation
+
+from custom_pmetrics.batched_metric import BatchedPMetric, MemoryMappedArrays, budget_slices, csr_gather, split_rows
+
+# Maximum number of adjacency entries gathered at once by the batched lookups
+GATHER_BUDGET = 2 ** 22
+
+
+class WeightedAdjacency(MemoryMappedArrays):
+    """CSR adjacency of a graph with a parallel array of edge weights, indexed by the (integer) gtrieScanner node ids.
+    The neighbors of each node keep the order of the networkx adjacency, so edges are gathered in the same order
+    as `graph.edges(graphlet_nodes)` would yield them."""
+
+    shared_arrays = ("indptr", "indices", "weights")
+
+    def __init__(self, indptr: np.ndarray, indices: np.ndarray, weights: np.ndarray):
+        self.indptr = indptr
+        self.indices = indices
+        self.weights = weights
+
+    @staticmethod
+    def from_graphs(graph: nx.Graph, graph_with_weights: nx.Graph, data_key: str) -> WeightedAdjacency:
+        """Build the adjacency of `graph`, with weights taken from the same edges in `graph_with_weights`."""
+        node_count = max(int(node) for node in graph.nodes) + 1
+        degrees = np.zeros(node_count, dtype=np.int64)
+        for node, degree in graph.degree:
+            degrees[int(node)] = degree
+        indptr = np.concatenate(([0], np.cumsum(degrees)))
+
+        indices = np.empty(indptr[-1], dtype=np.int64)
+        weights = [0] * indptr[-1]
+        for node, neighbors in graph.adjacency():
+            start, end = indptr[int(node)], indptr[int(node) + 1]
+            indices[start:end] = [int(neighbor) for neighbor in neighbors]
+            weighted_neighbors = graph_with_weights.adj[node]
+            weights[start:end] = [weighted_neighbors[neighbor][data_key] for neighbor in neighbors]
+
+        # Keep integer weights integers, so the stored metrics do not change their type
+        dtype = np.int64 if all(isinstance(w, int) for w in weights) else np.float64
+        return WeightedAdjacency(indptr, indices, np.array(weights, dtype=dtype))
+
+    def internal_weights(self, graphlet_nodes: List[str]) -> List[float]:
+        """Return the weight of every edge between graphlet nodes."""
+        nodes = np.array([int(node) for node in graphlet_nodes])
+        weights = []
+        for i, node in enumerate(nodes):
+            start, end = self.indptr[node], self.indptr[node + 1]
+            # Edges to earlier graphlet nodes were already gathered from the other end
+            internal = (self.indices[start:end, None] == nodes[i + 1:]).any(axis=1)
+            weights.append(self.weights[start:end][internal])
+        return np.concatenate(weights).tolist()
+
+    def external_weights(self, graphlet_nodes: List[str]) -> List[float]:
+        """Return the weight of every edge between a graphlet node and a node outside the graphlet."""
+        nodes = np.array([int(node) for node in graphlet_nodes])
+        weights = []
+        for node in nodes:
+            start, end = self.indptr[node], self.indptr[node + 1]
+            external = ~(self.indices[start:end, None] == nodes).any(axis=1)
+            weights.append(self.weights[start:end][external])
+        return np.concatenate(weights).tolist()
+
+    def batch_internal_weights(self, occurrences: np.ndarray) -> List[List[float]]:
+        """Return the internal edge weights of each row of an N x k node id array, like `internal_weights`."""
+        columns = np.arange(occurrences.shape[1])
+        # Only edges to later graphlet nodes, the others were already gathered from the other end
+        return self._batch_weights(occurrences, lambda column: columns > column[:, None])
+
+    def batch_external_weights(self, occurrences: np.ndarray) -> List[List[float]]:
+        """Return the external edge weights of each row of an N x k node id array, like `external_weights`."""
+        return self._batch_weights(occurrences, None)
+
+    def _batch_weights(self, occurrences: np.ndarray, internal_columns) -> List[List[float]]:
+        """Gather the weights of edges to graphlet nodes in `internal_columns(column)`,
+        or of edges to nodes outside the graphlet if None."""
+        graphlet_size = occurrences.shape[1]
+        degrees = np.diff(self.indptr)[occurrences].sum(axis=1)
+        result = []
+        for block in budget_slices(degrees, GATHER_BUDGET):
+            block_occurrences = occurrences[block]
+            owner, positions = csr_gather(self.indptr, block_occurrences.ravel())
+            rows, columns = np.divmod(owner, graphlet_size)
+
+            # Entries are gathered row by row, node by node, each in adjacency order
+            to_graphlet = self.indices[positions, None] == block_occurrences[rows]
+            if internal_columns is None:
+                selected = ~to_graphlet.any(axis=1)
+            else:
+                selected = (to_graphlet & internal_columns(columns)).any(axis=1)
+            result.extend(split_rows(self.weights[positions[selected]], rows[selected], len(block_occurrences)))
+        return result
+
+
+class WeightedAdjacencyMetric(BatchedPMetric):
+    """Base of the pMetrics gathering edge weights of graphlet occurrences from a `WeightedAdjacency`."""
+
+    def __init__(self, name: str, graph_with_weights: nx.Graph, data_key="weight"):
+        """GtrieScanner does not allow weights. Therefore, the edgelists handed to the pmotif lib never contain
+        (meaningful) weights. This makes a side-channel to inject the weights necessary.
+        Providing the same edgelist with weights for this metric is said side-channel."""
+        self.graph_with_weights = graph_with_weights
+        self.data_key = data_key
+        self.adjacency: Optional[WeightedAdjacency] = None
+
+        super().__init__(name)
+
+    def pre_computation(self, graph: nx.Graph) -> PreComputation:
+        """Build a weighted adjacency lookup of the graph. It is kept on the metric, as it is not json serializable."""
+        self.adjacency = WeightedAdjacency.from_graphs(graph, self.graph_with_weights, self.data_key)
+        return {}
+
+    def share_pre_computation(self, directory: Path):
+        """Memory-map the weighted adjacency lookup, so worker processes share it."""
+        self.adjacency.share(directory / self.name)
+
+    def __getstate__(self):
+        """Leave the weighted graph behind when sent to worker processes, they only need the adjacency lookup."""
+        state = self.__dict__.copy()
+        if state["adjacency"] is not None:
+            del state["graph_with_weights"]
+        return state
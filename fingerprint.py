@@ -0,0 +1,130 @@
+"""Fingerprint the inputs of the analysis data creation by their content,
+so that only analysis data whose inputs changed is rebuilt."""
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from pmotif_lib.p_metric.metric_consolidation import metrics
+from pmotif_lib.p_motif_graph import PMotifGraph
+
+from report_creation.util import write_json_atomically
+
+FINGERPRINT_MANIFEST_NAME = "fingerprints.json"
+GRAPHLETS = "graphlets"
+CHUNK_SIZE = 2 ** 20
+
+Fingerprint = Dict[str, Optional[str]]
+
+
+def combine(*parts) -> str:
+    """Return a digest of json serializable `parts`."""
+    return hashlib.blake2b(json.dumps(parts, sort_keys=True).encode(), digest_size=16).hexdigest()
+
+
+def consolidation_fingerprint() -> Dict[str, str]:
+    """Return a digest of the consolidation methods applied to each pMetric, by their names and implementations."""
+    return {
+        metric_name: combine([
+            (consolidation_name, consolidation_method.__module__, consolidation_method.__qualname__)
+            for consolidation_name, consolidation_method in consolidations
+        ])
+        for metric_name, consolidations in metrics.items()
+    }
+
+
+def consolidated_metric_inputs() -> Dict[str, str]:
+    """Return the pMetric each consolidated metric is computed from."""
+    return {
+        consolidation_name: metric_name
+        for metric_name, consolidations in metrics.items()
+        for consolidation_name, _ in consolidations
+    }
+
+
+class FingerprintManifest:
+    """Record of the fingerprint of the inputs each analysis data output was built from.
+    An output is current as long as it exists and the fingerprint of its inputs did not change.
+
+    Content digests of input files are cached by file size and modification time,
+    so unchanged inputs are not read again."""
+
+    def __init__(self, analysis_out: Path):
+        self.analysis_out = analysis_out
+        self.path = analysis_out / FINGERPRINT_MANIFEST_NAME
+
+        self._files: Dict[str, List] = {}
+        self._outputs: Dict[str, str] = {}
+        if self.path.is_file():
+            with open(self.path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            self._files = manifest["files"]
+            self._outputs = manifest["outputs"]
+
+    def digest(self, path: Path) -> Optional[str]:
+        """Return the content digest of the file at `path`, or None if there is no such file."""
+        if not path.is_file():
+            return None
+        stat = path.stat()
+        cached = self._files.get(str(path))
+        if cached is not None and cached[:2] == [stat.st_size, stat.st_mtime_ns]:
+            return cached[2]
+
+        file_hash = hashlib.blake2b(digest_size=16)
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                file_hash.update(chunk)
+        self._files[str(path)] = [stat.st_size, stat.st_mtime_ns, file_hash.hexdigest()]
+        return file_hash.hexdigest()
+
+    def graph_fingerprint(self, pmotif_graph: PMotifGraph, graphlet_size: int) -> Fingerprint:
+        """Return the fingerprint of the graphlets and of each pMetric of a graph."""
+        fingerprint = {
+            GRAPHLETS: combine(
+                self.digest(pmotif_graph.edgelist_path),
+                self.digest(pmotif_graph.get_graphlet_freq_file(graphlet_size)),
+                self.digest(pmotif_graph.get_graphlet_pos_zip(graphlet_size)),
+            )
+        }
+        pmetric_directory = pmotif_graph.get_pmetric_directory(graphlet_size)
+        if pmetric_directory.is_dir():
+            for metric_name in sorted(os.listdir(pmetric_directory)):
+                metric_files = sorted(
+                    Path(root) / file
+                    for root, _, files in os.walk(pmetric_directory / metric_name)
+                    for file in files
+                )
+                fingerprint[metric_name] = combine([
+                    (str(file.relative_to(pmetric_directory)), self.digest(file))
+                    for file in metric_files
+                ])
+        return fingerprint
+
+    def is_current(self, output: str, key: str) -> bool:
+        """Whether `output`, relative to the analysis data, exists and was built from inputs with fingerprint `key`."""
+        return self._outputs.get(output) == key and (self.analysis_out / output).exists()
+
+    def record(self, outputs: Dict[str, str]):
+        """Record outputs, relative to the analysis data, as built from inputs with the given fingerprints."""
+        self._outputs.update(outputs)
+        self.save()
+
+    def save(self):
+        """Write the manifest to disk."""
+        write_json_atomically(self.path, {"files": self._files, "outputs": self._outputs})
+
+
+def random_graph_keys(original: Fingerprint, random: Fingerprint, consolidations: Dict[str, str]) -> Dict[str, str]:
+    """Return the input fingerprint of each analysis data output of a random graph:
+    its frequency, and the comparison of each consolidated metric with the original graph."""
+    keys = {"frequency": combine(random[GRAPHLETS])}
+    for consolidation_name, metric_name in consolidated_metric_inputs().items():
+        keys[f"{consolidation_name}.data"] = combine(
+            original[GRAPHLETS],
+            original.get(metric_name),
+            random[GRAPHLETS],
+            random.get(metric_name),
+            consolidations[metric_name],
+        )
+    return keys
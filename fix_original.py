@@ -1,11 +1,12 @@
 """The pMotif detection script had a bug:
 It did not check whether the input graph had weights or not, which can mess up the input parsing of the gTrieScanner.
 This script recomputes the motifs and pMetrics of the original graph, not touching the random graphs.
-Corrects the mistake while saving time by not recomputing everything.
+Corrects the mistake while saving time by not recomputing everything:
+Output recorded in the completion manifest with the correct edgelist format is kept,
+while output without a record (computed before the fix) or with a wrong format is recomputed.
 However, analysis data was created on faulty data, and will have to be recomputed.
 """
 import argparse
-import shutil
 from os import makedirs
 from pathlib import Path
 
@@ -14,6 +15,7 @@ from pmotif_lib.p_metric.p_anchor_node_distance import PAnchorNodeDistance
 from pmotif_lib.p_metric.p_degree import PDegree
 from pmotif_lib.p_metric.p_graph_module_participation import PGraphModuleParticipation
 
+from checkpoint import GraphManifest
 from pmotif_cml_interface import add_common_args, add_experiment_out_arg
 from util import process_graph, get_edgelist_format
 
@@ -27,14 +29,15 @@ def main(edgelist: Path, out: Path, graphlet_size: int):
 
     pmotif_graph = PMotifGraph(edgelist, out)
 
-    # Remove the faulty result
-    shutil.rmtree(pmotif_graph.get_graphlet_directory() / str(graphlet_size))
+    # Do not trust output without a record of the edgelist format it was computed with
+    manifest = GraphManifest(pmotif_graph, graphlet_size, trust_unrecorded=False)
 
     process_graph(
         pmotif_graph,
         graphlet_size,
         [degree, anchor_node, graph_module_participation],
         edgelist_format=get_edgelist_format(edgelist),
+        manifest=manifest,
     )
 
 
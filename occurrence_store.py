@@ -0,0 +1,194 @@
+"""Binary copy of the graphlet occurrences found by gtrieScanner, parsed once from its text output (`motif_pos`)
+and memory-mapped by every later stage instead of parsing the text again.
+
+A store holds the node ids of all occurrences as an N x k uint32 array (`nodes.npy`), and the graphlet class of each
+occurrence as a uint8 code (`classes.npy`), indexing the graphlet classes listed in `store.json`.
+Rows keep the order of gtrieScanner, which is the order of the lines of pMetric `graphlet_metrics` files."""
+from __future__ import annotations
+
+import json
+import os
+import shutil
+import zipfile
+from pathlib import Path
+from typing import Dict, Iterator, List, Tuple
+
+import numpy as np
+from pmotif_lib.graphlet_occurence import GraphletOccurrence
+from pmotif_lib.graphlet_representation import graphlet_classes_from_size
+from pmotif_lib.p_motif_graph import PMotifGraph
+
+OCCURRENCE_STORE_NAME = "occurrence_store"
+STORE_META_NAME = "store.json"
+NODES_NAME = "nodes.npy"
+CLASSES_NAME = "classes.npy"
+
+STORE_NODE_DTYPE = np.uint32
+CLASS_CODE_DTYPE = np.uint8
+# Bytes of `motif_pos` parsed at once
+PARSE_BLOCK_BYTES = 2 ** 23
+# Number of occurrences converted to node id strings at once
+OCCURRENCE_BLOCK_SIZE = 2 ** 16
+
+
+def store_directory(pmotif_graph: PMotifGraph, graphlet_size: int) -> Path:
+    """Return the location of the occurrence store of `graphlet_size`-graphlets of the graph."""
+    return pmotif_graph.get_graphlet_output_directory(graphlet_size) / OCCURRENCE_STORE_NAME
+
+
+def source_stat(pmotif_graph: PMotifGraph, graphlet_size: int) -> Dict[str, int]:
+    """Return size and modification time of the gtrieScanner output a store is built from."""
+    stat = pmotif_graph.get_graphlet_pos_zip(graphlet_size).stat()
+    return {"source_size": stat.st_size, "source_mtime_ns": stat.st_mtime_ns}
+
+
+def parse_block(
+    lines: List[bytes],
+    graphlet_size: int,
+    class_codes: Dict[bytes, int],
+    graphlet_classes: List[str],
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Parse lines of `motif_pos` into class codes and a node id matrix.
+    Each line looks like this: '<adj.matrix written in one line>: <node1> <node2> ...'
+    gtrieScanner reverses the adj matrix, so each new label is reversed and split into rows, like
+    `PMotifGraph.load_graphlet_pos_zip` does. New graphlet classes are appended to `graphlet_classes`."""
+    label_length = graphlet_size * graphlet_size
+    codes = np.empty(len(lines), dtype=CLASS_CODE_DTYPE)
+    for i, line in enumerate(lines):
+        label = line[:label_length]
+        if label not in class_codes:
+            reversed_label = label.decode()[::-1]
+            graphlet_class = " ".join(
+                reversed_label[j: j + graphlet_size] for j in range(0, label_length, graphlet_size)
+            )
+            if graphlet_class not in graphlet_classes:
+                graphlet_classes.append(graphlet_class)
+            code = graphlet_classes.index(graphlet_class)
+            if code > np.iinfo(CLASS_CODE_DTYPE).max:
+                raise ValueError(f"Too many graphlet classes to store their codes as {np.dtype(CLASS_CODE_DTYPE)}!")
+            class_codes[label] = code
+        codes[i] = class_codes[label]
+
+    # Skip the label and its trailing ':'
+    text = b"".join([line[label_length + 1:] for line in lines]).decode()
+    nodes = np.fromstring(text, dtype=STORE_NODE_DTYPE, sep=" ")
+    if nodes.size != len(lines) * graphlet_size:
+        raise ValueError(f"Expected {graphlet_size} integer node ids on each line of `motif_pos`!")
+    return codes, nodes.reshape(len(lines), graphlet_size)
+
+
+def build_occurrence_store(pmotif_graph: PMotifGraph, graphlet_size: int) -> OccurrenceStore:
+    """Parse the gtrieScanner output of the graph into its occurrence store, replacing any previous store.
+    Arrays are preallocated on disk from the graphlet class frequencies and filled block-wise,
+    in a temporary directory which is moved in place once complete."""
+    directory = store_directory(pmotif_graph, graphlet_size)
+    tmp_directory = directory.with_name(f"{OCCURRENCE_STORE_NAME}.{os.getpid()}.tmp")
+    shutil.rmtree(tmp_directory, ignore_errors=True)
+    os.makedirs(tmp_directory)
+
+    stat = source_stat(pmotif_graph, graphlet_size)
+    occurrence_count = sum(pmotif_graph.load_graphlet_freq_file(graphlet_size).values())
+    nodes = np.lib.format.open_memmap(
+        tmp_directory / NODES_NAME, mode="w+", dtype=STORE_NODE_DTYPE, shape=(occurrence_count, graphlet_size),
+    )
+    classes = np.lib.format.open_memmap(
+        tmp_directory / CLASSES_NAME, mode="w+", dtype=CLASS_CODE_DTYPE, shape=(occurrence_count,),
+    )
+
+    graphlet_classes = list(graphlet_classes_from_size(graphlet_size))
+    class_codes = {}
+    stored = 0
+    with zipfile.ZipFile(pmotif_graph.get_graphlet_pos_zip(graphlet_size), "r") as zfile:
+        with zfile.open("motif_pos") as motif_pos_file:
+            while True:
+                lines = motif_pos_file.readlines(PARSE_BLOCK_BYTES)
+                if len(lines) == 0:
+                    break
+                if stored + len(lines) > occurrence_count:
+                    raise ValueError("`motif_pos` contains more graphlet occurrences than `motif_freq`!")
+                block_classes, block_nodes = parse_block(lines, graphlet_size, class_codes, graphlet_classes)
+                classes[stored:stored + len(lines)] = block_classes
+                nodes[stored:stored + len(lines)] = block_nodes
+                stored += len(lines)
+    if stored != occurrence_count:
+        raise ValueError("`motif_pos` contains fewer graphlet occurrences than `motif_freq`!")
+    nodes.flush()
+    classes.flush()
+    del nodes, classes
+
+    with open(tmp_directory / STORE_META_NAME, "w", encoding="utf-8") as f:
+        json.dump({"graphlet_size": graphlet_size, "graphlet_classes": graphlet_classes, **stat}, f)
+    shutil.rmtree(directory, ignore_errors=True)
+    try:
+        os.rename(tmp_directory, directory)
+    except OSError:
+        # Another process built the same store concurrently
+        shutil.rmtree(tmp_directory, ignore_errors=True)
+    return OccurrenceStore(directory)
+
+
+def load_occurrence_store(pmotif_graph: PMotifGraph, graphlet_size: int) -> OccurrenceStore:
+    """Memory-map the occurrence store of the graph.
+    The store is built first, if it is missing or older than the gtrieScanner output, e.g. for output
+    computed before stores existed."""
+    directory = store_directory(pmotif_graph, graphlet_size)
+    if (directory / STORE_META_NAME).is_file():
+        store = OccurrenceStore(directory)
+        if store.source_stat == source_stat(pmotif_graph, graphlet_size):
+            return store
+    return build_occurrence_store(pmotif_graph, graphlet_size)
+
+
+class OccurrenceStore:
+    """The memory-mapped occurrence store in `directory`, see `build_occurrence_store`."""
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        with open(directory / STORE_META_NAME, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.graphlet_size: int = meta["graphlet_size"]
+        self.graphlet_classes: List[str] = meta["graphlet_classes"]
+        self.source_stat = {key: meta[key] for key in ["source_size", "source_mtime_ns"]}
+        self.nodes: np.ndarray = np.load(directory / NODES_NAME, mmap_mode="r")
+        self.classes: np.ndarray = np.load(directory / CLASSES_NAME, mmap_mode="r")
+
+    def __len__(self) -> int:
+        return len(self.classes)
+
+    def frequency(self) -> Dict[str, int]:
+        """Return the occurrence count of each graphlet class, including classes without occurrences."""
+        counts = np.bincount(self.classes, minlength=len(self.graphlet_classes)).tolist()
+        return dict(zip(self.graphlet_classes, counts))
+
+    def class_rows(self) -> Dict[str, np.ndarray]:
+        """Return the rows of the occurrences of each graphlet class present, in order, sorted by graphlet class."""
+        order = np.argsort(self.classes, kind="stable")
+        bounds = np.concatenate(([0], np.cumsum(np.bincount(self.classes, minlength=len(self.graphlet_classes)))))
+        rows = {
+            graphlet_class: order[start:end]
+            for graphlet_class, start, end in zip(self.graphlet_classes, bounds[:-1], bounds[1:])
+            if end > start
+        }
+        return dict(sorted(rows.items()))
+
+    def class_arrays(self) -> Dict[str, np.ndarray]:
+        """Return the node id matrix of the occurrences of each graphlet class present, sorted by graphlet class."""
+        return {graphlet_class: self.nodes[rows] for graphlet_class, rows in self.class_rows().items()}
+
+    def iter_blocks(self, block_size: int = OCCURRENCE_BLOCK_SIZE) -> Iterator[Tuple[List[str], List[List[str]]]]:
+        """Yield graphlet classes and node lists of consecutive blocks of occurrences, in the order of gtrieScanner.
+        Nodes are node id strings, like the ones `PMotifGraph.load_graphlet_pos_zip` returns."""
+        graphlet_classes = np.array(self.graphlet_classes, dtype=object)
+        for start in range(0, len(self), block_size):
+            yield (
+                graphlet_classes[self.classes[start:start + block_size]].tolist(),
+                self.nodes[start:start + block_size].astype(str).tolist(),
+            )
+
+    def graphlet_occurrences(self) -> List[GraphletOccurrence]:
+        """Return all occurrences, equal to the ones `PMotifGraph.load_graphlet_pos_zip` returns."""
+        return [
+            GraphletOccurrence(graphlet_class=graphlet_class, nodes=nodes)
+            for graphlet_classes, node_lists in self.iter_blocks()
+            for graphlet_class, nodes in zip(graphlet_classes, node_lists)
+        ]
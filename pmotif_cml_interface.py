@@ -1,6 +1,8 @@
 import argparse
 from pathlib import Path
 
+from sharding import parse_shard
+
 
 def add_common_args(parser: argparse.ArgumentParser):
     parser.add_argument(
@@ -39,11 +41,78 @@ def add_analysis_out_arg(parser: argparse.ArgumentParser):
     )
 
 
-def add_workers_arg(parser: argparse.ArgumentParser):
+def add_workers_arg(parser: argparse.ArgumentParser, required: bool = True):
     parser.add_argument(
         "--workers",
-        required=True,
+        required=required,
         type=int,
         default=1,
         help="Degree of Parallelization for certain processes.",
     )
+
+
+def add_graph_workers_args(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--graph-workers",
+        required=False,
+        type=int,
+        default=1,
+        help="Number of random graphs to process at once, each in its own process. "
+             "The `--workers` are split evenly between those processes.",
+    )
+    parser.add_argument(
+        "--memory-budget",
+        required=False,
+        type=float,
+        default=None,
+        help="Memory in GB available to all graph workers together. Limits `--graph-workers` based on the memory "
+             "needed to process the original graph. Defaults to the memory of the SLURM allocation, if any.",
+    )
+
+
+def add_shard_args(parser: argparse.ArgumentParser):
+    modes = parser.add_mutually_exclusive_group()
+    modes.add_argument(
+        "--prepare-only",
+        action="store_true",
+        help="Only process the original graph and create the random graphs, to process them in shards afterwards.",
+    )
+    modes.add_argument(
+        "--shard",
+        required=False,
+        type=parse_shard,
+        default=None,
+        help="`I/N`: only process the I-th (0-based) of N contiguous slices of the random graphs, "
+             "e.g. `$SLURM_ARRAY_TASK_ID/N`. Requires a `--prepare-only` run first.",
+    )
+    modes.add_argument(
+        "--merge-shards",
+        required=False,
+        type=int,
+        default=None,
+        metavar="N",
+        help="Verify that the original graph and all random graphs of N shards are completely processed. "
+             "Exits with 1 and lists the shards to rerun otherwise.",
+    )
+
+
+def add_scan_ahead_arg(parser: argparse.ArgumentParser, default: int = 1):
+    parser.add_argument(
+        "--scan-ahead",
+        required=False,
+        type=int,
+        default=default,
+        help="Number of random graphs whose graphlets are detected in the background (by gtrieScanner), "
+             "while the metrics of the current random graph are calculated. 0 disables the overlap.",
+    )
+
+
+def add_random_seed_arg(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--random-seed",
+        required=False,
+        type=int,
+        default=None,
+        help="Seed of the random graph ensemble. Each random graph is created from its own seed derived from it, "
+             "independent of the number of `--workers`. Random, if not given.",
+    )
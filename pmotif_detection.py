@@ -1,55 +1,252 @@
 """Script to run a p-graphlet or p-motif detection from command line."""
 import argparse
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from os import makedirs
 from pathlib import Path
+from typing import List, Optional
 
+import numpy as np
 from tqdm import tqdm
 
+from pmotif_lib.p_metric.p_metric import PMetric
 from pmotif_lib.p_motif_graph import PMotifGraph, PMotifGraphWithRandomization
-from pmotif_lib.p_metric.p_anchor_node_distance import PAnchorNodeDistance
 from pmotif_lib.p_metric.p_degree import PDegree
 from pmotif_lib.p_metric.p_graph_module_participation import PGraphModuleParticipation
 
-from pmotif_cml_interface import add_common_args, add_experiment_out_arg, add_workers_arg
-from util import process_graph, get_edgelist_format, EdgelistFormat
+from checkpoint import GraphManifest
+from pmotif_cml_interface import (
+    add_common_args,
+    add_experiment_out_arg,
+    add_workers_arg,
+    add_graph_workers_args,
+    add_shard_args,
+    add_scan_ahead_arg,
+    add_random_seed_arg,
+)
+from anchor_node_distance import BfsPAnchorNodeDistance
+from randomization import create_random_graphs
+from sharding import Shard, order_random_graphs, missing_indices, incomplete_shards
+from util import (
+    process_graph,
+    process_graphs,
+    get_edgelist_format,
+    EdgelistFormat,
+    get_peak_memory_gb,
+    get_memory_budget_gb,
+    parallel_graph_count,
+    is_processed,
+)
 
 
-def main(edgelist: Path, out: Path, graphlet_size: int, workers: int = 1, random_graphs: int = 0):
+def process_swapped_graph(swapped_graph: PMotifGraph, graphlet_size: int, metrics: List[PMetric], workers: int):
+    """Run a p-motif detection on a single random graph."""
+    process_graph(
+        swapped_graph,
+        graphlet_size,
+        metrics,
+        workers=workers,
+        check_validity=False,
+        edgelist_format=EdgelistFormat.SIMPLE_WEIGHT,  # Random Graphs are generated to contain weights
+    )
+
+
+def process_swapped_graphs(
+    swapped_graphs: List[PMotifGraph],
+    graphlet_size: int,
+    metrics: List[PMetric],
+    workers: int,
+    graph_workers: int,
+    scan_ahead: int = 1,
+):
+    """Run a p-motif detection on all random graphs, processing `graph_workers` graphs at once.
+    Graphlet detection of one graph overlaps with the metric calculation of others: in separate processes,
+    or with a single graph worker, by detecting the graphlets of the next `scan_ahead` graphs in the background.
+    Random graphs which are already completely processed (e.g. by an interrupted run) are skipped."""
+    pending_graphs = [
+        swapped_graph
+        for swapped_graph in swapped_graphs
+        if not is_processed(GraphManifest(swapped_graph, graphlet_size), metrics, EdgelistFormat.SIMPLE_WEIGHT)
+    ]
+    if len(pending_graphs) < len(swapped_graphs):
+        print(f"Skipping {len(swapped_graphs) - len(pending_graphs)} already processed random graphs.")
+    swapped_graphs = pending_graphs
+
+    if graph_workers == 1:
+        processed_graphs = process_graphs(
+            swapped_graphs,
+            graphlet_size,
+            metrics,
+            EdgelistFormat.SIMPLE_WEIGHT,  # Random Graphs are generated to contain weights
+            workers=workers,
+            scan_ahead=scan_ahead,
+        )
+        for _ in tqdm(processed_graphs, total=len(swapped_graphs), desc="Processing swapped graphs", leave=True):
+            pass
+        return
+
+    workers_per_graph = max(1, workers // graph_workers)
+    with ProcessPoolExecutor(max_workers=graph_workers) as executor:
+        futures = [
+            executor.submit(process_swapped_graph, swapped_graph, graphlet_size, metrics, workers_per_graph)
+            for swapped_graph in swapped_graphs
+        ]
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Processing swapped graphs", leave=True):
+            future.result()  # Re-raise errors of the worker
+
+
+def create_metrics() -> List[PMetric]:
+    """Create the three p-Metrics of a p-motif detection."""
+    return [PDegree(), BfsPAnchorNodeDistance(), PGraphModuleParticipation()]
+
+
+def record_ensemble(manifest: GraphManifest, random_graphs: int, random_seed: Optional[int]) -> int:
+    """Record the requested number of random graphs and their seed in the manifest of the original graph,
+    and return the seed. The seed of an ensemble recorded earlier is kept, so that missing random graphs
+    are recreated equally; without any seed, a random one is recorded."""
+    if manifest.ensemble is not None:
+        recorded_seed = manifest.ensemble["random_seed"]
+        if random_seed is not None and random_seed != recorded_seed:
+            raise ValueError(
+                f"The random graphs were created from the seed {recorded_seed}, not {random_seed}. "
+                f"Remove `--random-seed` to complete the ensemble."
+            )
+        random_seed = recorded_seed
+    elif random_seed is None:
+        random_seed = np.random.SeedSequence().entropy
+    manifest.record_ensemble(random_graphs, random_seed)
+    return random_seed
+
+
+def main(
+    edgelist: Path,
+    out: Path,
+    graphlet_size: int,
+    workers: int = 1,
+    random_graphs: int = 0,
+    graph_workers: int = 1,
+    memory_budget: Optional[float] = None,
+    shard: Optional[Shard] = None,
+    prepare_only: bool = False,
+    scan_ahead: int = 1,
+    random_seed: Optional[int] = None,
+):
     """Create three p-Metrics, generate random graphs from the original graph, and
-    run a p-motif detection on the graphs (or a graphlet-detection if random_graphs=0)."""
-    degree = PDegree()
-    anchor_node = PAnchorNodeDistance()
-    graph_module_participation = PGraphModuleParticipation()
+    run a p-motif detection on the graphs (or a graphlet-detection if random_graphs=0).
+    Up to `graph_workers` random graphs are processed in parallel, as long as their estimated memory
+    (the peak memory of processing the original graph) fits into `memory_budget` GB.
+    With a single graph worker, graphlets of the next `scan_ahead` random graphs are detected in the background.
+    Random graphs are generated by `workers` processes, from seeds derived from `random_seed`.
 
+    With `prepare_only`, only the original graph is processed and the random graphs are created.
+    With a `shard`, only the random graphs of that shard are processed, which requires a preparing run first."""
     pmotif_graph = PMotifGraph(edgelist, out)
+    edgelist_format = get_edgelist_format(edgelist)
+    metrics = create_metrics()
 
-    process_graph(
-        pmotif_graph,
+    if shard is None:
+        manifest = GraphManifest(pmotif_graph, graphlet_size)
+        was_processed = is_processed(manifest, metrics, edgelist_format)
+        process_graph(
+            pmotif_graph,
+            graphlet_size,
+            metrics,
+            workers=workers,
+            edgelist_format=edgelist_format,
+            manifest=manifest,
+        )
+        if not was_processed:
+            manifest.record_peak_memory(get_peak_memory_gb())
+
+        if random_graphs >= 0:
+            random_seed = record_ensemble(manifest, random_graphs, random_seed)
+        randomized_pmotif_graph, _ = create_random_graphs(
+            pmotif_graph, random_graphs, seed=random_seed, workers=workers
+        )
+        if prepare_only:
+            return
+        swapped_graphs = randomized_pmotif_graph.swapped_graphs
+    else:
+        # Shards run concurrently, so they only read the manifest of the original graph
+        manifest = GraphManifest(pmotif_graph, graphlet_size, trust_unrecorded=False)
+        if not is_processed(manifest, metrics, edgelist_format):
+            raise ValueError(
+                f"The original graph is not processed yet, run with `--prepare-only` before processing shard {shard}."
+            )
+        randomized_pmotif_graph = PMotifGraphWithRandomization(edgelist, out)
+        swapped_graphs = shard.select(order_random_graphs(randomized_pmotif_graph.swapped_graphs))
+        print(
+            f"Processing shard {shard}: {len(swapped_graphs)} "
+            f"of {len(randomized_pmotif_graph.swapped_graphs)} random graphs."
+        )
+    del pmotif_graph
+
+    if memory_budget is None:
+        memory_budget = get_memory_budget_gb()
+    graph_memory = manifest.peak_memory_gb or 0  # Unknown, if the original was processed by an older version
+    parallel_graphs = parallel_graph_count(graph_workers, memory_budget, graph_memory)
+    if parallel_graphs < graph_workers:
+        print(
+            f"Processing {parallel_graphs} instead of {graph_workers} graphs at once, "
+            f"as each needs ~{graph_memory:.2f}GB of the {memory_budget}GB memory budget."
+        )
+
+    process_swapped_graphs(
+        swapped_graphs,
         graphlet_size,
-        [degree, anchor_node, graph_module_participation],
+        metrics,
         workers=workers,
-        edgelist_format=get_edgelist_format(edgelist),
+        graph_workers=parallel_graphs,
+        scan_ahead=scan_ahead,
     )
 
-    randomized_pmotif_graph = PMotifGraphWithRandomization.create_from_pmotif_graph(
-        pmotif_graph, random_graphs
-    )
-    del pmotif_graph
 
-    pbar_swapped_graphs = tqdm(
-        randomized_pmotif_graph.swapped_graphs,
-        desc="Processing swapped graphs",
-        leave=True,
-    )
-    swapped_graph: PMotifGraph
-    for swapped_graph in pbar_swapped_graphs:
-        process_graph(
-            swapped_graph,
-            graphlet_size,
-            [degree, anchor_node, graph_module_participation],
-            check_validity=False,
-            edgelist_format=EdgelistFormat.SIMPLE_WEIGHT,  # Random Graphs are generated to contain weights
+def merge_shards(edgelist: Path, out: Path, graphlet_size: int, shards: int) -> bool:
+    """Verify that the original graph and the random graphs of all `shards` are completely processed,
+    reporting missing random graphs and the shards which have to be rerun. Only reads the manifests."""
+    metrics = create_metrics()
+    pmotif_graph = PMotifGraph(edgelist, out)
+    complete = True
+
+    manifest = GraphManifest(pmotif_graph, graphlet_size, trust_unrecorded=False)
+    if not is_processed(manifest, metrics, get_edgelist_format(edgelist)):
+        print("The original graph is not completely processed, rerun with `--prepare-only`.")
+        complete = False
+
+    swapped_graphs = PMotifGraphWithRandomization(edgelist, out).swapped_graphs
+    if manifest.ensemble is None:
+        # Prepared by an older version, only gaps between the random graphs present can be found
+        missing = missing_indices(swapped_graphs)
+        random_graphs = len(swapped_graphs) + len(missing)
+    else:
+        random_graphs = manifest.ensemble["random_graphs"]
+        missing = missing_indices(swapped_graphs, random_graphs)
+    if len(missing) > 0:
+        print(
+            f"Random graphs {missing} are missing from the ensemble, "
+            f"rerun with `--prepare-only --random-graphs {random_graphs}`."
         )
+        complete = False
+
+    incomplete = incomplete_shards(
+        swapped_graphs,
+        shards,
+        lambda swapped_graph: is_processed(
+            GraphManifest(swapped_graph, graphlet_size, trust_unrecorded=False),
+            metrics,
+            EdgelistFormat.SIMPLE_WEIGHT,
+        ),
+    )
+    for shard, pending_graphs in incomplete.items():
+        names = ", ".join(swapped_graph.edgelist_path.name for swapped_graph in pending_graphs)
+        print(f"Shard {shard} has {len(pending_graphs)} incomplete random graphs: {names}")
+    if len(incomplete) > 0:
+        print("Rerun the shards " + " ".join(str(shard) for shard in incomplete))
+        complete = False
+
+    if complete:
+        print(f"All {len(swapped_graphs)} random graphs of {shards} shards are completely processed.")
+    return complete
 
 
 if __name__ == "__main__":
@@ -57,6 +254,10 @@ if __name__ == "__main__":
     add_common_args(parser)
     add_experiment_out_arg(parser)
     add_workers_arg(parser)
+    add_graph_workers_args(parser)
+    add_shard_args(parser)
+    add_scan_ahead_arg(parser)
+    add_random_seed_arg(parser)
     parser.add_argument("--random-graphs", required=False, type=int, default=1)
 
     args = parser.parse_args()
@@ -68,4 +269,19 @@ if __name__ == "__main__":
 
     makedirs(OUT, exist_ok=True)
 
-    main(GRAPH_EDGELIST, OUT, GRAPHLET_SIZE, random_graphs=RANDOM_GRAPHS, workers=args.workers)
+    if args.merge_shards is not None:
+        sys.exit(0 if merge_shards(GRAPH_EDGELIST, OUT, GRAPHLET_SIZE, args.merge_shards) else 1)
+
+    main(
+        GRAPH_EDGELIST,
+        OUT,
+        GRAPHLET_SIZE,
+        random_graphs=RANDOM_GRAPHS,
+        workers=args.workers,
+        graph_workers=args.graph_workers,
+        memory_budget=args.memory_budget,
+        shard=args.shard,
+        prepare_only=args.prepare_only,
+        scan_ahead=args.scan_ahead,
+        random_seed=args.random_seed,
+    )
@@ -2,67 +2,119 @@
 import argparse
 from os import makedirs
 from pathlib import Path
-from typing import List, Dict
-import time
+from typing import List, Dict, Optional, Tuple
 import logging
 from tqdm import tqdm
 
 from pmotif_lib.p_metric.p_metric import PMetric
-from pmotif_lib.p_motif_graph import PMotifGraph, PMotifGraphWithRandomization
+from pmotif_lib.p_motif_graph import PMotifGraph
 from pmotif_lib.gtrieScanner.wrapper import run_gtrieScanner
-from pmotif_lib.p_metric.p_anchor_node_distance import PAnchorNodeDistance
 from pmotif_lib.p_metric.p_degree import PDegree
 from pmotif_lib.p_metric.p_graph_module_participation import PGraphModuleParticipation
 from pmotif_lib.p_metric.metric_processing import calculate_metrics
 
-from pmotif_cml_interface import add_common_args, add_experiment_out_arg, add_workers_arg
-from util import assert_validity, get_edgelist_format, EdgelistFormat
+from pmotif_cml_interface import (
+    add_common_args,
+    add_experiment_out_arg,
+    add_workers_arg,
+    add_scan_ahead_arg,
+    add_random_seed_arg,
+)
+from anchor_node_distance import BfsPAnchorNodeDistance
+from randomization import create_random_graphs
+from telemetry import Telemetry, STAGE_RECORD, TELEMETRY_SUFFIX, summarize, telemetry_name
+from util import assert_validity, get_edgelist_format, validate_edgelist, pipelined, EdgelistFormat
 
 
 GTRIESCANNER_EXECUTABLE = "gtrieScanner"  # is in PATH
 
 
+def detect_graphlets(
+    pmotif_graph: PMotifGraph,
+    graphlet_size: int,
+    edgelist_format: EdgelistFormat,
+    telemetry: Telemetry,
+    graph_label: str,
+    check_validity: bool = True,
+    overlapping: bool = False,
+) -> Dict[str, float]:
+    """Run a graphlet detection on the given graph measuring its runtime.
+    The stage measurement and the graph size are recorded to `telemetry`, labeled with `graph_label`,
+    without CPU time if the detection is `overlapping` with the metric calculation of another graph."""
+    if check_validity:
+        stats = assert_validity(pmotif_graph)
+    else:
+        stats = validate_edgelist(pmotif_graph.get_graph_path())
+
+    with telemetry.stage(graph_label, "graphlet_detection", overlapping=overlapping) as graphlet_stage:
+        run_gtrieScanner(
+            graph_edgelist=pmotif_graph.get_graph_path(),
+            gtrieScanner_executable=GTRIESCANNER_EXECUTABLE,
+            directed=False,
+            graphlet_size=graphlet_size,
+            output_directory=pmotif_graph.get_graphlet_directory(),
+            with_weights=True if edgelist_format == EdgelistFormat.SIMPLE_WEIGHT else False,
+        )
+    telemetry.record_graph(graph_label, pmotif_graph, graphlet_size, stats.node_count, stats.edge_count)
+    return {"graphlet_runtime": graphlet_stage["wall_s"]}
+
+
+def calculate_graph_metrics(
+    pmotif_graph: PMotifGraph,
+    graphlet_size: int,
+    metrics: List[PMetric],
+    workers: int,
+    telemetry: Telemetry,
+    graph_label: str,
+    overlapping: bool = False,
+) -> Dict[str, float]:
+    """Run the metric calculation on the graphlets of the given graph measuring its runtime.
+    CPU time is not recorded if the calculation is `overlapping` with the graphlet detection of other graphs."""
+    with telemetry.stage(graph_label, "metric_calculation", overlapping=overlapping, workers=workers) as metric_stage:
+        calculate_metrics(pmotif_graph, graphlet_size, metrics, True, workers=workers)
+    return {"metric_runtime": metric_stage["wall_s"]}
+
+
 def process_graph(
     pmotif_graph: PMotifGraph,
     graphlet_size: int,
     metrics: List[PMetric],
     edgelist_format: EdgelistFormat,
     workers: int,
+    telemetry: Telemetry,
+    graph_label: str,
     check_validity: bool = True,
 ) -> Dict[str, float]:
     """Run a graphlet detection and metric calculation (if any) on the given graph measuring
-    runtimes."""
-    if check_validity:
-        assert_validity(pmotif_graph)
-
-    graphlet_runtime_start = time.time()
-    run_gtrieScanner(
-        graph_edgelist=pmotif_graph.get_graph_path(),
-        gtrieScanner_executable=GTRIESCANNER_EXECUTABLE,
-        directed=False,
-        graphlet_size=graphlet_size,
-        output_directory=pmotif_graph.get_graphlet_directory(),
-        with_weights=True if edgelist_format == EdgelistFormat.SIMPLE_WEIGHT else False,
+    runtimes. Stage measurements and the graph size are recorded to `telemetry`, labeled with `graph_label`."""
+    graphlet_log = detect_graphlets(
+        pmotif_graph, graphlet_size, edgelist_format, telemetry, graph_label, check_validity
     )
-    graphlet_runtime = time.time() - graphlet_runtime_start
-
     if len(metrics) == 0:
         return {}
 
-    metric_runtime_start = time.time()
-    calculate_metrics(pmotif_graph, graphlet_size, metrics, True, workers=workers)
-    metric_runtime = time.time() - metric_runtime_start
-    return {
-        "graphlet_runtime": graphlet_runtime,
-        "metric_runtime": metric_runtime,
-    }
+    metric_log = calculate_graph_metrics(pmotif_graph, graphlet_size, metrics, workers, telemetry, graph_label)
+    return {**graphlet_log, **metric_log}
 
 
-def main(edgelist: Path, out: Path, graphlet_size: int, random_graphs: int = 0, workers: int = 1):
+def main(
+    edgelist: Path,
+    out: Path,
+    graphlet_size: int,
+    telemetry: Telemetry,
+    random_graphs: int = 0,
+    workers: int = 1,
+    scan_ahead: int = 0,
+    random_seed: Optional[int] = None,
+):
     """Create three p-Metrics, generate random graphs from the original graph, and
     run a p-motif detection on the graphs (or a graphlet-detection if random_graphs=0),
-    collecting runtime logs."""
-    metrics = [PDegree(), PAnchorNodeDistance(), PGraphModuleParticipation()]
+    collecting runtime logs and telemetry.
+    Graphlets of the next `scan_ahead` random graphs are detected while the metrics of the current one are
+    calculated. CPU time of these stages cannot be told apart then, and is only recorded with a `scan_ahead` of 0.
+    Random graphs are generated by `workers` processes, from seeds derived from `random_seed`,
+    and the creation of each is recorded as a stage of the random graph."""
+    metrics = [PDegree(), BfsPAnchorNodeDistance(), PGraphModuleParticipation()]
 
     pmotif_graph = PMotifGraph(edgelist, out)
 
@@ -72,36 +124,54 @@ def main(edgelist: Path, out: Path, graphlet_size: int, random_graphs: int = 0,
         metrics,
         workers=workers,
         edgelist_format=get_edgelist_format(edgelist),
+        telemetry=telemetry,
+        graph_label="original",
     )
     for runtime_name, runtime in log_r.items():
         logger.info("%s: %s", runtime_name, runtime)
 
-    random_creation_runtime_start = time.time()
-    randomized_pmotif_graph = PMotifGraphWithRandomization.create_from_pmotif_graph(
-        pmotif_graph, random_graphs
-    )
-    random_creation_runtime = time.time() - random_creation_runtime_start
+    with telemetry.stage("original", "random_creation", random_graphs=random_graphs) as random_creation_stage:
+        randomized_pmotif_graph, random_graph_measurements = create_random_graphs(
+            pmotif_graph, random_graphs, seed=random_seed, workers=workers
+        )
     logger.info(
-        "Random Creation Runtime: %s (created %s)", random_creation_runtime, random_graphs
+        "Random Creation Runtime: %s (created %s)", random_creation_stage["wall_s"], random_graphs
     )
+    # Measured by the process which created the random graph
+    for i, measurements in enumerate(random_graph_measurements):
+        telemetry.record(STAGE_RECORD, graph=f"random_{i}", stage="random_creation", **measurements)
+        logger.info("Random %s, random_creation_runtime: %s", i, measurements["wall_s"])
 
     del pmotif_graph
 
-    pbar_swapped_graphs = tqdm(
-        randomized_pmotif_graph.swapped_graphs,
-        desc="Processing swapped graphs",
-        leave=True,
-    )
-    swapped_graph: PMotifGraph
-    for i, swapped_graph in enumerate(pbar_swapped_graphs):
-        log_r = process_graph(
+    def detect_swapped_graphlets(indexed_graph: Tuple[int, PMotifGraph]) -> Dict[str, float]:
+        i, swapped_graph = indexed_graph
+        return detect_graphlets(
             swapped_graph,
             graphlet_size,
-            metrics,
-            workers=workers,
-            check_validity=False,
             edgelist_format=EdgelistFormat.SIMPLE_WEIGHT,  # Random Graphs are generated to contain weights
+            telemetry=telemetry,
+            graph_label=f"random_{i}",
+            check_validity=False,
+            overlapping=scan_ahead > 0,
         )
+
+    # Graphlets of the next `scan_ahead` random graphs are detected while the metrics of the current one are calculated
+    pbar_swapped_graphs = tqdm(
+        pipelined(enumerate(randomized_pmotif_graph.swapped_graphs), detect_swapped_graphlets, scan_ahead),
+        total=len(randomized_pmotif_graph.swapped_graphs),
+        desc="Processing swapped graphs",
+        leave=True,
+    )
+    for (i, swapped_graph), graphlet_log in pbar_swapped_graphs:
+        log_r = graphlet_log
+        if len(metrics) > 0:
+            log_r = {
+                **graphlet_log,
+                **calculate_graph_metrics(
+                    swapped_graph, graphlet_size, metrics, workers, telemetry, f"random_{i}", scan_ahead > 0
+                ),
+            }
         for runtime_name, runtime in log_r.items():
             logger.info("Random %s, %s: %s", i, runtime_name, runtime)
 
@@ -111,6 +181,9 @@ if __name__ == "__main__":
     add_common_args(parser)
     add_experiment_out_arg(parser)
     add_workers_arg(parser)
+    # Stages do not overlap by default, so their CPU time is measured
+    add_scan_ahead_arg(parser, default=0)
+    add_random_seed_arg(parser)
     parser.add_argument("--random-graphs", required=False, type=int, default=0)
     parser.add_argument(
         "--benchmarking-run", required=True, type=int, choices=[1, 2, 3, 4, 5]
@@ -139,7 +212,19 @@ if __name__ == "__main__":
 
     logger = logging.getLogger("benchmark")
 
-    total_runtime_start = time.time()
-    main(GRAPH_EDGELIST, OUT, GRAPHLET_SIZE, RANDOM_GRAPHS, workers=args.workers)
-    total_runtime = time.time() - total_runtime_start
-    logger.info("Total Runtime: %s", total_runtime)
+    # Structured telemetry of all runs of this configuration is aggregated in `--experiment-out`
+    TELEMETRY_NAME = telemetry_name(GRAPH_EDGELIST, GRAPHLET_SIZE, RANDOM_GRAPHS)
+    with Telemetry(logs_out / f"{TELEMETRY_NAME}{TELEMETRY_SUFFIX}", BENCHMARKING_RUN) as telemetry:
+        with telemetry.stage("all", "total") as total_stage:
+            main(
+                GRAPH_EDGELIST,
+                OUT,
+                GRAPHLET_SIZE,
+                telemetry,
+                RANDOM_GRAPHS,
+                workers=args.workers,
+                scan_ahead=args.scan_ahead,
+                random_seed=args.random_seed,
+            )
+    logger.info("Total Runtime: %s", total_stage["wall_s"])
+    summarize(args.experiment_out, TELEMETRY_NAME)
@@ -17,7 +17,7 @@ from pmotif_lib.p_metric.p_graph_module_participation import PGraphModulePartici
 from custom_pmetrics.ExternalWeight import ExternalWeight
 from custom_pmetrics.GivenModuleParticipation import GivenModuleParticipation
 from custom_pmetrics.InternalWeight import InternalWeight
-from pmotif_cml_interface import add_common_args, add_experiment_out_arg
+from pmotif_cml_interface import add_common_args, add_experiment_out_arg, add_workers_arg
 from util import process_graph, get_edgelist_format
 
 
@@ -27,6 +27,7 @@ def main(
     given_modules: List[List[str]],
     out: Path,
     graphlet_size: int,
+    workers: int = 1,
 ):
     """Create three p-Metrics, generate random graphs from the original graph, and
     run a p-motif detection on the graphs (or a graphlet-detection if random_graphs=0).
@@ -36,6 +37,8 @@ def main(
     :param weighted_graph: the same nx.Graph as the graph behind `edgelist`, but with edge weights.
     :param given_modules: A list of node lists. Node labels have to be in `edgelist` param nodes labels. Each node
     may only occur once.
+    :param workers: Number of processes calculating the pMetrics. The external knowledge of the custom pMetrics
+    is shared with the processes through memory-mapped files.
     """
 
     metrics = [
@@ -55,6 +58,7 @@ def main(
         graphlet_size,
         metrics,
         edgelist_format=get_edgelist_format(edgelist),
+        workers=workers,
     )
 
     # No random graphs, as given modules, external weight, and internal weight are not defined on randomized graphs
@@ -64,6 +68,7 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     add_common_args(parser)
     add_experiment_out_arg(parser)
+    add_workers_arg(parser, required=False)
     parser.add_argument("--weighted-edgelist-path", required=True, type=Path)
     parser.add_argument(
         "--node-mapping",
@@ -83,6 +88,7 @@ if __name__ == "__main__":
     graph_edgelist = args.edgelist_path
     out = args.experiment_out / graph_edgelist.stem
     graphlet_size = args.graphlet_size
+    workers = args.workers
 
     # External knowledge Args
     weighted_graph_edgelist = args.weighted_edgelist_path
@@ -111,4 +117,4 @@ if __name__ == "__main__":
 
     makedirs(out, exist_ok=True)
 
-    main(graph_edgelist, weighted_graph, mapped_modules, out, graphlet_size)
+    main(graph_edgelist, weighted_graph, mapped_modules, out, graphlet_size, workers)
@@ -0,0 +1,274 @@
+"""Pre-flight estimate of a p-motif detection job: the number of graphlet occurrences, the size of the output on disk,
+and the peak memory of the detection and of the analysis data creation.
+Graphlet occurrences are estimated by sampling wedges (size 3) and 3-paths (size 4), without enumerating them.
+Exits with `REFUSE_EXIT_CODE` if the detection would exceed the memory budget."""
+import argparse
+import json
+import sys
+from pathlib import Path
+from typing import Dict, NamedTuple, Optional
+
+import numpy as np
+from pmotif_lib.graphlet_representation import graphlet_class_to_name
+
+from pmotif_cml_interface import add_common_args
+from util import get_memory_budget_gb
+
+REFUSE_EXIT_CODE = 2
+
+TRIANGLE = "011 101 110"
+THREE_DASH = "011 100 100"
+FOUR_DASH = "0110 1001 1000 0100"
+FORK = "0111 1000 1000 1000"
+SPOON = "0111 1010 1100 1000"
+SQUARE = "0110 1001 1001 0110"
+CROSSED_SQUARE = "0111 1011 1100 1100"
+DOUBLE_CROSSED_SQUARE = "0111 1011 1101 1110"
+
+# Number of (non-induced) 3-paths contained in each graphlet class of size 4
+THREE_PATHS_PER_CLASS = {FOUR_DASH: 1, SPOON: 2, SQUARE: 4, CROSSED_SQUARE: 6, DOUBLE_CROSSED_SQUARE: 12}
+
+# Cost per graphlet occurrence, calibrated on runs of `pmotif_detection.py` and `create_analysis_data.py`.
+# The anchor node distance stores a distance per hub for each occurrence, adding cost per occurrence and hub.
+DETECTION_BYTES_PER_OCCURRENCE = {3: 1000, 4: 1000}
+DETECTION_BYTES_PER_OCCURRENCE_AND_HUB = 6
+ANALYSIS_BYTES_PER_OCCURRENCE = {3: 800, 4: 1350}
+ANALYSIS_BYTES_PER_OCCURRENCE_AND_HUB = 23
+DISK_BYTES_PER_OCCURRENCE = {3: 28, 4: 33}  # Zipped graphlet positions, occurrence store (4 k + 1 bytes) and pMetrics
+DISK_BYTES_PER_OCCURRENCE_AND_HUB = 3
+ANALYSIS_DISK_BYTES_PER_OCCURRENCE = 80
+# Memory per edge of the networkx graph, and the memory of the interpreter and libraries
+GRAPH_BYTES_PER_EDGE = 600
+BASE_MEMORY_BYTES = 130 * 2 ** 20
+
+
+class CSRGraph(NamedTuple):
+    """Simple, undirected graph as sorted adjacency arrays, with a sorted edge key per direction for edge lookups."""
+    indptr: np.ndarray
+    indices: np.ndarray
+    edge_keys: np.ndarray  # u * node_count + v for each directed edge
+    node_count: int
+
+    @property
+    def degrees(self) -> np.ndarray:
+        return np.diff(self.indptr)
+
+    def has_edges(self, u: np.ndarray, v: np.ndarray) -> np.ndarray:
+        """Whether each pair (u[i], v[i]) is connected."""
+        keys = u * self.node_count + v
+        at = np.minimum(np.searchsorted(self.edge_keys, keys), len(self.edge_keys) - 1)
+        return self.edge_keys[at] == keys
+
+    def random_neighbors(self, nodes: np.ndarray, rng: np.random.Generator, excluded: Optional[np.ndarray] = None):
+        """Return a uniformly random neighbor of each node, other than the respective `excluded` neighbor.
+        Nodes need at least one neighbor besides the excluded one."""
+        degrees = self.degrees[nodes]
+        if excluded is None:
+            return self.indices[self.indptr[nodes] + rng.integers(0, degrees)]
+        # Draw among all but the last neighbor, and replace the excluded neighbor by the last one
+        picked = self.indices[self.indptr[nodes] + rng.integers(0, degrees - 1)]
+        last = self.indices[self.indptr[nodes] + degrees - 1]
+        return np.where(picked == excluded, last, picked)
+
+
+def load_csr_graph(edgelist: Path) -> CSRGraph:
+    """Read an edgelist (`u v` or `u v w`), ignoring weights, self-loops and duplicate edges.
+    Node ids are remapped to 0..n-1, so they need neither be dense nor non-negative."""
+    edges = np.loadtxt(edgelist, usecols=(0, 1), dtype=np.int64, comments="#", ndmin=2)
+    edges = edges[edges[:, 0] != edges[:, 1]]
+    node_ids, edges = np.unique(edges, return_inverse=True)
+    edges = edges.reshape(-1, 2)
+    edges = np.unique(np.sort(edges, axis=1), axis=0)
+    node_count = len(node_ids)
+
+    directed = np.concatenate((edges, edges[:, ::-1]))
+    edge_keys = np.sort(directed[:, 0] * node_count + directed[:, 1])
+    indices = edge_keys % node_count
+    indptr = np.searchsorted(edge_keys // node_count, np.arange(node_count + 1))
+    return CSRGraph(indptr, indices, edge_keys, node_count)
+
+
+def sample(weights: np.ndarray, samples: int, rng: np.random.Generator) -> np.ndarray:
+    """Draw `samples` indices with probability proportional to `weights`."""
+    cumulative = np.cumsum(weights, dtype=np.float64)
+    return np.minimum(np.searchsorted(cumulative, rng.random(samples) * cumulative[-1], side="right"), len(weights) - 1)
+
+
+def estimate_size_3(graph: CSRGraph, samples: int, rng: np.random.Generator) -> Dict[str, float]:
+    """Estimate the occurrences of each graphlet class of size 3 by wedge sampling:
+    the fraction of closed wedges among uniformly sampled wedges, times the (exact) number of wedges."""
+    degrees = graph.degrees.astype(np.float64)
+    wedges_per_center = degrees * (degrees - 1) / 2
+    wedges = wedges_per_center.sum()
+    if wedges == 0:
+        return {TRIANGLE: 0.0, THREE_DASH: 0.0}
+
+    centers = sample(wedges_per_center, samples, rng)
+    first = graph.random_neighbors(centers, rng)
+    second = graph.random_neighbors(centers, rng, excluded=first)
+    closed = graph.has_edges(first, second).mean()
+
+    triangles = closed * wedges / 3  # Each triangle closes three wedges
+    return {TRIANGLE: triangles, THREE_DASH: wedges - 3 * triangles}
+
+
+def estimate_size_4(graph: CSRGraph, samples: int, rng: np.random.Generator) -> Dict[str, float]:
+    """Estimate the occurrences of each graphlet class of size 4 by 3-path sampling (Jha, Seshadhri, Pinar 2015):
+    uniformly sampled 3-paths are classified by the induced subgraph of their nodes, and each class count
+    follows from the (exact) number of 3-paths and the number of 3-paths each class contains.
+    Forks (stars) contain no 3-path, their count follows from the exact number of (non-induced) stars."""
+    degrees = graph.degrees.astype(np.float64)
+    estimate = {graphlet_class: 0.0 for graphlet_class in [FOUR_DASH, FORK, SPOON, SQUARE, CROSSED_SQUARE,
+                                                           DOUBLE_CROSSED_SQUARE]}
+    stars = (degrees * (degrees - 1) * (degrees - 2) / 6).sum()
+
+    # Each undirected edge (u, v) is the center of (d(u) - 1) * (d(v) - 1) 3-paths
+    u = np.repeat(np.arange(graph.node_count), graph.degrees)
+    v = graph.indices
+    forward = u < v
+    u, v = u[forward], v[forward]
+    paths_per_edge = (degrees[u] - 1) * (degrees[v] - 1)
+    paths = paths_per_edge.sum()
+
+    if paths > 0:
+        centers = sample(paths_per_edge, samples, rng)
+        center_u, center_v = u[centers], v[centers]
+        end_u = graph.random_neighbors(center_u, rng, excluded=center_v)
+        end_v = graph.random_neighbors(center_v, rng, excluded=center_u)
+        # Paths closing into a triangle are no 3-path on 4 nodes
+        proper = end_u != end_v
+
+        chords = (
+            graph.has_edges(end_u, center_v).astype(int)
+            + graph.has_edges(center_u, end_v)
+            + graph.has_edges(end_u, end_v)
+        )
+        cycle = graph.has_edges(end_u, end_v) & (chords == 1)
+        classes = {
+            FOUR_DASH: proper & (chords == 0),
+            SPOON: proper & (chords == 1) & ~cycle,
+            SQUARE: proper & cycle,
+            CROSSED_SQUARE: proper & (chords == 2),
+            DOUBLE_CROSSED_SQUARE: proper & (chords == 3),
+        }
+        for graphlet_class, sampled in classes.items():
+            estimate[graphlet_class] = sampled.mean() * paths / THREE_PATHS_PER_CLASS[graphlet_class]
+
+    # Stars within spoons, crossed squares and double crossed squares are not induced
+    estimate[FORK] = max(
+        0.0,
+        stars - estimate[SPOON] - 2 * estimate[CROSSED_SQUARE] - 4 * estimate[DOUBLE_CROSSED_SQUARE],
+    )
+    return estimate
+
+
+def count_hubs(degrees: np.ndarray) -> int:
+    """Count the anchor nodes of `PAnchorNodeDistance`: nodes with a degree above mean + one standard deviation."""
+    degrees = degrees[degrees > 0]
+    return int(np.count_nonzero(degrees > degrees.mean() + degrees.std(ddof=1)))
+
+
+def estimate_job(
+    edgelist: Path,
+    graphlet_size: int,
+    random_graphs: int = 0,
+    samples: int = 100_000,
+    seed: int = 0,
+) -> Dict:
+    """Estimate the graphlet occurrences, the output size on disk, and the peak memory of the detection
+    (per graph) and the analysis data creation (in memory and streaming) of a graph.
+    Random graphs keep the degree sequence, so they are assumed to cost the same as the original graph."""
+    graph = load_csr_graph(edgelist)
+    rng = np.random.default_rng(seed)
+    estimate_occurrences = estimate_size_3 if graphlet_size == 3 else estimate_size_4
+    per_class = estimate_occurrences(graph, samples, rng)
+    occurrences = sum(per_class.values())
+    edges = len(graph.edge_keys) // 2
+    nodes = int(np.count_nonzero(graph.degrees))
+    hubs = count_hubs(graph.degrees)
+
+    graph_bytes = BASE_MEMORY_BYTES + edges * GRAPH_BYTES_PER_EDGE
+    disk_bytes_per_graph = (
+        occurrences * (DISK_BYTES_PER_OCCURRENCE[graphlet_size] + DISK_BYTES_PER_OCCURRENCE_AND_HUB * hubs)
+        + hubs * nodes * 10  # Shortest path lookup of each hub
+    )
+    return {
+        "edgelist": str(edgelist),
+        "graphlet_size": graphlet_size,
+        "nodes": nodes,
+        "edges": edges,
+        "hubs": hubs,
+        "occurrences": round(occurrences),
+        "occurrences_per_class": {
+            graphlet_class_to_name(graphlet_class): round(count) for graphlet_class, count in per_class.items()
+        },
+        "disk_gb": disk_bytes_per_graph * (max(random_graphs, 0) + 1) / 2 ** 30,
+        "analysis_disk_gb": occurrences * ANALYSIS_DISK_BYTES_PER_OCCURRENCE / 2 ** 30,
+        "detection_memory_gb": (graph_bytes + occurrences * (
+            DETECTION_BYTES_PER_OCCURRENCE[graphlet_size] + DETECTION_BYTES_PER_OCCURRENCE_AND_HUB * hubs
+        )) / 2 ** 30,
+        "analysis_memory_gb": (graph_bytes + occurrences * (
+            ANALYSIS_BYTES_PER_OCCURRENCE[graphlet_size] + ANALYSIS_BYTES_PER_OCCURRENCE_AND_HUB * hubs
+        )) / 2 ** 30,
+        # Streaming keeps the occurrences on disk and only distributions per graphlet class in memory
+        "streaming_analysis_memory_gb": graph_bytes / 2 ** 30,
+    }
+
+
+def decide(estimate: Dict, memory_budget: Optional[float]) -> Dict:
+    """Decide whether the detection fits into `memory_budget` GB, and whether the analysis data creation
+    has to stream. Without a budget, every job is run without streaming."""
+    if memory_budget is None:
+        return {"memory_budget_gb": None, "run_detection": True, "streaming": False}
+    return {
+        "memory_budget_gb": memory_budget,
+        "run_detection": bool(estimate["detection_memory_gb"] <= memory_budget),
+        "streaming": bool(estimate["analysis_memory_gb"] > memory_budget),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Estimate graphlet occurrences, output size and peak memory of a p-motif detection job. "
+                    f"Exits with {REFUSE_EXIT_CODE} if the detection would exceed the memory budget.",
+    )
+    add_common_args(parser)
+    parser.add_argument(
+        "--memory-budget",
+        required=False,
+        type=float,
+        default=None,
+        help="Memory in GB available to the job. Defaults to the memory of the SLURM allocation, if any.",
+    )
+    parser.add_argument(
+        "--random-graphs",
+        required=False,
+        type=int,
+        default=0,
+        help="Number of random graphs to generate, added to the disk estimate. -1 (reuse random graphs) counts as 0.",
+    )
+    parser.add_argument("--samples", required=False, type=int, default=100_000, help="Number of sampled wedges/paths.")
+    parser.add_argument("--seed", required=False, type=int, default=0)
+    parser.add_argument(
+        "--print-analysis-flags",
+        action="store_true",
+        help="Only print the flags to pass to `create_analysis_data.py`, i.e. `--streaming` if it has to stream.",
+    )
+
+    args = parser.parse_args()
+
+    budget = args.memory_budget if args.memory_budget is not None else get_memory_budget_gb()
+    job = estimate_job(args.edgelist_path, args.graphlet_size, args.random_graphs, args.samples, args.seed)
+    job.update(decide(job, budget))
+
+    if args.print_analysis_flags:
+        print("--streaming" if job["streaming"] else "")
+    else:
+        print(json.dumps(job, indent=4))
+    if not job["run_detection"]:
+        print(
+            f"Refusing to run: the detection needs ~{job['detection_memory_gb']:.1f}GB "
+            f"of the {budget}GB memory budget.",
+            file=sys.stderr,
+        )
+        sys.exit(REFUSE_EXIT_CODE)
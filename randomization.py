@@ -0,0 +1,213 @@
+"""Degree preserving edge swapping on an array-backed graph, replacing the networkx based randomization of pmotif_lib.
+Random graphs are written as edgelists directly, and can be generated in parallel from independent seeds."""
+import os
+import resource
+import time
+from multiprocessing import Pool
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from pmotif_lib.gtrieScanner import graph_io
+from pmotif_lib.p_motif_graph import PMotifGraph, PMotifGraphWithRandomization
+from tqdm import tqdm
+
+# Parameters of `PMotifGraphWithRandomization.create_random_graph`
+SWAPS_PER_EDGE = 3
+TRIES_PER_SWAP = 10
+# Number of random numbers drawn at once
+RANDOM_BLOCK = 2 ** 16
+
+
+class SwapGraph:
+    """Undirected graph with a fixed degree per node, as kept by edge swaps.
+    The neighbors of node `i` occupy the slots `offsets[i]` to `offsets[i] + degrees[i]` of `slots`,
+    and `positions` hashes each directed edge `u * node_count + v` to the slot holding `v` among the neighbors of `u`.
+    Nodes are indices into `labels`, the integer labels of the edgelist the graph was read from."""
+
+    def __init__(self, labels: List[int], edges: List[Tuple[int, int]]):
+        self.labels = labels
+        self.node_count = len(labels)
+        self.degrees = [0] * self.node_count
+        for u, v in edges:
+            self.degrees[u] += 1
+            self.degrees[v] += 1
+        self.offsets = np.concatenate(([0], np.cumsum(self.degrees)[:-1])).tolist() if labels else []
+
+        self.slots = [0] * (2 * len(edges))
+        self.positions: Dict[int, int] = {}
+        filled = list(self.offsets)
+        for u, v in edges:
+            for a, b in ((u, v), (v, u)):
+                self.slots[filled[a]] = b
+                self.positions[a * self.node_count + b] = filled[a]
+                filled[a] += 1
+
+    @staticmethod
+    def from_edgelist(edgelist: Path) -> "SwapGraph":
+        """Read an edgelist the same way `PMotifGraph.load_graph` does, keeping the node order of networkx."""
+        graph = graph_io.read_edgelist(edgelist)
+        index = {node: i for i, node in enumerate(graph.nodes)}
+        return SwapGraph([int(node) for node in graph.nodes], [(index[u], index[v]) for u, v in graph.edges])
+
+    def copy(self) -> "SwapGraph":
+        """Return a copy to swap edges on, sharing the node labels, degrees and offsets which swaps keep."""
+        graph = SwapGraph.__new__(SwapGraph)
+        graph.labels, graph.node_count = self.labels, self.node_count
+        graph.degrees, graph.offsets = self.degrees, self.offsets
+        graph.slots = list(self.slots)
+        graph.positions = dict(self.positions)
+        return graph
+
+    def neighbors(self, u: int) -> List[int]:
+        return self.slots[self.offsets[u]:self.offsets[u] + self.degrees[u]]
+
+    def write_edgelist(self, path: Path, shift: int = 0):
+        """Write each edge once as `u v 1`, with labels increased by `shift`, like `graph_io.write_shifted_edgelist`.
+        The weight is necessary for gTrieScanner, which always expects one."""
+        labels = [label + shift for label in self.labels]
+        with open(path, "w", encoding="utf-8") as out:
+            for u in range(self.node_count):
+                out.writelines(f"{labels[u]} {labels[v]} 1\n" for v in self.neighbors(u) if u < v)
+
+
+def swap_edges_markov_chain(graph: SwapGraph, num: int, tries: int, rng: np.random.Generator):
+    """The markov style edge swapping of `pmotif_lib.randomization.swap_edges_markov_chain`, on a `SwapGraph`:
+    `num` times, every edge src-dst (in both directions) is swapped with the edge of a random node and
+    a random neighbor of it, making up to `tries` attempts to find a swap which keeps the graph simple.
+    Random numbers are drawn from `rng` in blocks, and the graph is updated in place, without method calls."""
+    node_count = graph.node_count
+    degrees, offsets, slots, positions = graph.degrees, graph.offsets, graph.slots, graph.positions
+    uniforms = iter(())
+
+    for _ in range(num):
+        for src in range(node_count):
+            src_key = src * node_count
+            for dst in slots[offsets[src]:offsets[src] + degrees[src]]:
+                dst_key = dst * node_count
+                for _ in range(tries):
+                    try:
+                        draw = next(uniforms)
+                    except StopIteration:
+                        uniforms = iter(rng.random(RANDOM_BLOCK).tolist())
+                        draw = next(uniforms)
+                    new_src = int(draw * node_count)
+                    if degrees[new_src] == 0:
+                        continue
+                    if new_src == src or new_src == dst or new_src * node_count + dst in positions:
+                        continue
+
+                    # Reuse the fraction of the draw below the chosen node, uniform in [0, 1) as well
+                    new_dst_slot = offsets[new_src] + int((draw * node_count - new_src) * degrees[new_src])
+                    new_dst = slots[new_dst_slot]
+                    if new_dst == src or new_dst == dst or src_key + new_dst in positions:
+                        continue
+
+                    # Swap src-dst and new_src-new_dst for src-new_dst and new_src-dst
+                    new_src_key = new_src * node_count
+                    new_dst_key = new_dst * node_count
+                    position = positions.pop(src_key + dst)
+                    slots[position] = new_dst
+                    positions[src_key + new_dst] = position
+                    position = positions.pop(dst_key + src)
+                    slots[position] = new_src
+                    positions[dst_key + new_src] = position
+                    positions.pop(new_src_key + new_dst)
+                    slots[new_dst_slot] = dst
+                    positions[new_src_key + dst] = new_dst_slot
+                    position = positions.pop(new_dst_key + new_src)
+                    slots[position] = src
+                    positions[new_dst_key + src] = position
+                    # Stop trying
+                    break
+
+
+def random_graph_seed(seed_sequence: np.random.SeedSequence, index: int) -> int:
+    """Return the seed of the random graph with `index`, independent of the seeds of all other random graphs.
+    Equals the seed of the `index`-th child of `seed_sequence.spawn`, but does not depend on the graphs created before,
+    so an ensemble can be created in parallel, or grown, and still be reproduced."""
+    child = np.random.SeedSequence(seed_sequence.entropy, spawn_key=seed_sequence.spawn_key + (index,))
+    return int.from_bytes(child.generate_state(4).tobytes(), "little")
+
+
+def create_random_graph(template: SwapGraph, out: Path, seed: int, shift: int) -> Dict[str, float]:
+    """Create a random graph from a copy of `template` and write it to `out`.
+    The edgelist is written to a temporary file first, which replaces `out` once complete, so an interrupted
+    process never leaves a partial random graph behind.
+    Returns the wall time, CPU time and peak resident memory of the process creating it."""
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    graph = template.copy()
+    swap_edges_markov_chain(graph, SWAPS_PER_EDGE, TRIES_PER_SWAP, np.random.default_rng(seed))
+    # Outside of `edge_swappings`, where every file counts as a random graph
+    tmp_path = out.parent.parent / f"{out.name}.{os.getpid()}.tmp"
+    graph.write_edgelist(tmp_path, shift=shift)
+    os.replace(tmp_path, out)
+    return {
+        "wall_s": time.perf_counter() - start,
+        "cpu_s": time.process_time() - cpu_start,
+        "children_cpu_s": 0.0,
+        # ru_maxrss is reported in KB, and covers the earlier random graphs of the worker process as well
+        "process_peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "largest_child_peak_rss_mb": 0.0,
+    }
+
+
+# Original graph of a random graph worker process, set by `init_random_graph_worker`
+_template = None
+
+
+def init_random_graph_worker(template: SwapGraph):
+    """Receive the original graph once per worker process, instead of once per random graph."""
+    global _template
+    _template = template
+
+
+def _create_random_graph(args) -> Dict[str, float]:
+    return create_random_graph(_template, *args)
+
+
+def create_random_graphs(
+    pmotif_graph: PMotifGraph,
+    num_random_graphs: int,
+    seed: Optional[int] = None,
+    workers: int = 1,
+) -> Tuple[PMotifGraphWithRandomization, List[Dict[str, float]]]:
+    """Drop-in replacement for `PMotifGraphWithRandomization.create_from_pmotif_graph`, generating the random graphs
+    in `workers` processes. Random graph `i` is written to `edge_swappings/{i}_random.edgelist`, created from its own seed
+    derived from `seed` (random, if None).
+    Only random graphs missing from the first `num_random_graphs` are created, so with the same `seed`,
+    an interrupted or partially deleted ensemble is completed with the same random graphs.
+    Returns the randomized graph and the measurements of creating each new random graph, in order of their index."""
+    if num_random_graphs <= -1:
+        # Do not generate additional graphs
+        return PMotifGraphWithRandomization(pmotif_graph.edgelist_path, pmotif_graph.output_directory), []
+
+    edge_swapped_dir = pmotif_graph.output_directory / PMotifGraphWithRandomization.EDGE_SWAPPED_GRAPH_DIRECTORY_NAME
+    os.makedirs(edge_swapped_dir, exist_ok=True)
+
+    template = SwapGraph.from_edgelist(pmotif_graph.get_graph_path())
+    # Shift node ids above 0, as gtrieScanner requires
+    min_node = min(template.labels)
+    shift = abs(min_node) + 1 if min_node < 1 else 0
+
+    seed_sequence = np.random.SeedSequence(seed)
+    tasks = [
+        (edge_swapped_dir / f"{i}_random.edgelist", random_graph_seed(seed_sequence, i), shift)
+        for i in range(num_random_graphs)
+        if not (edge_swapped_dir / f"{i}_random.edgelist").is_file()
+    ]
+    measurements = []
+    with tqdm(total=len(tasks), desc="Creating Random Graphs", leave=False) as pbar:
+        if workers == 1:
+            init_random_graph_worker(template)
+            for task in tasks:
+                measurements.append(_create_random_graph(task))
+                pbar.update()
+        else:
+            with Pool(processes=workers, initializer=init_random_graph_worker, initargs=(template,)) as pool:
+                for measurement in pool.imap(_create_random_graph, tasks):
+                    measurements.append(measurement)
+                    pbar.update()
+
+    return PMotifGraphWithRandomization(pmotif_graph.edgelist_path, pmotif_graph.output_directory), measurements
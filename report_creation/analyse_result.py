@@ -3,28 +3,45 @@ import argparse
 import json
 import os
 from pathlib import Path
+from typing import List
 
 import report_creation.local_analysis as local_analysis
-from pmotif_cml_interface import add_common_args
+from pmotif_cml_interface import add_common_args, add_workers_arg
 from report_creation.global_analysis import analyse_relevance, get_random_graph_paths, plot_frequency_histogram
 from report_creation.jinja_render import create_report
+from report_creation.rendering import FIGURE_FORMATS, REPORT_FIGURE_FORMAT, FigureRenderer
+from report_creation.util import thumbnail_dpi
 
+EMBEDDED_REPORT = "embedded"
+LINKED_REPORT = "linked"
 
-def run_local_analysis(analysis_out, original):
+
+def run_local_analysis(
+        analysis_out,
+        original,
+        renderer: FigureRenderer,
+        max_outlier_occurrences: int = local_analysis.MAX_OUTLIER_OCCURRENCES,
+):
     """Produce artifacts for the local (un-randomized) scope."""
     print("\nLocal Analysis\n")
     original_frequency = local_analysis.get_frequency_data(original)
-    local_analysis.graphlet_pie_chart(original_frequency, analysis_out)
-    local_analysis.metric_distribution(original, analysis_out)
-    local_analysis.outlier_detection(original, analysis_out)
-
-
-def run_global_analysis(analysis_data: Path, global_out: Path, graphlet_size: int, original: Path):
+    local_analysis.graphlet_pie_chart(original_frequency, analysis_out, renderer)
+    local_analysis.metric_distribution(original, analysis_out, renderer)
+    local_analysis.outlier_detection(original, analysis_out, max_outlier_occurrences)
+
+
+def run_global_analysis(
+        analysis_data: Path,
+        global_out: Path,
+        graphlet_size: int,
+        original: Path,
+        renderer: FigureRenderer,
+):
     """Produce artifacts for the global (randomized) scope."""
     print("\nGlobal Analysis\n")
     random_graphs = get_random_graph_paths(analysis_data)
-    plot_frequency_histogram(global_out, original, random_graphs, graphlet_size)
-    analyse_relevance(global_out, random_graphs, graphlet_size)
+    plot_frequency_histogram(global_out, original, random_graphs, graphlet_size, renderer)
+    analyse_relevance(global_out, random_graphs, graphlet_size, renderer)
 
 
 def dump_meta(analysis_out: Path, edgelist: Path, graphlet_size: int):
@@ -35,13 +52,25 @@ def dump_meta(analysis_out: Path, edgelist: Path, graphlet_size: int):
         }, f, indent=4)
 
 
-def _create_report(analysis_out: Path, local_out: Path, global_out: Path, report_out: Path):
+def _create_report(analysis_out: Path, local_out: Path, global_out: Path, report_out: Path, linked: bool):
     print("\nReport Creation\n")
-    create_report(analysis_out, local_out, global_out, report_out)
-
-
-def main(analysis_out: Path, edgelist: Path, graphlet_size: int):
-    """Create analysis artifacts and report."""
+    create_report(analysis_out, local_out, global_out, report_out, linked=linked)
+
+
+def main(
+        analysis_out: Path,
+        edgelist: Path,
+        graphlet_size: int,
+        workers: int = 1,
+        figure_formats: List[str] = tuple(FIGURE_FORMATS),
+        report_mode: str = EMBEDDED_REPORT,
+        max_outlier_occurrences: int = local_analysis.MAX_OUTLIER_OCCURRENCES,
+):
+    """Create analysis artifacts and report.
+    Figures are rendered by `workers` processes in `figure_formats`, skipping figures whose data did not change.
+    The `report_mode` either embeds all figures into the report, or links thumbnails to the full resolution figures.
+    Outlier files list at most `max_outlier_occurrences` of the most extreme occurrences per threshold."""
+    linked = report_mode == LINKED_REPORT
     analysis_data = analysis_out / edgelist.name / "raw" / str(graphlet_size)
     analysis_out = analysis_out / edgelist.name / "artifacts" / str(graphlet_size)
     os.makedirs(analysis_out, exist_ok=True)
@@ -52,20 +81,60 @@ def main(analysis_out: Path, edgelist: Path, graphlet_size: int):
 
     local_out = analysis_out / "local"
     os.makedirs(local_out, exist_ok=True)
-    run_local_analysis(local_out, original)
-
     global_out = analysis_out / "global"
     os.makedirs(global_out, exist_ok=True)
-    run_global_analysis(analysis_data, global_out, graphlet_size, original)
 
-    _create_report(analysis_out, local_out, global_out, analysis_out / "report.html")
+    with FigureRenderer(
+            analysis_out,
+            workers=workers,
+            formats=figure_formats,
+            thumbnail_dpi=thumbnail_dpi if linked else None,
+    ) as renderer:
+        run_local_analysis(local_out, original, renderer, max_outlier_occurrences)
+        run_global_analysis(analysis_data, global_out, graphlet_size, original, renderer)
+
+    _create_report(analysis_out, local_out, global_out, analysis_out / "report.html", linked)
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--analysis-out", required=True, type=Path)
     add_common_args(parser)
+    add_workers_arg(parser, required=False)
+    parser.add_argument(
+        "--figure-formats",
+        nargs="+",
+        choices=FIGURE_FORMATS,
+        default=FIGURE_FORMATS,
+        help=f"Formats to save figures in. The report requires `{REPORT_FIGURE_FORMAT}`.",
+    )
+    parser.add_argument(
+        "--report-mode",
+        choices=[EMBEDDED_REPORT, LINKED_REPORT],
+        default=EMBEDDED_REPORT,
+        help="`embedded` creates a single, self-contained html file. `linked` references low resolution thumbnails "
+             "next to the report instead, which link to the full resolution figures. "
+             "This keeps the report small, but it has to stay next to the artifacts.",
+    )
+
+    parser.add_argument(
+        "--max-outlier-occurrences",
+        type=int,
+        default=local_analysis.MAX_OUTLIER_OCCURRENCES,
+        help="Number of the most extreme occurrences listed per outlier threshold. "
+             "All occurrences beyond a threshold are still counted.",
+    )
 
     args = parser.parse_args()
-
-    main(args.analysis_out, args.edgelist_path, args.graphlet_size)
+    if REPORT_FIGURE_FORMAT not in args.figure_formats:
+        parser.error(f"--figure-formats has to include `{REPORT_FIGURE_FORMAT}`, which is embedded into the report.")
+
+    main(
+        args.analysis_out,
+        args.edgelist_path,
+        args.graphlet_size,
+        args.workers,
+        args.figure_formats,
+        args.report_mode,
+        args.max_outlier_occurrences,
+    )
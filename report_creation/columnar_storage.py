@@ -0,0 +1,58 @@
+"""Columnar on-disk format for consolidated metrics and graphlet occurrences.
+Each graphlet class is stored as a typed numpy array in its own `.npy` file:
+float64 values for consolidated metrics, and a uint32 node id matrix (one row per occurrence) for graphlet occurrences.
+Arrays are memory-mapped when loaded, instead of being parsed as a whole."""
+import os
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import numpy as np
+from pmotif_lib.graphlet_representation import graphlet_class_to_name, graphlet_name_to_class
+
+JSON_FORMAT = "json"
+COLUMNAR_FORMAT = "columnar"
+STORAGE_FORMATS = [JSON_FORMAT, COLUMNAR_FORMAT]
+
+METRIC_DTYPE = np.float64
+NODE_DTYPE = np.uint32  # Node ids of gtrieScanner are positive, like in the occurrence store
+
+
+def class_array_path(directory: Path, graphlet_class: str) -> Path:
+    """Return the file storing the array of `graphlet_class`."""
+    return directory / f"{graphlet_class_to_name(graphlet_class)}.npy"
+
+
+def write_class_arrays(directory: Path, arrays: Dict[str, np.ndarray]):
+    """Store one array per graphlet class in `directory`."""
+    os.makedirs(directory, exist_ok=True)
+    for graphlet_class, array in arrays.items():
+        np.save(class_array_path(directory, graphlet_class), array)
+
+
+def open_class_array(directory: Path, graphlet_class: str, shape: Tuple[int, ...], dtype) -> np.memmap:
+    """Create the array of `graphlet_class` on disk with the given shape, to be filled incrementally."""
+    os.makedirs(directory, exist_ok=True)
+    return np.lib.format.open_memmap(class_array_path(directory, graphlet_class), mode="w+", dtype=dtype, shape=shape)
+
+
+def read_class_arrays(directory: Path) -> Dict[str, np.ndarray]:
+    """Memory-map all graphlet class arrays stored in `directory`, sorted by graphlet class."""
+    arrays = {
+        graphlet_name_to_class(Path(f).stem): np.load(directory / f, mmap_mode="r")
+        for f in os.listdir(directory)
+        if f.endswith(".npy")
+    }
+    return dict(sorted(arrays.items()))
+
+
+def is_columnar(path: Path) -> bool:
+    """Whether the artifact at `path` is stored in the columnar format (a directory) instead of json (a file)."""
+    return path.is_dir()
+
+
+def to_node_lists(occurrences) -> List[List[str]]:
+    """Return graphlet occurrences as lists of node ids, the way they are stored in json."""
+    if isinstance(occurrences, np.ndarray):
+        return occurrences.astype(str).tolist()
+    return occurrences
+
@@ -7,9 +7,11 @@ import re
 
 import matplotlib.pyplot as plt
 import json
+from matplotlib.figure import Figure
 from pmotif_lib.graphlet_representation import graphlet_classes_from_size, graphlet_class_to_name
 from tqdm import tqdm
 
+from report_creation.rendering import FigureRenderer
 from report_creation.util import get_frequency_data, get_zscore, figsize, dpi, font_size, short_metric_names
 
 plt.rcParams.update({'font.size': font_size})
@@ -19,6 +21,10 @@ RANDOM_GRAPH_DIR_REGEX = re.compile(r"\d+_random\.edgelist")
 ORIGINAL_MISSING_GRAPHLET_CLASS = "ORIGINAL_MISSING_GRAPHLET_CLASS"
 RANDOM_MISSING_GRAPHLET_CLASS = "RANDOM_MISSING_GRAPHLET_CLASS"
 
+# Pairwise comparison results (or a missing graphlet class marker) of each random graph,
+# as a lookup metric_name -> graphlet_class -> result per random graph
+PairwiseTable = Dict[str, Dict[str, List[Union[str, Dict[str, float]]]]]
+
 
 def get_random_graph_paths(analysis_out: Path) -> List[Path]:
     """Return paths pointing to all random graphs found."""
@@ -45,7 +51,32 @@ def split_equal_above_below(value: float, compare_values: List[float]) -> Tuple[
     return equal, above, below
 
 
-def plot_frequency_histogram(analysis_out: Path, original: Path, random_graphs: List[Path], graphlet_size: int):
+def highlighted_histogram_figure(values: List[float], highlight: float, highlight_label: str, title: str, xlabel: str) -> Figure:
+    """Plot the distribution of random graph `values` in a histogram, highlighting the value of the original graph."""
+    fig, ax = plt.subplots(figsize=figsize, dpi=dpi)
+    ax.hist(values, label="Random Graphs")
+    ax.axvline(
+        highlight,
+        color="tab:orange",
+        label=highlight_label,
+    )
+
+    ax.set_title(title)
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel("#")
+    ax.legend()
+
+    fig.tight_layout()
+    return fig
+
+
+def plot_frequency_histogram(
+        analysis_out: Path,
+        original: Path,
+        random_graphs: List[Path],
+        graphlet_size: int,
+        renderer: FigureRenderer,
+):
     """For each graphlet class plot the count of graphlet occurrences per random graph in a histogram.
     Highlight the count of graphlet occurrences in the original graph."""
     graphlet_classes = graphlet_classes_from_size(graphlet_size)
@@ -61,26 +92,16 @@ def plot_frequency_histogram(analysis_out: Path, original: Path, random_graphs:
         highlight = original_frequency[graphlet_class]
         z_score = get_zscore(highlight, frequencies)
 
-        fig, ax = plt.subplots(figsize=figsize, dpi=dpi)
-        ax.hist(frequencies, label="Random Graphs")
-        ax.axvline(
-            highlight,
-            color="tab:orange",
-            label=f"Original",
+        renderer.render(
+            analysis_out / f"{graphlet_class_to_name(graphlet_class)}_frequency",
+            highlighted_histogram_figure,
+            values=frequencies,
+            highlight=highlight,
+            highlight_label="Original",
+            title=graphlet_class_to_name(graphlet_class),
+            xlabel="Occurrence Count",
         )
 
-        ax.set_title(graphlet_class_to_name(graphlet_class))
-        ax.set_xlabel("Occurrence Count")
-        ax.set_ylabel("#")
-        ax.legend()
-
-        fig.tight_layout()
-
-        fig.savefig(analysis_out / f"{graphlet_class_to_name(graphlet_class)}_frequency.png")
-        fig.savefig(analysis_out / f"{graphlet_class_to_name(graphlet_class)}_frequency.pdf")
-        fig.savefig(analysis_out / f"{graphlet_class_to_name(graphlet_class)}_frequency.svg")
-        plt.close(fig)
-
         equal, above, below = split_equal_above_below(highlight, frequencies)
         with open(analysis_out / f"{graphlet_class_to_name(graphlet_class)}_frequency_split.json", "w", encoding="utf-8") as f:
             json.dump({"equal": equal, "above": above, "below": below, "z-score": z_score}, f, indent=4)
@@ -99,28 +120,40 @@ def load_pairwise_data(random_graph: Path, metric_name: str) -> Dict[str, Dict[s
         return json.load(f)
 
 
-def analyse_relevance(analysis_out: Path, random_graphs: List[Path], graphlet_size: int):
+def load_pairwise_table(random_graphs: List[Path], metric_names: List[str]) -> PairwiseTable:
+    """Read the pairwise data of each random graph and metric once, in a single pass over the random graphs.
+    Results per random graph are in the order of `random_graphs`."""
+    table: PairwiseTable = {metric_name: defaultdict(list) for metric_name in metric_names}
+    for random_graph in tqdm(random_graphs, desc="Loading Pairwise Data"):
+        for metric_name in metric_names:
+            for graphlet_class, result in load_pairwise_data(random_graph, metric_name).items():
+                table[metric_name][graphlet_class].append(result)
+    return table
+
+
+def analyse_relevance(analysis_out: Path, random_graphs: List[Path], graphlet_size: int, renderer: FigureRenderer):
     """Create artifacts used to analyse the relevance of a graphlet class in the context of p-motif analysis."""
     graphlet_classes = graphlet_classes_from_size(graphlet_size)
     metric_names = get_metrics(random_graphs[0])
+    table = load_pairwise_table(random_graphs, metric_names)
 
     for metric_name in tqdm(metric_names, desc="Analysing Metric Relevance"):
         os.makedirs(analysis_out / metric_name, exist_ok=True)
         for graphlet_class in tqdm(graphlet_classes, leave=False, desc="Graphlet Class Progress"):
             relevancy_out = analysis_out / metric_name / f"{graphlet_class_to_name(graphlet_class)}_pairwise.json"
             try:
-                pair_wise_data = extract_pairwise_data(
-                    graphlet_class,
-                    metric_name,
-                    random_graphs,
-                )
-                original_median = pair_wise_data["original_median"]
-                sample_median = pair_wise_data["sample_median"]
-                plot_sample_median(analysis_out, metric_name, original_median, sample_median, graphlet_class)
+                pair_wise_data = extract_pairwise_data(table[metric_name].get(graphlet_class, []))
             except ValueError:
                 dump_pairwise_data(relevancy_out, {}, len(random_graphs), error=ORIGINAL_MISSING_GRAPHLET_CLASS)
                 continue
+            if pair_wise_data["original_median"] is None:
+                # No random graph has pairwise data on the graphlet class, so there is nothing to compare
+                dump_pairwise_data(relevancy_out, {}, len(random_graphs), error=RANDOM_MISSING_GRAPHLET_CLASS)
+                continue
 
+            original_median = pair_wise_data["original_median"]
+            sample_median = pair_wise_data["sample_median"]
+            plot_sample_median(analysis_out, metric_name, original_median, sample_median, graphlet_class, renderer)
             dump_pairwise_data(relevancy_out, pair_wise_data, len(random_graphs), error=None)
 
 
@@ -168,61 +201,48 @@ def plot_sample_median(
         original_median: float,
         sample_median: List[float],
         graphlet_class: str,
+        renderer: FigureRenderer,
 ):
     """Plot a median histogram, highlighting the original median."""
-    fig, ax = plt.subplots(figsize=figsize, dpi=dpi)
-    ax.hist(
-        sample_median,
-        label="Random Graphs",
-    )
-    ax.axvline(
-        original_median,
-        color="tab:orange",
-        label=f"Original ({round(original_median, 2)})",
+    renderer.render(
+        analysis_out / metric_name / f"{graphlet_class_to_name(graphlet_class)}_sample_median",
+        highlighted_histogram_figure,
+        values=sample_median,
+        highlight=original_median,
+        highlight_label=f"Original ({round(original_median, 2)})",
+        title=graphlet_class_to_name(graphlet_class),
+        xlabel=f"{short_metric_names[metric_name]} median",
     )
-    ax.set_title(graphlet_class_to_name(graphlet_class))
-    ax.set_xlabel(f"{short_metric_names[metric_name]} median")
-    ax.set_ylabel("#")
-    ax.legend()
-
-    fig.tight_layout()
-
-    fig.savefig(analysis_out / metric_name / f"{graphlet_class_to_name(graphlet_class)}_sample_median.png")
-    fig.savefig(analysis_out / metric_name / f"{graphlet_class_to_name(graphlet_class)}_sample_median.pdf")
-    fig.savefig(analysis_out / metric_name / f"{graphlet_class_to_name(graphlet_class)}_sample_median.svg")
-    plt.close(fig)
 
 
-def extract_pairwise_data(
-        graphlet_class: str, metric_name: str, random_graphs: List[Path],
-) -> Dict[str, Union[float, List[float]]]:
-    """Extract the original median, the p-values, and the medians of all random graphs for a given metrics for the
-    pairwise comparision data and return.
-    Raises a ValueError if the original graph did not contain the specified graphlet class.
-    Skips a random graph, if it does not contain the specified graphlet class,
-    thus reducing the size of p-values and sample medians by one."""
+def extract_pairwise_data(results: List[Union[str, Dict[str, float]]]) -> Dict[str, Union[float, List[float]]]:
+    """Extract the original median, the p-values, and the medians of all random graphs from the pairwise comparison
+    `results` of a metric and graphlet class (one per random graph, see `load_pairwise_table`) and return.
+    Raises a ValueError if the original graph did not contain the graphlet class.
+    Skips a random graph, if it does not contain the graphlet class,
+    thus reducing the size of p-values and sample medians by one.
+    The original median is None, if no random graph contains the graphlet class."""
     original_median = None
     p_values = []
     sample_median = []
     correlation_coefficients = []
-    for r_g in random_graphs:
-        data = load_pairwise_data(r_g, metric_name)
-        if data[graphlet_class] == ORIGINAL_MISSING_GRAPHLET_CLASS:
+    for result in results:
+        if result == ORIGINAL_MISSING_GRAPHLET_CLASS:
             # The original has no occurrence of that graphlet class
             # There are no p-values to extract and no original median
             raise ValueError("Original graph missing graphlet class")
-        if data[graphlet_class] == RANDOM_MISSING_GRAPHLET_CLASS:
+        if result == RANDOM_MISSING_GRAPHLET_CLASS:
             # The current random graph has no occurrence of that graphlet class
             # Skip this graph in the comparison process
             continue
-        sample_median.append(data[graphlet_class]["sample-median"])
-        p_values.append(data[graphlet_class]["p-value"])
-        original_median = data[graphlet_class]["original-median"]  # Same for all graphs
+        sample_median.append(result["sample-median"])
+        p_values.append(result["p-value"])
+        original_median = result["original-median"]  # Same for all graphs
 
         correlation_coefficients.append(calculate_mwu_correlation_coefficient(
-            data[graphlet_class]["u-statistic"],
-            data[graphlet_class]["original-size"],
-            data[graphlet_class]["sample-size"],
+            result["u-statistic"],
+            result["original-size"],
+            result["sample-size"],
         ))
 
     return {
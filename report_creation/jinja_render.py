@@ -1,12 +1,13 @@
 import json
 import os
-from functools import lru_cache
+from functools import lru_cache, partial
 from pathlib import Path
 from typing import Dict
 import base64
 
 from jinja2 import Template
 from pmotif_lib.graphlet_representation import graphlet_classes_from_size, graphlet_class_to_name
+from report_creation.rendering import REPORT_FIGURE_FORMAT, THUMBNAIL_SUFFIX
 from report_creation.util import short_metric_names
 
 
@@ -39,6 +40,11 @@ def get_pairwise_data(global_out: Path, metric: str, graphlet_class: str) -> Dic
         return json.load(f)
 
 
+def to_relative(p: Path, suffix: str, report_out: Path) -> str:
+    """Return the location of the figure `p` with `suffix`, relative to the report."""
+    return Path(os.path.relpath(f"{p}{suffix}", report_out.absolute().parent)).as_posix()
+
+
 def to_base_64(p: Path) -> str:
     """Converts the given image to base64 representation in html"""
     p = Path(str(p) + ".png")
@@ -48,7 +54,14 @@ def to_base_64(p: Path) -> str:
     return f"data:image/png;base64,{encoded_string.decode()}"
 
 
-def create_report(analysis_out: Path, local_out: Path, global_out: Path, report_out: Path):
+def create_report(analysis_out: Path, local_out: Path, global_out: Path, report_out: Path, linked: bool = False):
+    """Render the html report. Figures are embedded as base64, or with `linked`, referenced as thumbnails
+    (see `FigureRenderer`) linking to the full resolution figure, keeping the report small."""
+    if linked:
+        image_src = partial(to_relative, suffix=THUMBNAIL_SUFFIX, report_out=report_out)
+    else:
+        image_src = to_base_64
+
     with open(Path(__file__).parent / "jinja_template.jinja2", "r") as f:
         t = Template(f.read())
 
@@ -71,7 +84,9 @@ def create_report(analysis_out: Path, local_out: Path, global_out: Path, report_
         round=round,
         get_pairwise_data=get_pairwise_data,
         short_metric_names=short_metric_names,
-        to_base_64=to_base_64,
+        linked=linked,
+        image_src=image_src,
+        image_href=partial(to_relative, suffix=f".{REPORT_FIGURE_FORMAT}", report_out=report_out),
     )
 
     with open(report_out, "w") as f:
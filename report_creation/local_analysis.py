@@ -2,16 +2,24 @@ import json
 import os
 from functools import lru_cache
 from pathlib import Path
-from statistics import quantiles
-from typing import Dict, List, Tuple
+from typing import Dict, List
 
+import numpy as np
 from matplotlib import pyplot as plt
+from matplotlib.figure import Figure
 from pmotif_lib.graphlet_representation import graphlet_class_to_name
 from tqdm import tqdm
+from report_creation.rendering import FigureRenderer
+from report_creation.columnar_storage import is_columnar, read_class_arrays, to_node_lists
 from report_creation.util import figsize, dpi, font_size, short_metric_names
 
 plt.rcParams.update({'font.size': font_size})
 
+# Outlier thresholds, by the percentile they cut at
+OUTLIER_PERCENTILES = {"<1%": 1, "<5%": 5, ">95%": 95, ">99%": 99}
+# Number of occurrences listed per outlier threshold, keeping outlier files of hub-heavy graphs small
+MAX_OUTLIER_OCCURRENCES = 100
+
 @lru_cache(maxsize=None)
 def get_frequency_data(p: Path):
     """Load the graphlet class -> occurrence count lookup."""
@@ -19,7 +27,7 @@ def get_frequency_data(p: Path):
         return json.load(frequency)
 
 
-def graphlet_pie_chart(frequency_data: Dict[str, int], analysis_out: Path):
+def pie_figure(frequency_data: Dict[str, int]) -> Figure:
     """Visualize the graphlet classes and their occurrence count in a pie chart."""
     fig, ax = plt.subplots(figsize=figsize, dpi=dpi)
     labels = [graphlet_class_to_name(graphlet_class) for graphlet_class in frequency_data.keys()]
@@ -28,14 +36,30 @@ def graphlet_pie_chart(frequency_data: Dict[str, int], analysis_out: Path):
     ax.legend()
 
     fig.tight_layout()
+    return fig
+
+
+def histogram_figure(values, title: str, xlabel: str) -> Figure:
+    """Plot the distribution of `values` in a histogram."""
+    fig, ax = plt.subplots(figsize=figsize, dpi=dpi)
+    ax.hist(
+        values,
+    )
+    ax.set_title(title)
+
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel("#")
+
+    fig.tight_layout()
+    return fig
+
 
-    fig.savefig(analysis_out / "graphlet_pie.png")
-    fig.savefig(analysis_out / "graphlet_pie.pdf")
-    fig.savefig(analysis_out / "graphlet_pie.svg")
-    plt.close(fig)
+def graphlet_pie_chart(frequency_data: Dict[str, int], analysis_out: Path, renderer: FigureRenderer):
+    """Visualize the graphlet classes and their occurrence count in a pie chart."""
+    renderer.render(analysis_out / "graphlet_pie", pie_figure, frequency_data=frequency_data)
 
 
-def metric_distribution(original: Path, analysis_out: Path):
+def metric_distribution(original: Path, analysis_out: Path, renderer: FigureRenderer):
     """Create histograms for each consolidated metric."""
     if "random" in str(original):
         raise ValueError("Only call this on the original graph compute!")
@@ -43,26 +67,19 @@ def metric_distribution(original: Path, analysis_out: Path):
     for metric_name, graphlet_class_to_metrics in tqdm(metrics.items(), desc="Processing metric distribution"):
         os.makedirs(analysis_out / metric_name, exist_ok=True)
         for graphlet_class, metric_values in graphlet_class_to_metrics.items():
-            fig, ax = plt.subplots(figsize=figsize, dpi=dpi)
-            ax.hist(
-                metric_values,
-            )
             title = graphlet_class_to_name(graphlet_class)
-            ax.set_title(title)
-
-            ax.set_xlabel(short_metric_names[metric_name])
-            ax.set_ylabel("#")
-
-            fig.tight_layout()
-
-            fig.savefig(analysis_out / metric_name / f"{title}.png")
-            fig.savefig(analysis_out / metric_name / f"{title}.pdf")
-            fig.savefig(analysis_out / metric_name / f"{title}.svg")
-            plt.close(fig)
+            renderer.render(
+                analysis_out / metric_name / title,
+                histogram_figure,
+                values=metric_values,
+                title=title,
+                xlabel=short_metric_names[metric_name],
+            )
 
 
-def outlier_detection(original: Path, analysis_out: Path):
-    """Determine outlier thresholds, save thresholds and occurrences beyond those thresholds."""
+def outlier_detection(original: Path, analysis_out: Path, max_occurrences: int = MAX_OUTLIER_OCCURRENCES):
+    """Determine outlier thresholds, save thresholds and the (at most `max_occurrences`) most extreme occurrences
+    beyond those thresholds."""
     if "random" in str(original):
         raise ValueError("Only call this on the original graph compute!")
 
@@ -72,71 +89,78 @@ def outlier_detection(original: Path, analysis_out: Path):
         out = analysis_out / metric_name
         os.makedirs(out, exist_ok=True)
         for graphlet_class, metric_values in graphlet_class_to_metrics.items():
-            occurrence_metric_pairs: List[Tuple[List[str], float]] = list(zip(occurrences[graphlet_class], metric_values))
-            if len(occurrence_metric_pairs) == 0:
+            values = np.asarray(metric_values, dtype=np.float64)
+            if len(values) == 0:
                 continue
 
-            percentile_cuts = get_percentile_cuts(occurrence_metric_pairs)
+            percentile_cuts = get_percentile_cuts(values, max_occurrences)
+            for cut in percentile_cuts.values():
+                cut["occurrences"] = select_occurrences(occurrences[graphlet_class], cut["occurrences"])
             with open(out / f"{graphlet_class_to_name(graphlet_class)}_outliers.json", "w", encoding="utf-8") as outliers:
                 json.dump(percentile_cuts, outliers, indent=4)
 
 
-def get_percentile_cuts(occurrence_metric_tuples: List[Tuple[List[str], float]]):
-    """Compute cut values for 1%, 5%, 95%, 99% and counts each occurrence beyond those thresholds."""
-    metric_values = [v for _, v in occurrence_metric_tuples]
-    if len(metric_values) <= 1:
+def exclusive_percentiles(values: np.ndarray, percentiles: List[int]) -> np.ndarray:
+    """Return the given percentiles (1 to 99) of at least two `values`, exactly as
+    `statistics.quantiles(values, n=100, method="exclusive")` computes them: the order statistics around the rank
+    `p * (len + 1) / 100` (clamped to the first and last pair) are interpolated with the same integer weights.
+    Only the order statistics needed are selected, without sorting all values."""
+    n = 100
+    count = len(values)
+    percentiles = np.asarray(percentiles)
+    j = np.clip(percentiles * (count + 1) // n, 1, count - 1)
+    delta = percentiles * (count + 1) - j * n
+    ordered = np.partition(values, np.unique(np.concatenate((j - 1, j))))
+    return (ordered[j - 1] * (n - delta) + ordered[j] * delta) / n
+
+
+def most_extreme(values: np.ndarray, beyond: np.ndarray, lowest: bool, max_occurrences: int) -> List[int]:
+    """Return the rows of at most `max_occurrences` of the `beyond` rows with the lowest (or highest) values,
+    most extreme first. Ties keep the order of the occurrences."""
+    keys = values[beyond] if lowest else -values[beyond]
+    return beyond[np.argsort(keys, kind="stable")[:max_occurrences]].tolist()
+
+
+def get_percentile_cuts(values: np.ndarray, max_occurrences: int = MAX_OUTLIER_OCCURRENCES) -> Dict[str, Dict]:
+    """Compute cut values for 1%, 5%, 95%, 99% and count the occurrences beyond those thresholds.
+    Occurrences are given as the rows of the (at most `max_occurrences`) most extreme of them, and `truncated`
+    tells whether there are more."""
+    if len(values) <= 1:
         # Can be only one occurrence of a graphlet class, making percentile calculation impossible
-        invalid = {"cut_value": -1, "occurrence_count": 0, "occurrences": []}
-        return {"<1%": invalid, "<5%": invalid, ">95%": invalid, ">99%": invalid}
-
-    percentile_cuts = quantiles(metric_values, n=100, method="exclusive")
-
-    cuts = {
-        "<1%": {
-            "cut_value": round(percentile_cuts[0], 2),
-            "occurrence_count": 0,
-            "occurrences": []
-        },
-        "<5%": {
-            "cut_value": round(percentile_cuts[4], 2),
-            "occurrence_count": 0,
-            "occurrences": []
-        },
-        ">95%": {
-            "cut_value": round(percentile_cuts[-5], 2),
-            "occurrence_count": 0,
-            "occurrences": []
-        },
-        ">99%": {
-            "cut_value": round(percentile_cuts[-1], 2),
-            "occurrence_count": 0,
-            "occurrences": []
-        },
-    }
-
-    for occurrence, v in occurrence_metric_tuples:
-        if v < percentile_cuts[0]:
-            cuts["<1%"]["occurrence_count"] += 1
-            cuts["<1%"]["occurrences"].append(occurrence)
-        if v < percentile_cuts[4]:
-            cuts["<5%"]["occurrence_count"] += 1
-            cuts["<5%"]["occurrences"].append(occurrence)
-        if v > percentile_cuts[-5]:
-            cuts[">95%"]["occurrence_count"] += 1
-            cuts[">95%"]["occurrences"].append(occurrence)
-        if v > percentile_cuts[-1]:
-            cuts[">99%"]["occurrence_count"] += 1
-            cuts[">99%"]["occurrences"].append(occurrence)
+        invalid = {"cut_value": -1, "occurrence_count": 0, "occurrences": [], "truncated": False}
+        return {name: dict(invalid) for name in OUTLIER_PERCENTILES}
+
+    cut_values = exclusive_percentiles(values, list(OUTLIER_PERCENTILES.values()))
+    cuts = {}
+    for (name, percentile), cut_value in zip(OUTLIER_PERCENTILES.items(), cut_values):
+        lowest = percentile < 50
+        beyond = np.flatnonzero(values < cut_value if lowest else values > cut_value)
+        cuts[name] = {
+            "cut_value": round(float(cut_value), 2),
+            "occurrence_count": len(beyond),
+            "occurrences": most_extreme(values, beyond, lowest, max_occurrences),
+            "truncated": len(beyond) > max_occurrences,
+        }
     return cuts
 
 
+def select_occurrences(occurrences, rows: List[int]) -> List[List[str]]:
+    """Return the graphlet occurrences in `rows`, as lists of node ids."""
+    if isinstance(occurrences, np.ndarray):
+        return to_node_lists(occurrences[rows])
+    return [occurrences[row] for row in rows]
+
+
 @lru_cache(maxsize=None)
 def get_graphlet_occurrences(original: Path) -> Dict[str, List[List[int]]]:
     """Load all avaiable metrics from disk, return as a lookup
-    metric_name -> graphlet_class -> values"""
+    metric_name -> graphlet_class -> values
+    Occurrences in the columnar storage format are memory-mapped as a node id matrix per graphlet class."""
     if "random" in str(original):
         raise ValueError("Only call this on the original graph compute!")
 
+    if is_columnar(original / "graphlet_occurrences"):
+        return read_class_arrays(original / "graphlet_occurrences")
     with open(original / "graphlet_occurrences", "r", encoding="utf-8") as occurrences_file:
         return json.load(occurrences_file)
 
@@ -144,7 +168,8 @@ def get_graphlet_occurrences(original: Path) -> Dict[str, List[List[int]]]:
 @lru_cache(maxsize=None)
 def get_metrics(original: Path) -> Dict[str, Dict[str, List[float]]]:
     """Load all available metrics from disk, return as a lookup
-    metric_name -> graphlet_class -> values"""
+    metric_name -> graphlet_class -> values
+    Metrics in the columnar storage format are memory-mapped as an array per graphlet class."""
     if "random" in str(original):
         raise ValueError("Only call this on the original graph compute!")
 
@@ -152,6 +177,9 @@ def get_metrics(original: Path) -> Dict[str, Dict[str, List[float]]]:
 
     metrics = {}
     for f in files:
+        if is_columnar(original / "consolidated_metrics" / f):
+            metrics[f] = read_class_arrays(original / "consolidated_metrics" / f)
+            continue
         with open(original / "consolidated_metrics" / f, "r", encoding="utf-8") as metric_file:
             metrics[f] = json.load(metric_file)
     return metrics
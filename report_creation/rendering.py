@@ -0,0 +1,138 @@
+"""Render report figures in a process pool, in selectable formats,
+skipping figures whose input data did not change since they were last rendered."""
+import hashlib
+import json
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from matplotlib import pyplot as plt
+from matplotlib.figure import Figure
+
+from report_creation.util import figsize, dpi, font_size, write_json_atomically
+
+FIGURE_FORMATS = ["png", "pdf", "svg"]
+# The html report embeds the png version of each figure
+REPORT_FIGURE_FORMAT = "png"
+THUMBNAIL_SUFFIX = ".thumbnail.png"
+RENDER_MANIFEST_NAME = "figures.json"
+
+PlotFunction = Callable[..., Figure]
+
+
+def figure_digest(plot: PlotFunction, data: Dict) -> str:
+    """Return a digest of everything a figure is rendered from."""
+    figure_hash = hashlib.blake2b(digest_size=16)
+    figure_hash.update(json.dumps([plot.__module__, plot.__qualname__, figsize, dpi, font_size]).encode())
+    for name in sorted(data):
+        value = data[name]
+        figure_hash.update(name.encode())
+        if isinstance(value, np.ndarray):
+            figure_hash.update(f"{value.dtype}{value.shape}".encode())
+            figure_hash.update(np.ascontiguousarray(value).tobytes())
+        else:
+            figure_hash.update(json.dumps(value, sort_keys=True, default=str).encode())
+    return figure_hash.hexdigest()
+
+
+def render_figure(stem: Path, plot: PlotFunction, data: Dict, outputs: Dict[str, Dict]):
+    """Create a figure with `plot` once and save it next to `stem` with each output suffix,
+    passing the savefig arguments of that output."""
+    fig = plot(**data)
+    for suffix, savefig_kwargs in outputs.items():
+        fig.savefig(f"{stem}{suffix}", **savefig_kwargs)
+    plt.close(fig)
+
+
+class FigureRenderer:
+    """Render figures in `workers` processes and save them in the given `formats`.
+    With `thumbnail_dpi`, a low resolution png thumbnail is saved alongside, from the same rendered figure.
+    The digest of the data of each saved figure file is kept in a manifest in `out`,
+    so figures with unchanged data are not rendered again.
+
+    Use as a context manager; all figures are rendered when the context exits."""
+
+    def __init__(
+            self,
+            out: Path,
+            workers: int = 1,
+            formats: Sequence[str] = tuple(FIGURE_FORMATS),
+            thumbnail_dpi: Optional[int] = None,
+    ):
+        self.out = out
+        self.workers = workers
+        # Output suffix -> savefig arguments
+        self.outputs: Dict[str, Dict] = {f".{figure_format}": {} for figure_format in formats}
+        if thumbnail_dpi is not None:
+            self.outputs[THUMBNAIL_SUFFIX] = {"dpi": thumbnail_dpi}
+        self.manifest_path = out / RENDER_MANIFEST_NAME
+        self.rendered = 0
+        self.skipped = 0
+
+        self._digests: Dict[str, str] = {}
+        if self.manifest_path.is_file():
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                self._digests = json.load(f)
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._pending: Dict[Future, Tuple[List[str], str]] = {}
+
+    def __enter__(self):
+        if self.workers > 1:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            if exc_type is None:
+                self._collect(len(self._pending))
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown(cancel_futures=exc_type is not None)
+            self._save()
+        if exc_type is None:
+            print(f"Rendered {self.rendered} figures, skipped {self.skipped} unchanged figures.")
+
+    def render(self, stem: Path, plot: PlotFunction, **data):
+        """Render the figure created by `plot(**data)` to `stem` with the suffix of each output."""
+        digest = figure_digest(plot, data)
+        outdated = {
+            suffix: savefig_kwargs for suffix, savefig_kwargs in self.outputs.items()
+            if self._digests.get(self._key(stem, suffix)) != digest or not Path(f"{stem}{suffix}").is_file()
+        }
+        if len(outdated) == 0:
+            self.skipped += 1
+            return
+        keys = [self._key(stem, suffix) for suffix in outdated]
+
+        if self._executor is None:
+            render_figure(stem, plot, data, outdated)
+            self._record(keys, digest)
+            return
+
+        # Bound the figure data waiting in the queue
+        if len(self._pending) >= 4 * self.workers:
+            self._collect(1)
+        self._pending[self._executor.submit(render_figure, stem, plot, data, outdated)] = (keys, digest)
+
+    def _key(self, stem: Path, suffix: str) -> str:
+        return f"{stem.relative_to(self.out)}{suffix}"
+
+    def _record(self, keys: List[str], digest: str):
+        for key in keys:
+            self._digests[key] = digest
+        self.rendered += 1
+
+    def _collect(self, count: int):
+        """Wait for at least `count` pending figures and record them as rendered."""
+        while count > 0 and self._pending:
+            done, _ = wait(self._pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                keys, digest = self._pending.pop(future)
+                future.result()
+                self._record(keys, digest)
+                count -= 1
+
+    def _save(self):
+        """Write the manifest to disk."""
+        write_json_atomically(self.manifest_path, self._digests, indent=4)
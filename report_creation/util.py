@@ -1,4 +1,6 @@
 import json
+import os
+import threading
 from pathlib import Path
 from statistics import mean, stdev
 from typing import List, Dict
@@ -10,15 +12,26 @@ def get_frequency_data(p: Path) -> Dict[str, int]:
         return json.load(frequency)
 
 
+def write_json_atomically(path: Path, data, indent: int = None):
+    """Write `data` as json to `path` through a uniquely named temporary file next to it, which replaces `path`
+    once complete. An interruption never leaves a corrupt file behind, and concurrent writers do not collide."""
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=indent)
+    os.replace(tmp_path, path)
+
+
 def get_zscore(point: float, values: List[float]) -> float:
-    """Calculate the z-score."""
-    if point == 0 and set(values) == {0}:
-        return 0
+    """Calculate the z-score.
+    Without variation in `values` (e.g. fewer than two), it is 0 if `point` equals all of them and undefined (nan) otherwise."""
+    if len(values) < 2 or stdev(values) == 0:
+        return 0 if set(values) == {point} else float("nan")
     return (point - mean(values)) / stdev(values)
 
 
 figsize = (7,6)
 dpi = 500
+thumbnail_dpi = 50
 font_size = 22
 
 short_metric_names = {
@@ -13,11 +13,18 @@ SCRIPT=$MA_ANALYTICS/create_analysis_data.py
 source ./pmotif_lib.env
 WORKERS=$USER_WORKERS  # Overwrite WORKERS taken from pmotif_lib
 
+# Stream if the analysis data would exceed the memory of the allocation
+ANALYSIS_FLAGS=$($PYTHON_EXEC $MA_ANALYTICS/preflight.py \
+    --edgelist-path $DATASET_DIRECTORY/$EDGELIST_NAME \
+    --graphlet-size $GRAPHLET_SIZE \
+    --print-analysis-flags)
+
 # Run
 date >> $LOG_OUT/start_time
 $PYTHON_EXEC $SCRIPT \
     --analysis_out $OUT_BASE/analysis_out \
     --edgelist_name $EDGELIST_NAME \
     --graphlet_size $GRAPHLET_SIZE \
+    $ANALYSIS_FLAGS \
     2> $LOG_OUT/err.log 1> $LOG_OUT/std.log
 date >> $LOG_OUT/end_time
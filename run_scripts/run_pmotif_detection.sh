@@ -13,6 +13,13 @@ SCRIPT=$MA_ANALYTICS/pmotif_detection.py
 
 source ./pmotif_lib.env
 
+# Refuse jobs which would exceed the memory of the allocation
+$PYTHON_EXEC $MA_ANALYTICS/preflight.py \
+    --edgelist-path $DATASET_DIRECTORY/$EDGELIST_NAME \
+    --graphlet-size $GRAPHLET_SIZE \
+    --random-graphs $RANDOM_GRAPHS \
+    > $LOG_OUT/preflight.json 2> $LOG_OUT/preflight_err.log || exit $?
+
 # Run
 date >> $LOG_OUT/start_time
 $PYTHON_EXEC $SCRIPT \
@@ -0,0 +1,29 @@
+# Name args
+LOG_OUT=$1
+EDGELIST_NAME=$2
+GRAPHLET_SIZE=$3
+RANDOM_GRAPHS=$4
+MODE="${@:5}"  # --prepare-only, --shard I/N, or --merge-shards N
+
+source run.env
+# Setup logging
+mkdir -p $LOG_OUT
+
+
+SCRIPT=$MA_ANALYTICS/pmotif_detection.py
+
+source ./pmotif_lib.env
+
+# Run
+date >> $LOG_OUT/start_time
+$PYTHON_EXEC $SCRIPT \
+    --edgelist-path $DATASET_DIRECTORY/$EDGELIST_NAME \
+    --experiment-out $EXPERIMENT_OUT \
+    --graphlet-size $GRAPHLET_SIZE \
+    --random-graphs $RANDOM_GRAPHS \
+    --workers $SLURM_CPUS_PER_TASK \
+    $MODE \
+    2> $LOG_OUT/err.log 1> $LOG_OUT/std.log
+EXIT_CODE=$?
+date >> $LOG_OUT/end_time
+exit $EXIT_CODE
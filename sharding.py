@@ -0,0 +1,80 @@
+"""Split the random graphs of an ensemble into shards, e.g. to process them in the tasks of a SLURM array job."""
+import argparse
+from typing import Callable, Dict, List, NamedTuple, Optional, TypeVar
+
+from pmotif_lib.p_motif_graph import PMotifGraph
+
+T = TypeVar("T")
+
+RANDOM_GRAPH_SUFFIX = "_random"
+
+
+class Shard(NamedTuple):
+    """The `index`-th (0-based) of `count` contiguous slices of an ensemble of random graphs."""
+    index: int
+    count: int
+
+    def __str__(self):
+        return f"{self.index}/{self.count}"
+
+    def bounds(self, total: int) -> range:
+        """Return the indices of the items of this shard, out of `total` items.
+        Slices differ in length by at most one item, and together cover each item exactly once."""
+        return range(self.index * total // self.count, (self.index + 1) * total // self.count)
+
+    def select(self, items: List[T]) -> List[T]:
+        """Return the items of this shard. `items` have to be in the same order for every shard."""
+        bounds = self.bounds(len(items))
+        return items[bounds.start:bounds.stop]
+
+
+def parse_shard(spec: str) -> Shard:
+    """Parse a shard given as `I/N`, such as `3/10` for the fourth of ten shards."""
+    try:
+        index, count = (int(part) for part in spec.split("/"))
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(f"Expected a shard as `I/N`, got `{spec}`") from e
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"Shard index has to be in [0, N) with N > 0, got `{spec}`")
+    return Shard(index, count)
+
+
+def random_graph_index(random_graph: PMotifGraph) -> int:
+    """Return the index of a random graph, taken from its edgelist name `{index}_random.edgelist`."""
+    stem = random_graph.edgelist_path.stem
+    if not stem.endswith(RANDOM_GRAPH_SUFFIX):
+        raise ValueError(f"{random_graph.edgelist_path} is not named like a random graph")
+    return int(stem[:-len(RANDOM_GRAPH_SUFFIX)])
+
+
+def order_random_graphs(random_graphs: List[PMotifGraph]) -> List[PMotifGraph]:
+    """Order random graphs by their index. Directory listings have no defined order,
+    so sharding relies on this to select the same graphs for the same shard on every node."""
+    return sorted(random_graphs, key=random_graph_index)
+
+
+def missing_indices(random_graphs: List[PMotifGraph], count: Optional[int] = None) -> List[int]:
+    """Return the indices missing from an ensemble, whose random graphs are expected to be numbered from 0
+    to `count` - 1. Without a `count`, only gaps below the highest index present are found."""
+    indices = {random_graph_index(random_graph) for random_graph in random_graphs}
+    if count is None:
+        count = max(indices, default=-1) + 1
+    return sorted(set(range(count)) - indices)
+
+
+def incomplete_shards(
+    random_graphs: List[PMotifGraph],
+    count: int,
+    is_complete: Callable[[PMotifGraph], bool],
+) -> Dict[Shard, List[PMotifGraph]]:
+    """Split the ordered `random_graphs` into `count` shards and return the random graphs
+    which are not complete, by shard. Shards without incomplete random graphs are left out."""
+    random_graphs = order_random_graphs(random_graphs)
+    incomplete = {}
+    for index in range(count):
+        shard = Shard(index, count)
+        pending = [random_graph for random_graph in shard.select(random_graphs) if not is_complete(random_graph)]
+        if len(pending) > 0:
+            incomplete[shard] = pending
+    return incomplete
+
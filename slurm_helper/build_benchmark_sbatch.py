@@ -10,7 +10,7 @@ DATASETS = [
     "kaggle_star_wars.edgelist",
     "yeastInter_st.txt",
     "random_graphs/0_barabasi_albert_graph_m_1",
-    "random_graphs/0_barabasi_albert_graph_m_2"
+    "random_graphs/0_barabasi_albert_graph_m_2",
     "random_graphs/0_ferdos_renyi_graph_m_2000",
     "human_cancer_cutoff_0.935.edgelist",
     "human_brain_development_cutoff_0.772.edgelist",
@@ -0,0 +1,111 @@
+"""Script to generate sbatch files for slurm, which spread the random graphs of each dataset
+across the tasks of an array job, and a script to submit them in order:
+a preparing job processes the original graph and creates the random graphs,
+an array job processes one shard of the random graphs per task,
+and a merging job verifies that all shards completed."""
+from pathlib import Path
+from typing import List
+
+LOG_BASE = "/hpi/fs00/home/tim.garrels/masterthesis/logs/data_collection/"
+BATCH_DIRECTORY = Path("sharded_batches")
+
+DATASETS = [
+    "kaggle_so_tags.edgelist",
+    "kaggle_star_wars.edgelist",
+    "yeastInter_st.txt",
+    "human_cancer_cutoff_0.935.edgelist",
+    "human_brain_development_cutoff_0.772.edgelist",
+]
+
+GRAPHLET_SIZES = [3, 4]
+RANDOM_GRAPHS = 1000
+SHARDS = 100
+
+PREAMBLE_LINES = [
+    "#!/bin/bash",
+    "#SBATCH -A renard",
+    "#SBATCH --time=40:00:00",
+]
+PROCESSING_RESOURCES = [
+    "#SBATCH --cpus-per-task=8",
+    "#SBATCH --mem-per-cpu=150G",
+]
+MERGE_RESOURCES = [
+    "#SBATCH --cpus-per-task=1",
+    "#SBATCH --mem-per-cpu=4G",
+]
+
+
+def generate_line(log_path: str, edgelist: Path, graphlet_size: int, random_graphs: int, mode: str):
+    """Create a line for the sbatch file, running a single p-motif detection task in the given `mode`."""
+    return f"./run_sharded_data_collection.sh {log_path} {str(edgelist)} {graphlet_size} {random_graphs} {mode}"
+
+
+def write_batch(path: Path, header: List[str], line: str):
+    """Write an sbatch file running a single line."""
+    with open(path, "w", encoding="utf-8") as sbatch_file:
+        for header_line in PREAMBLE_LINES + header:
+            sbatch_file.write(header_line)
+            sbatch_file.write("\n")
+        sbatch_file.write("\n")
+        sbatch_file.write(line)
+        sbatch_file.write("\n")
+
+
+def main():
+    """Generate the sbatch files of every dataset and graphlet size, and the script submitting them.
+    The first graphlet size creates the random graphs of a dataset, which the other graphlet sizes reuse
+    once they exist."""
+    BATCH_DIRECTORY.mkdir(exist_ok=True)
+    submit_lines = ["#!/bin/bash", "# Submit with `./submit_sharded.sh` from the directory of the sbatch files", ""]
+
+    for dataset_index, dataset in enumerate(DATASETS):
+        edgelist = Path(dataset)
+        random_graphs = RANDOM_GRAPHS
+        for graphlet_size in GRAPHLET_SIZES:
+            log_path = LOG_BASE + str(graphlet_size) + "/" + edgelist.name
+            name = f"{edgelist.name}_{graphlet_size}"
+            job = f"{dataset_index}_{graphlet_size}"
+
+            write_batch(
+                BATCH_DIRECTORY / f"{name}_prepare.batch",
+                PROCESSING_RESOURCES,
+                generate_line(log_path + "/prepare", edgelist, graphlet_size, random_graphs, "--prepare-only"),
+            )
+            write_batch(
+                BATCH_DIRECTORY / f"{name}_shards.batch",
+                PROCESSING_RESOURCES + [f"#SBATCH --array=0-{SHARDS - 1}"],
+                generate_line(
+                    log_path + "/shard_${SLURM_ARRAY_TASK_ID}",
+                    edgelist,
+                    graphlet_size,
+                    -1,
+                    f"--shard ${{SLURM_ARRAY_TASK_ID}}/{SHARDS}",
+                ),
+            )
+            write_batch(
+                BATCH_DIRECTORY / f"{name}_merge.batch",
+                MERGE_RESOURCES,
+                generate_line(log_path + "/merge", edgelist, graphlet_size, -1, f"--merge-shards {SHARDS}"),
+            )
+
+            # Random graphs of the dataset have to exist before a later graphlet size reuses them
+            dependency = ""
+            if random_graphs == -1:
+                dependency = f"--dependency=afterok:$PREPARE_{dataset_index}_{GRAPHLET_SIZES[0]} "
+            submit_lines.extend([
+                f"PREPARE_{job}=$(sbatch --parsable {dependency}{name}_prepare.batch)",
+                f"SHARDS_{job}=$(sbatch --parsable --dependency=afterok:$PREPARE_{job} {name}_shards.batch)",
+                f"sbatch --dependency=afterany:$SHARDS_{job} {name}_merge.batch",
+            ])
+            random_graphs = -1
+
+    submit_path = BATCH_DIRECTORY / "submit_sharded.sh"
+    with open(submit_path, "w", encoding="utf-8") as submit_file:
+        submit_file.write("\n".join(submit_lines))
+        submit_file.write("\n")
+    submit_path.chmod(0o755)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+"""Load results of a (p)motif detection in a single streaming pass over graphlet positions and graphlet metrics,
+keeping only aggregates per graphlet class in memory.
+The constant-memory counterpart to `pmotif_lib.result_transformer.ResultTransformer`."""
+from __future__ import annotations
+
+import json
+import os
+import shutil
+from collections import Counter, defaultdict
+from contextlib import ExitStack
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+from pmotif_lib.graphlet_representation import graphlet_classes_from_size
+from pmotif_lib.p_metric.metric_consolidation import metrics
+from pmotif_lib.p_metric.p_metric import PreComputation
+from pmotif_lib.p_motif_graph import PMotifGraph
+
+from mann_whitney import ValueCounts
+from occurrence_store import load_occurrence_store
+from report_creation.columnar_storage import METRIC_DTYPE, NODE_DTYPE, open_class_array
+
+
+def iter_graphlet_positions(pmotif_graph: PMotifGraph, graphlet_size: int) -> Iterator[Tuple[str, List[str]]]:
+    """Yield graphlet class and nodes of each graphlet occurrence, in the order gtrieScanner found them.
+    Reads the memory-mapped occurrence store block by block, without holding all occurrences in memory."""
+    store = load_occurrence_store(pmotif_graph, graphlet_size)
+    for graphlet_classes, node_lists in store.iter_blocks():
+        yield from zip(graphlet_classes, node_lists)
+
+
+def load_pre_compute(pre_compute_directory: Path) -> PreComputation:
+    """Load all pre-compute values of a pMetric."""
+    pre_compute = {}
+    for name in os.listdir(pre_compute_directory):
+        with open(pre_compute_directory / name, "r", encoding="utf-8") as pre_compute_file:
+            pre_compute[name] = json.load(pre_compute_file)
+    return pre_compute
+
+
+def iter_consolidated_metrics(pmotif_graph: PMotifGraph, graphlet_size: int) -> Iterator[Dict[str, float]]:
+    """Yield all consolidated metrics of each graphlet occurrence, in the order of the graphlet positions.
+    Reads the `graphlet_metrics` files of all pMetrics line by line in lockstep."""
+    pmetric_directory = pmotif_graph.get_pmetric_directory(graphlet_size)
+    pre_computes = {
+        metric_name: load_pre_compute(pmetric_directory / metric_name / "pre_compute")
+        for metric_name in metrics
+    }
+
+    with ExitStack() as stack:
+        graphlet_metric_files = {
+            metric_name: stack.enter_context(
+                open(pmetric_directory / metric_name / "graphlet_metrics", "r", encoding="utf-8")
+            )
+            for metric_name in metrics
+        }
+        for graphlet_metric_file in graphlet_metric_files.values():
+            graphlet_metric_file.readline()  # Skip total used for progress bars
+
+        for lines in zip(*graphlet_metric_files.values()):
+            consolidated = {}
+            for metric_name, line in zip(graphlet_metric_files.keys(), lines):
+                raw_metric = json.loads(line)
+                for consolidation_name, consolidation_method in metrics[metric_name]:
+                    consolidated[consolidation_name] = consolidation_method(raw_metric, pre_computes[metric_name])
+            yield consolidated
+
+
+class OccurrenceSpool:
+    """Write consolidated metrics and nodes of each graphlet occurrence to per graphlet class files while streaming,
+    and assemble them into the json files of `create_analysis_data.dump_consolidated_metrics` and
+    `create_analysis_data.dump_graphlet_occurrences` without loading them."""
+
+    def __init__(self, out: Path):
+        self.out = out
+        self.spool_directory = out / "spool"
+        os.makedirs(self.spool_directory, exist_ok=True)
+        self._stack = ExitStack()
+        self._files = {}
+
+    def add(self, graphlet_class: str, nodes: List[str], consolidated: Dict[str, float]):
+        """Append a graphlet occurrence."""
+        self._file("graphlet_occurrences", graphlet_class).write(json.dumps(nodes) + "\n")
+        for metric_name, value in consolidated.items():
+            self._file(metric_name, graphlet_class).write(json.dumps(value) + "\n")
+
+    def dump(self):
+        """Assemble the spooled values into json files and remove the spool."""
+        self._stack.close()
+        grouped = defaultdict(list)
+        for name, graphlet_class in self._files:
+            grouped[name].append(graphlet_class)
+
+        os.makedirs(self.out / "consolidated_metrics", exist_ok=True)
+        for name, graphlet_classes in grouped.items():
+            target = self.out / name if name == "graphlet_occurrences" else self.out / "consolidated_metrics" / name
+            with open(target, "w", encoding="utf-8") as out:
+                out.write("{")
+                for i, graphlet_class in enumerate(sorted(graphlet_classes)):
+                    out.write(("" if i == 0 else ", ") + json.dumps(graphlet_class) + ": [")
+                    with open(self._spool_path(name, graphlet_class), "r", encoding="utf-8") as spooled:
+                        for j, line in enumerate(spooled):
+                            out.write(("" if j == 0 else ", ") + line.rstrip("\n"))
+                    out.write("]")
+                out.write("}")
+        shutil.rmtree(self.spool_directory)
+
+    def _spool_path(self, name: str, graphlet_class: str) -> Path:
+        return self.spool_directory / f"{name}_{graphlet_class.replace(' ', '_')}"
+
+    def _file(self, name: str, graphlet_class: str):
+        if (name, graphlet_class) not in self._files:
+            self._files[(name, graphlet_class)] = self._stack.enter_context(
+                open(self._spool_path(name, graphlet_class), "w", encoding="utf-8")
+            )
+        return self._files[(name, graphlet_class)]
+
+
+class ColumnarOccurrenceSpool:
+    """Write consolidated metrics and nodes of each graphlet occurrence directly into the per graphlet class
+    arrays of the columnar storage format. Arrays are preallocated on disk from the graphlet class frequencies
+    found by gtrieScanner and filled while streaming."""
+
+    def __init__(self, out: Path, pmotif_graph: PMotifGraph, graphlet_size: int):
+        self.out = out
+        self.graphlet_size = graphlet_size
+        self.frequency = pmotif_graph.load_graphlet_freq_file(graphlet_size)
+        self._stored = Counter()
+        self._arrays = {}
+
+    def add(self, graphlet_class: str, nodes: List[str], consolidated: Dict[str, float]):
+        """Store a graphlet occurrence at the next free row of its graphlet class."""
+        row = self._stored[graphlet_class]
+        self._array(self.out / "graphlet_occurrences", graphlet_class, (self.graphlet_size,), NODE_DTYPE)[row] = nodes
+        for metric_name, value in consolidated.items():
+            self._array(self.out / "consolidated_metrics" / metric_name, graphlet_class, (), METRIC_DTYPE)[row] = value
+        self._stored[graphlet_class] += 1
+
+    def dump(self):
+        """Flush all arrays to disk."""
+        for array in self._arrays.values():
+            array.flush()
+        self._arrays = {}
+
+    def _array(self, directory: Path, graphlet_class: str, row_shape: Tuple[int, ...], dtype):
+        if (directory, graphlet_class) not in self._arrays:
+            self._arrays[(directory, graphlet_class)] = open_class_array(
+                directory, graphlet_class, (self.frequency[graphlet_class], *row_shape), dtype,
+            )
+        return self._arrays[(directory, graphlet_class)]
+
+
+class StreamedResult:
+    """Graphlet class frequencies and consolidated metric distributions of a (p)motif detection result.
+    Distributions are aggregated as value counts per graphlet class while streaming the result from disk,
+    so memory depends on the number of graphlet classes (and distinct metric values), not on the number
+    of graphlet occurrences."""
+
+    def __init__(
+        self,
+        pmotif_graph: PMotifGraph,
+        graphlet_size: int,
+        frequency: Dict[str, int],
+        distributions: Dict[str, Dict[str, ValueCounts]],
+    ):
+        self.pmotif_graph = pmotif_graph
+        self.graphlet_size = graphlet_size
+        self.frequency = frequency
+        self.distributions = distributions
+
+    @property
+    def consolidated_metrics(self) -> List[str]:
+        """Return the names of all consolidated metrics."""
+        return list(self.distributions.keys())
+
+    @staticmethod
+    def load_result(
+        edgelist: Path,
+        out: Path,
+        graphlet_size: int,
+        spool: Optional[Union[OccurrenceSpool, ColumnarOccurrenceSpool]] = None,
+    ) -> StreamedResult:
+        """Stream results of the graph `edgelist` from disk. Every graphlet occurrence is handed to `spool`, if any."""
+        pmotif_graph = PMotifGraph(edgelist, out)
+
+        frequency = Counter()
+        distributions: Dict[str, Dict[str, Counter]] = defaultdict(lambda: defaultdict(Counter))
+        occurrences = zip(
+            iter_graphlet_positions(pmotif_graph, graphlet_size),
+            iter_consolidated_metrics(pmotif_graph, graphlet_size),
+        )
+        for (graphlet_class, nodes), consolidated in occurrences:
+            frequency[graphlet_class] += 1
+            for metric_name, value in consolidated.items():
+                distributions[metric_name][graphlet_class][value] += 1
+            if spool is not None:
+                spool.add(graphlet_class, nodes, consolidated)
+
+        return StreamedResult(
+            pmotif_graph=pmotif_graph,
+            graphlet_size=graphlet_size,
+            frequency={**dict.fromkeys(graphlet_classes_from_size(graphlet_size), 0), **frequency},
+            distributions={
+                metric_name: {graphlet_class: dict(c) for graphlet_class, c in sorted(per_class.items())}
+                for metric_name, per_class in distributions.items()
+            },
+        )
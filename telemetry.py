@@ -0,0 +1,197 @@
+"""Structured benchmark telemetry: stage timings, CPU time, peak memory and graph sizes as JSON lines,
+aggregated to median and interquartile range across benchmarking runs.
+Peak memory is only known for the lifetime of a process, so it is aggregated per run instead of per stage."""
+import argparse
+import json
+import os
+import resource
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Tuple
+
+import numpy as np
+from pmotif_lib.p_motif_graph import PMotifGraph
+
+TELEMETRY_SUFFIX = ".telemetry.jsonl"
+SUMMARY_SUFFIX = ".telemetry_summary.json"
+
+STAGE_RECORD = "stage"
+GRAPH_RECORD = "graph"
+# Measurements of stage records which are aggregated per stage across runs
+STAGE_MEASUREMENTS = ["wall_s", "cpu_s", "children_cpu_s"]
+# Process lifetime peaks of stage records, aggregated as their maximum per run across runs
+PEAK_MEASUREMENTS = ["process_peak_rss_mb", "largest_child_peak_rss_mb"]
+GRAPH_MEASUREMENTS = ["nodes", "edges", "occurrences"]
+
+
+def telemetry_name(edgelist: Path, graphlet_size: int, random_graphs: int) -> str:
+    """Return the name shared by the telemetry files of all benchmarking runs of the same configuration."""
+    return f"{edgelist.stem}_{graphlet_size}_{random_graphs}"
+
+
+def _usage() -> Tuple[float, float, float, float]:
+    """Return the CPU time of this process and of its finished children, the peak resident memory of this process
+    and the largest peak resident memory of a finished child in MB, each since the start of this process."""
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return (
+        own.ru_utime + own.ru_stime,
+        children.ru_utime + children.ru_stime,
+        own.ru_maxrss / 1024,  # ru_maxrss is reported in KB
+        children.ru_maxrss / 1024,
+    )
+
+
+class Telemetry:
+    """Write one JSON record per line to `path`, each tagged with the benchmarking `run`.
+    A repeated run replaces the telemetry of the earlier attempt.
+    Records are flushed as they are written, so an interrupted run keeps the telemetry of its finished stages.
+    Stages may be measured from several threads; CPU time and peak memory are those of the whole process.
+    Peak memory is the peak since the start of the process when the stage ended, not the peak of the stage."""
+
+    def __init__(self, path: Path, run: int):
+        self.path = path
+        self.run = run
+        self._file = open(path, "w", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def record(self, record_type: str, **fields):
+        """Write a record of `record_type` with the given fields."""
+        line = json.dumps({"record": record_type, "run": self.run, **fields})
+        with self._lock:
+            self._file.write(line)
+            self._file.write("\n")
+            self._file.flush()
+
+    @contextmanager
+    def stage(self, graph: str, stage: str, overlapping: bool = False, **fields) -> Iterator[Dict]:
+        """Measure the wall time (`perf_counter`) and CPU time of a stage on `graph`.
+        CPU time of child processes, such as gtrieScanner or worker pools, is counted once they finished,
+        so it includes children of stages running concurrently in other threads.
+        Stages which are `overlapping` with others are recorded without CPU time, as it cannot be told apart.
+        Yields the record of the stage, which holds the measurements once the stage is done."""
+        record = {"graph": graph, "stage": stage, "overlapping": overlapping, **fields}
+        cpu_start, children_cpu_start, _, _ = _usage()
+        start = time.perf_counter()
+        yield record
+        wall = time.perf_counter() - start
+        cpu_end, children_cpu_end, process_peak_rss, largest_child_peak_rss = _usage()
+        record.update(
+            wall_s=wall,
+            cpu_s=cpu_end - cpu_start,
+            children_cpu_s=children_cpu_end - children_cpu_start,
+            process_peak_rss_mb=process_peak_rss,
+            largest_child_peak_rss_mb=largest_child_peak_rss,
+        )
+        if overlapping:
+            del record["cpu_s"], record["children_cpu_s"]
+        self.record(STAGE_RECORD, **record)
+
+    def record_graph(self, graph: str, pmotif_graph: PMotifGraph, graphlet_size: int, nodes: int, edges: int):
+        """Record the size of `graph` and the number of graphlet occurrences found per graphlet class."""
+        frequency = pmotif_graph.load_graphlet_freq_file(graphlet_size)
+        self.record(
+            GRAPH_RECORD,
+            graph=graph,
+            nodes=nodes,
+            edges=edges,
+            occurrences=sum(frequency.values()),
+            occurrences_per_class=frequency,
+        )
+
+
+def load_records(paths: List[Path]) -> List[Dict]:
+    """Load the records of telemetry files, skipping a partially written last line."""
+    records = []
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+    return records
+
+
+def describe(values: List[float]) -> Dict[str, float]:
+    """Return the median and interquartile range of `values`."""
+    q1, median, q3 = np.percentile(values, [25, 50, 75])
+    return {"median": float(median), "iqr": float(q3 - q1), "n": len(values)}
+
+
+def aggregate(records: List[Dict]) -> Dict:
+    """Aggregate the measurements of each stage and graph across runs.
+    Random graphs are aggregated by their index, and additionally pooled over all random graphs.
+    Peak memory is aggregated over the maximum of each run."""
+    stages = defaultdict(lambda: defaultdict(list))
+    graphs = defaultdict(lambda: defaultdict(list))
+    run_peaks = defaultdict(lambda: defaultdict(float))
+    for record in records:
+        if record["record"] == STAGE_RECORD:
+            for measurement in PEAK_MEASUREMENTS:
+                run_peaks[measurement][record["run"]] = max(
+                    run_peaks[measurement][record["run"]], record[measurement]
+                )
+
+        keys = [record["graph"]]
+        if record["graph"].startswith("random_"):
+            keys.append("random")
+        for key in keys:
+            if record["record"] == STAGE_RECORD:
+                for measurement in STAGE_MEASUREMENTS:
+                    if measurement in record:  # Overlapping stages lack CPU time
+                        stages[f"{key}/{record['stage']}"][measurement].append(record[measurement])
+            elif record["record"] == GRAPH_RECORD:
+                for measurement in GRAPH_MEASUREMENTS:
+                    graphs[key][measurement].append(record[measurement])
+
+    return {
+        "runs": sorted({record["run"] for record in records}),
+        "stages": {
+            stage: {measurement: describe(values) for measurement, values in measurements.items()}
+            for stage, measurements in sorted(stages.items())
+        },
+        "graphs": {
+            graph: {measurement: describe(values) for measurement, values in measurements.items()}
+            for graph, measurements in sorted(graphs.items())
+        },
+        "peaks": {measurement: describe(list(peaks.values())) for measurement, peaks in run_peaks.items()},
+    }
+
+
+def summarize(experiment_out: Path, name: str) -> Path:
+    """Aggregate the telemetry files named `name` of all benchmarking run directories in `experiment_out`
+    and write the summary next to the run directories."""
+    summary = aggregate(load_records(sorted(experiment_out.glob(f"*/{name}{TELEMETRY_SUFFIX}"))))
+    summary_path = experiment_out / f"{name}{SUMMARY_SUFFIX}"
+    # Unique temporary file, as runs of the same configuration may finish at the same time
+    tmp_path = summary_path.with_suffix(f".{os.getpid()}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=4)
+    os.replace(tmp_path, summary_path)
+    return summary_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Aggregate the telemetry of benchmarking runs, e.g. after runs finished concurrently."
+    )
+    parser.add_argument("--experiment-out", required=True, type=Path)
+    parser.add_argument("--edgelist-path", required=True, type=Path)
+    parser.add_argument("--graphlet-size", required=True, type=int, choices=[3, 4])
+    parser.add_argument("--random-graphs", required=False, type=int, default=0)
+    args = parser.parse_args()
+
+    print(summarize(args.experiment_out, telemetry_name(args.edgelist_path, args.graphlet_size, args.random_graphs)))
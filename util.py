@@ -1,42 +1,131 @@
+import os
+import resource
+import shutil
+import tempfile
+from array import array
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 from enum import Enum
-from typing import List
+from functools import lru_cache, partial
+from multiprocessing import Pool, get_context
+from multiprocessing.context import BaseContext
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, List, NamedTuple, Optional, Tuple, TypeVar
 
 import networkx as nx
+import numpy as np
 from pmotif_lib.gtrieScanner.wrapper import run_gtrieScanner
 from pmotif_lib.p_metric import p_metric as PMetric
-from pmotif_lib.p_metric.metric_processing import calculate_metrics
+from pmotif_lib.p_metric.metric_processing import process_graphlet_occurrences
+from pmotif_lib.p_metric.p_metric import PreComputation, RawMetric
+from pmotif_lib.p_metric.p_metric_result import PMetricResult
 from pmotif_lib.p_motif_graph import PMotifGraph
+from tqdm import tqdm
 
+from checkpoint import GraphManifest, GRAPHLET_STAGE
+from custom_pmetrics.batched_metric import BatchedPMetric
+from occurrence_store import build_occurrence_store, load_occurrence_store
+
+
+T = TypeVar("T")
+R = TypeVar("R")
 
 GTRIESCANNER_EXECUTABLE = "gtrieScanner"  # in PATH
+# Number of graphlet occurrences handed to a batched pMetric per call
+METRIC_BATCH_SIZE = 10_000
+
+
+class EdgelistFormat(Enum):
+    SIMPLE = "u v"
+    SIMPLE_WEIGHT = "u v weight"
+
+
+FORMAT_BY_COLUMN_COUNT = {2: EdgelistFormat.SIMPLE, 3: EdgelistFormat.SIMPLE_WEIGHT}
+
 
+class EdgelistStats(NamedTuple):
+    """Format and basic statistics of an edgelist file."""
+    edgelist_format: EdgelistFormat
+    node_count: int
+    edge_count: int  # Distinct undirected edges
+    min_node_id: int
+    max_node_id: int
+    self_loops: int
+    duplicate_edges: int  # Edges listed more than once, in either direction
 
-def assert_validity(pmotif_graph: PMotifGraph):
-    """Raises a ValueError of underlying graph is not valid for gtrieScanner input"""
-    nx_graph = pmotif_graph.load_graph()
 
-    if len(list(nx.selfloop_edges(nx_graph))) > 0:
+def validate_edgelist(edgelist: Path) -> EdgelistStats:
+    """Sniff the format of the edgelist and collect its statistics in a single pass over the file,
+    without building a graph. Results are cached for as long as the file does not change.
+    Raises a ValueError if lines have an unexpected or inconsistent number of columns, or non-integer node ids."""
+    edgelist = Path(edgelist).resolve()
+    stat = edgelist.stat()
+    return _validate_edgelist(str(edgelist), stat.st_size, stat.st_mtime_ns)
+
+
+@lru_cache(maxsize=None)
+def _validate_edgelist(edgelist: str, size: int, mtime_ns: int) -> EdgelistStats:
+    """Validate an edgelist, cached by its location, size and modification time."""
+    column_count = None
+    us, vs = array("q"), array("q")
+    with open(edgelist, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            parts = line.split()
+            if len(parts) == 0 or parts[0].startswith("#"):
+                continue  # Empty lines and comments are skipped by networkx, too
+            if column_count is None:
+                if len(parts) not in FORMAT_BY_COLUMN_COUNT:
+                    raise ValueError(f"{edgelist}:{line_number} has {len(parts)} columns, expected 2 or 3!")
+                column_count = len(parts)
+            elif len(parts) != column_count:
+                raise ValueError(
+                    f"{edgelist}:{line_number} has {len(parts)} columns, but previous lines have {column_count}!"
+                )
+            try:
+                us.append(int(parts[0]))
+                vs.append(int(parts[1]))
+            except ValueError:
+                raise ValueError(f"{edgelist}:{line_number} contains a non-integer node id!")
+
+    if column_count is None:
+        raise ValueError(f"{edgelist} contains no edges!")
+
+    u, v = np.frombuffer(us, dtype=np.int64), np.frombuffer(vs, dtype=np.int64)
+    nodes = np.unique(np.concatenate((u, v)))
+    # Undirected: (u, v) and (v, u) are the same edge
+    edges = np.unique(np.stack((np.minimum(u, v), np.maximum(u, v)), axis=1), axis=0)
+    return EdgelistStats(
+        edgelist_format=FORMAT_BY_COLUMN_COUNT[column_count],
+        node_count=len(nodes),
+        edge_count=len(edges),
+        min_node_id=int(nodes[0]),
+        max_node_id=int(nodes[-1]),
+        self_loops=int(np.count_nonzero(u == v)),
+        duplicate_edges=len(u) - len(edges),
+    )
+
+
+def assert_validity(pmotif_graph: PMotifGraph) -> EdgelistStats:
+    """Raises a ValueError of underlying graph is not valid for gtrieScanner input.
+    Returns the statistics of the graph."""
+    stats = validate_edgelist(pmotif_graph.get_graph_path())
+
+    if stats.self_loops > 0:
         raise ValueError("Graph contains Self-Loops!")  # Asserts simple graph
 
-    if min(map(int, nx_graph.nodes)) < 1:
+    if stats.min_node_id < 1:
         raise ValueError(
             "Graph contains node ids below '1'!"
         )  # Assert the lowest node index is >= 1
 
+    if stats.duplicate_edges > 0:
+        print(f"Warning: Graph contains {stats.duplicate_edges} duplicate edges!")
 
-class EdgelistFormat(Enum):
-    SIMPLE = "u v"
-    SIMPLE_WEIGHT = "u v weight"
+    return stats
 
 
 def get_edgelist_format(edgelist) -> EdgelistFormat:
-    with open(edgelist, "r", encoding="utf-8") as f:
-        l = f.readline()
-        parts = l.split(" ")
-        if len(parts) == 3:
-            return EdgelistFormat.SIMPLE_WEIGHT
-
-    return EdgelistFormat.SIMPLE
+    return validate_edgelist(edgelist).edgelist_format
 
 
 def process_graph(
@@ -46,11 +135,100 @@ def process_graph(
     edgelist_format: EdgelistFormat,
     workers: int = 1,
     check_validity: bool = True,
+    manifest: Optional[GraphManifest] = None,
 ):
-    """Run a graphlet detection and metric calculation (if any) on the given graph."""
+    """Run a graphlet detection and metric calculation (if any) on the given graph.
+    Stages already completed according to the `manifest` of the graph are skipped."""
+    if manifest is None:
+        manifest = GraphManifest(pmotif_graph, graphlet_size)
+
+    if is_processed(manifest, metrics, edgelist_format):
+        return
+
     if check_validity:
         assert_validity(pmotif_graph)
 
+    detect_graphlets(pmotif_graph, graphlet_size, edgelist_format, manifest)
+    calculate_missing_metrics(pmotif_graph, graphlet_size, metrics, manifest, workers=workers)
+
+
+def process_graphs(
+    pmotif_graphs: List[PMotifGraph],
+    graphlet_size: int,
+    metrics: List[PMetric.PMetric],
+    edgelist_format: EdgelistFormat,
+    workers: int = 1,
+    scan_ahead: int = 1,
+) -> Iterator[PMotifGraph]:
+    """Run a graphlet detection and metric calculation on each of the given graphs, yielding each graph once done.
+    The graphlets of the next `scan_ahead` graphs are detected in the background, while the metrics of the
+    current graph are calculated. Graphs are not checked for validity.
+    Background detections run in processes started by a fork server, not in threads: the metric calculation forks
+    worker pools, and a forked worker would inherit the locks (e.g. the import lock) held by other threads."""
+    detect = partial(detect_graphlets_with_manifest, graphlet_size=graphlet_size, edgelist_format=edgelist_format)
+    for pmotif_graph, manifest in pipelined(pmotif_graphs, detect, scan_ahead, get_context("forkserver")):
+        calculate_missing_metrics(pmotif_graph, graphlet_size, metrics, manifest, workers=workers)
+        yield pmotif_graph
+
+
+def pipelined(
+    items: Iterable[T],
+    stage: Callable[[T], R],
+    lookahead: int,
+    mp_context: Optional[BaseContext] = None,
+) -> Iterator[Tuple[T, R]]:
+    """Yield each item with the result of `stage` on it, in order. `stage` runs in background threads
+    on up to `lookahead` items ahead of the item the caller currently works on, so both overlap.
+    With an `mp_context`, `stage` runs in processes of that context instead, and has to be picklable.
+    Bounding the lookahead bounds the memory and disk space of results waiting to be consumed.
+    With a lookahead of 0, `stage` runs in the calling thread, right before its item is yielded."""
+    if lookahead <= 0:
+        for item in items:
+            yield item, stage(item)
+        return
+
+    items = iter(items)
+    executor: Executor
+    if mp_context is None:
+        executor = ThreadPoolExecutor(max_workers=lookahead)
+    else:
+        executor = ProcessPoolExecutor(max_workers=lookahead, mp_context=mp_context)
+    try:
+        pending = deque((item, executor.submit(stage, item)) for _, item in zip(range(lookahead), items))
+        while len(pending) > 0:
+            item, future = pending.popleft()
+            result = future.result()
+            for next_item in items:  # Refill before yielding, so the next stage overlaps with the caller
+                pending.append((next_item, executor.submit(stage, next_item)))
+                break
+            yield item, result
+    finally:
+        # Do not start stages of items nobody waits for anymore, e.g. after an error
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def is_processed(manifest: GraphManifest, metrics: List[PMetric.PMetric], edgelist_format: EdgelistFormat) -> bool:
+    """Whether the graphlets and all `metrics` of the graph behind `manifest` are complete."""
+    return manifest.is_complete(GRAPHLET_STAGE, edgelist_format=edgelist_format.name) and all(
+        manifest.is_complete(metric.name) for metric in metrics
+    )
+
+
+def detect_graphlets(
+    pmotif_graph: PMotifGraph,
+    graphlet_size: int,
+    edgelist_format: EdgelistFormat,
+    manifest: GraphManifest,
+):
+    """Run gtrieScanner on the given graph, unless its graphlets are already complete, and parse its output into
+    the occurrence store of the graph (see `occurrence_store`).
+    Incomplete or outdated output is removed first, including all pMetrics computed on it."""
+    if manifest.is_complete(GRAPHLET_STAGE, edgelist_format=edgelist_format.name):
+        return
+
+    manifest.reset()
+    shutil.rmtree(pmotif_graph.get_graphlet_output_directory(graphlet_size), ignore_errors=True)
+
     run_gtrieScanner(
         graph_edgelist=pmotif_graph.get_graph_path(),
         gtrieScanner_executable=GTRIESCANNER_EXECUTABLE,
@@ -59,9 +237,126 @@ def process_graph(
         output_directory=pmotif_graph.get_graphlet_directory(),
         with_weights=True if edgelist_format == EdgelistFormat.SIMPLE_WEIGHT else False,
     )
+    build_occurrence_store(pmotif_graph, graphlet_size)
+    manifest.mark_complete(GRAPHLET_STAGE, edgelist_format=edgelist_format.name)
+
 
-    if len(metrics) == 0:
+def detect_graphlets_with_manifest(
+    pmotif_graph: PMotifGraph,
+    graphlet_size: int,
+    edgelist_format: EdgelistFormat,
+) -> GraphManifest:
+    """Run `detect_graphlets` on the given graph and return its manifest."""
+    manifest = GraphManifest(pmotif_graph, graphlet_size)
+    detect_graphlets(pmotif_graph, graphlet_size, edgelist_format, manifest)
+    return manifest
+
+
+def calculate_missing_metrics(
+    pmotif_graph: PMotifGraph,
+    graphlet_size: int,
+    metrics: List[PMetric.PMetric],
+    manifest: GraphManifest,
+    workers: int = 1,
+):
+    """Calculate and store each of `metrics` which is not complete yet.
+    Each metric is stored and recorded as soon as it is done, so an interruption only loses the current metric.
+    Batched pMetrics are calculated block-wise on the memory-mapped occurrence store, all others occurrence by
+    occurrence."""
+    missing_metrics = [metric for metric in metrics if not manifest.is_complete(metric.name)]
+    if len(missing_metrics) == 0:
         return
 
-    calculate_metrics(pmotif_graph, graphlet_size, metrics, True, workers=workers)
+    graph = nx.readwrite.edgelist.read_edgelist(
+        pmotif_graph.get_graph_path(), data=False, create_using=nx.Graph
+    )
+    store = load_occurrence_store(pmotif_graph, graphlet_size)
+    graphlet_occurrences = None
+
+    metric_output = pmotif_graph.get_pmetric_directory(graphlet_size)
+    for metric in missing_metrics:
+        if isinstance(metric, BatchedPMetric):
+            metric_result = process_batched_metric(graph, store.nodes, metric, workers=workers)
+        else:
+            if graphlet_occurrences is None:
+                graphlet_occurrences = store.graphlet_occurrences()
+            metric_result, = process_graphlet_occurrences(graph, graphlet_occurrences, [metric], workers=workers)
+
+        shutil.rmtree(metric_output / metric.name, ignore_errors=True)  # Remove partial output
+        os.makedirs(metric_output, exist_ok=True)
+        metric_result.save_to_disk(metric_output)
+        manifest.mark_complete(metric.name)
+
+
+# Batched pMetric and its pre-computation of a batched pMetric worker process, set by `init_batch_worker`
+_batch_worker_args = None
+
+
+def init_batch_worker(metric: BatchedPMetric, pre_compute: PreComputation):
+    """Receive the arguments shared by all blocks once per worker process, instead of once per block."""
+    global _batch_worker_args
+    _batch_worker_args = (metric, pre_compute)
+
+
+def calculate_batch(occurrences: np.ndarray) -> List[RawMetric]:
+    """Calculate the batched pMetric of a worker process on a block of graphlet occurrences."""
+    metric, pre_compute = _batch_worker_args
+    return metric.batch_calculation(None, occurrences, pre_compute)
+
+
+def process_batched_metric(
+    graph: nx.Graph,
+    occurrences: np.ndarray,
+    metric: BatchedPMetric,
+    workers: int = 1,
+) -> PMetricResult:
+    """Calculate a batched pMetric on blocks of `METRIC_BATCH_SIZE` graphlet occurrences, in `workers` processes.
+    `occurrences` is an N x k node id matrix, such as the (memory-mapped) nodes of an occurrence store;
+    only the current blocks are read into memory. Workers do not receive the graph, and share the pre-computed
+    lookups of the metric through memory-mapped files."""
+    pre_compute = metric.pre_computation(graph)
+    blocks = (
+        np.asarray(occurrences[start:start + METRIC_BATCH_SIZE], dtype=np.int64)
+        for start in range(0, len(occurrences), METRIC_BATCH_SIZE)
+    )
+
+    graphlet_metrics = []
+    with tqdm(total=len(occurrences), desc="Graphlet Occurrence Progress", leave=False) as pbar:
+        if workers == 1:
+            for block in blocks:
+                graphlet_metrics.extend(metric.batch_calculation(None, block, pre_compute))
+                pbar.update(len(block))
+        else:
+            with tempfile.TemporaryDirectory() as shared_directory:
+                metric.share_pre_computation(Path(shared_directory))
+                with Pool(workers, initializer=init_batch_worker, initargs=(metric, pre_compute)) as pool:
+                    for block_metrics in pool.imap(calculate_batch, blocks):
+                        graphlet_metrics.extend(block_metrics)
+                        pbar.update(len(block_metrics))
+
+    return PMetricResult(metric_name=metric.name, pre_compute=pre_compute, graphlet_metrics=graphlet_metrics)
+
+
+def get_peak_memory_gb() -> float:
+    """Return the peak resident memory of this process or any of its finished children in GB."""
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(own, children) / 1024 ** 2  # ru_maxrss is reported in KB
+
+
+def get_memory_budget_gb() -> Optional[float]:
+    """Return the memory granted to the current SLURM allocation in GB, or None outside of SLURM."""
+    if "SLURM_MEM_PER_NODE" in os.environ:
+        return int(os.environ["SLURM_MEM_PER_NODE"]) / 1024
+    if "SLURM_MEM_PER_CPU" in os.environ:
+        cpus = int(os.environ.get("SLURM_CPUS_PER_TASK", 1))
+        return int(os.environ["SLURM_MEM_PER_CPU"]) * cpus / 1024
+    return None
+
 
+def parallel_graph_count(graph_workers: int, memory_budget: Optional[float], graph_memory: float) -> int:
+    """Limit the number of graphs processed at once, so that `graph_workers` graphs needing
+    `graph_memory` GB each do not exceed `memory_budget` GB (if any)."""
+    if memory_budget is None or graph_memory <= 0:
+        return graph_workers
+    return max(1, min(graph_workers, int(memory_budget // graph_memory)))
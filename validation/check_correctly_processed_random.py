@@ -1,8 +1,9 @@
 """We might process random graphs wrongly by loading them without weights, despite them having weights.
 This script runs the gtrieScanner on the original graph, and one random graph with 3, and one with 4 graphlet size.
 
-And checks whether the stored motif frequency is the same as gtrieScanner computes.
+And checks whether the stored motif frequency (and the occurrence store, if any) is the same as gtrieScanner computes.
 """
+import json
 import os
 import shutil
 import sys
@@ -10,6 +11,7 @@ from pathlib import Path
 from typing import Dict
 from uuid import uuid1
 
+import numpy as np
 from pmotif_lib.gtrieScanner.wrapper import run_gtrieScanner
 from pmotif_lib.gtrieScanner.parsing import parse_graphlet_detection_results_table
 
@@ -50,6 +52,31 @@ def original_motif_freq(dataset: Path, k: int):
     return parse_graphlet_detection_results_table(motif_freq_file, k=k)
 
 
+def stored_motif_freq(graphlet_out: Path) -> Dict[str, int]:
+    """Returns the motif frequency counted from the memory-mapped class codes of the occurrence store
+    (see `occurrence_store.py`), or an empty lookup if there is no store."""
+    store = graphlet_out / "occurrence_store"
+    if not (store / "store.json").is_file():
+        return {}
+    with open(store / "store.json", "r") as f:
+        graphlet_classes = json.load(f)["graphlet_classes"]
+    classes = np.load(store / "classes.npy", mmap_mode="r")
+    return dict(zip(graphlet_classes, np.bincount(classes, minlength=len(graphlet_classes)).tolist()))
+
+
+def check_stored_occurrences(correct: Dict[str, int], graphlet_out: Path, dataset: Path, k: int):
+    """Print a mismatch if the occurrence store does not count as many occurrences per class as gtrieScanner."""
+    stored = stored_motif_freq(graphlet_out)
+    for c in stored:
+        if correct.get(c, 0) != stored[c]:
+            print("\t", "MISMATCHED STORED OCCURRENCES")
+            print("\t", c)
+            print("\t", graphlet_out)
+            print("\t", dataset)
+            print("\t", k)
+            break
+
+
 def rerun(dataset: Path, k: int, out: Path):
     """Runs gtriescanner with manually checked weight parameter"""
     weights = detect_weights(dataset)
@@ -78,6 +105,7 @@ def test_correct(dataset: Path, k: int, temp_out: Path):
             print("\t", dataset)
             print("\t", k)
             break
+    check_stored_occurrences(correct, OLD_OUTPUT / dataset.name / f"{dataset.name}_motifs" / str(k), dataset, k)
 
     # Random
     try:
@@ -98,6 +126,7 @@ def test_correct(dataset: Path, k: int, temp_out: Path):
             print("\t", f"Random: {r['graph']}")
             print("\t", k)
             break
+    check_stored_occurrences(correct, r["motif_freq"].parent, dataset, k)
 
 
 def main(dataset: str):
@@ -6,17 +6,33 @@ import sys
 from typing import List
 from tqdm import tqdm
 
+import numpy as np
 
-def is_complete_pmetric_out(pmetric: Path):
+# Class codes of the occurrence store (see `occurrence_store.py`), one per graphlet occurrence
+STORED_CLASSES = Path("occurrence_store") / "classes.npy"
+
+
+def is_complete_pmetric_out(pmetric: Path, occurrence_count: int = None):
+    """Whether the pmetric has as many lines as its header expects, and as graphlet occurrences exist (if known)."""
     with open(pmetric / "graphlet_metrics", "r") as f:
         total_expected = int(f.readline().strip())
 
     file_path_as_str = str(pmetric / "graphlet_metrics")
 
     total = int(subprocess.check_output(['bash','-c', f"wc -l < {file_path_as_str}"]))
+    if occurrence_count is not None and total_expected != occurrence_count:
+        return False
     return total_expected == total - 1
 
 
+def stored_occurrence_count(graphlet_out: Path):
+    """Return the number of graphlet occurrences in the memory-mapped occurrence store, without parsing the
+    gtrieScanner output. Returns None if there is no store, e.g. for output computed before stores existed."""
+    if not (graphlet_out / STORED_CLASSES).is_file():
+        return None
+    return len(np.load(graphlet_out / STORED_CLASSES, mmap_mode="r"))
+
+
 def swapped_graphs_valid(swapped_graphs: List[Path], k: int):
 
     for g in tqdm(swapped_graphs, desc=f"Checking random graphs ({k})"):
@@ -24,7 +40,8 @@ def swapped_graphs_valid(swapped_graphs: List[Path], k: int):
         if not out.exists():
             return False, "Graphlet Size missing!"
 
-        if not all([is_complete_pmetric_out(out / pmetric) for pmetric in os.listdir(out)]):
+        occurrence_count = stored_occurrence_count(g / str(k))
+        if not all([is_complete_pmetric_out(out / pmetric, occurrence_count) for pmetric in os.listdir(out)]):
             return False, "Not all metrics complete!"
     return True, "All good"
 